@@ -79,15 +79,49 @@ WSGI_APPLICATION = 'app.wsgi.application'
 
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql_psycopg2",
+        "ENGINE": "commons.db.backends.postgresql_pool",
         "NAME": "postgres",
         "USER": "postgres",
         "PASSWORD": "pass",
         "HOST": "db",
         "PORT": "5432",
+        # connections are released to the pool at the end of every request
+        "POOL": {
+            "MIN_SIZE": int(os.environ.get("DB_POOL_MIN_SIZE", 1)),
+            "MAX_SIZE": int(os.environ.get("DB_POOL_MAX_SIZE", 10)),
+            "TIMEOUT": 30,
+            "CHECK_INTERVAL": 30,
+        },
+    }
+}
+
+# read replica used by --read-alias of the migration commands
+if os.environ.get("DB_REPLICA_HOST"):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "HOST": os.environ["DB_REPLICA_HOST"],
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_ROUTERS = ["commons.routers.PrimaryReplicaRouter"]
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+# The cache is kept in the database, so consents invalidated by the migration
+# commands or by any web worker are invalidated for all processes. Its table is
+# created with "python manage.py createcachetable".
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
     }
 }
 
+# Seconds for which consent lookups of users are cached
+CONSENT_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
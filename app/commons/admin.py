@@ -0,0 +1,151 @@
+import json
+from datetime import date, timedelta
+
+from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Max, Min, Q, QuerySet
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from phonenumber_field.phonenumber import to_python
+
+
+# below this number of rows counting them exactly is cheap
+EXACT_COUNT_LIMIT = 10000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator using estimates of the planner instead of SELECT COUNT(*) for
+    large querysets on PostgreSQL.
+
+    Whole tables are estimated from pg_class.reltuples and filtered querysets
+    from the number of rows in the plan of EXPLAIN. Querysets estimated below
+    EXACT_COUNT_LIMIT rows and other databases are counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        if connection.vendor == "postgresql":
+            estimate = self._estimate()
+            if estimate >= EXACT_COUNT_LIMIT:
+                return estimate
+        return super().count
+
+    def _estimate(self):
+        query = self.object_list.query
+        with connection.cursor() as cursor:
+            if not query.where:
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                    [self.object_list.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+                return int(row[0]) if row else 0
+            sql, params = query.sql_with_params()
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class RangeDatesQuerySet(QuerySet):
+    """
+    QuerySet returning periods between the first and the last date from dates.
+
+    The date hierarchy of the admin would otherwise select distinct truncated
+    dates of all rows, while the bounds are read from the index on the field.
+    Periods without rows are listed as well.
+    """
+
+    def dates(self, field_name, kind, order="ASC"):
+        bounds = self.aggregate(first=Min(field_name), last=Max(field_name))
+        if bounds["first"] is None:
+            return []
+        first, last = bounds["first"], bounds["last"]
+        if timezone.is_aware(first):
+            first, last = timezone.localtime(first), timezone.localtime(last)
+        periods = list(_periods(first.date(), last.date(), kind))
+        return periods if order == "ASC" else periods[::-1]
+
+
+def _periods(first, last, kind):
+    start, step = _PERIODS.get(kind, _PERIODS["day"])
+    period = start(first)
+    while period <= last:
+        yield period
+        period = step(period)
+
+
+def _next_year(year):
+    return date(year.year + 1, 1, 1)
+
+
+def _next_month(month):
+    return (month + timedelta(days=31)).replace(day=1)
+
+
+def _next_day(day):
+    return day + timedelta(days=1)
+
+
+# first period containing a day and the period after a period by kind
+_PERIODS = {
+    "year": (lambda day: date(day.year, 1, 1), _next_year),
+    "month": (lambda day: day.replace(day=1), _next_month),
+    "day": (lambda day: day, _next_day),
+}
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Admin of tables with millions of rows.
+
+    Pages are counted with EstimatedCountPaginator without the full count, rows
+    are ordered and drilled down by the indexed created field and search_fields
+    are matched exactly, so every query can use an index. Search terms which
+    look like phone numbers are matched as E.164 strings.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    date_hierarchy = "created"
+    ordering = ("-created", "-pk")
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return RangeDatesQuerySet(
+            model=queryset.model, query=queryset.query, using=queryset._db
+        )
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        query = _search_query(self.search_fields, search_term)
+        if not query:
+            return queryset.none(), False
+        return queryset.filter(query), False
+
+
+def _search_query(search_fields, search_term):
+    """
+    Return query matching the search term exactly with any of the fields.
+    """
+    query = Q()
+    for field_name in search_fields:
+        value = _search_value(field_name, search_term)
+        if value is not None:
+            query |= Q(**{field_name: value})
+    return query
+
+
+def _search_value(field_name, search_term):
+    if field_name != "phone":
+        return search_term
+    number = to_python(search_term)
+    if not number or not number.is_valid():
+        return None
+    return number.as_e164
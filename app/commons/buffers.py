@@ -0,0 +1,38 @@
+class WriteBuffer:
+    """
+    Write-behind buffer which passes objects to write in batches.
+
+    A batch is written as soon as batch_size objects are pending, so memory usage
+    is bounded by the batch size and progress is visible in the database while
+    the data is still being processed. Remaining objects are written by flush.
+    A write which skips some objects returns the number of written ones.
+    """
+
+    def __init__(self, write, batch_size):
+        self._write = write
+        self._batch_size = batch_size
+        self._pending = []
+        self.written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def add(self, obj):
+        self._pending.append(obj)
+        if len(self._pending) >= self._batch_size:
+            self.flush()
+
+    def extend(self, objs):
+        for obj in objs:
+            self.add(obj)
+
+    def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        written = self._write(batch)
+        self.written += len(batch) if written is None else written
@@ -0,0 +1,107 @@
+from django.db.backends.postgresql import base, creation
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from commons.db.pool import (
+    CHECK_INTERVAL,
+    MAX_SIZE,
+    MIN_SIZE,
+    TIMEOUT,
+    ConnectionPool,
+    PoolTimeout,
+    close_pools,
+    get_pool,
+)
+
+
+Database = base.Database
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    """
+    Creation of test databases closing idle pooled connections first, which
+    would otherwise keep the test database in use when it is dropped.
+    """
+
+    def _create_test_db(self, verbosity, autoclobber, keepdb=False):
+        close_pools(self.connection.alias)
+        return super()._create_test_db(verbosity, autoclobber, keepdb)
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        close_pools(self.connection.alias)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL backend taking connections from a ConnectionPool of the process
+    instead of opening a new one for every request or thread.
+
+    The pool is configured by the POOL dictionary of the database settings with
+    MIN_SIZE, MAX_SIZE, TIMEOUT and CHECK_INTERVAL keys. Closing the connection
+    releases it to the pool after rolling back an unfinished transaction and
+    discarding its session state, e.g. settings and TEMP tables, while
+    connections which are broken or closed inside an atomic block are discarded.
+    Connections are released to the pool of the params they were opened with,
+    or closed when that pool has been replaced after the params changed.
+    """
+
+    creation_class = DatabaseCreation
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias, conn_params, lambda: self._create_pool(conn_params))
+        try:
+            connection = pool.getconn()
+        except PoolTimeout as error:
+            raise Database.OperationalError(str(error))
+        self._pool_params = conn_params
+        options = self.settings_dict["OPTIONS"]
+        self.isolation_level = options.get(
+            "isolation_level", connection.isolation_level
+        )
+        if self.isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _create_pool(self, conn_params):
+        options = self.settings_dict.get("POOL", {})
+        return ConnectionPool(
+            lambda: Database.connect(**conn_params),
+            _is_alive,
+            min_size=options.get("MIN_SIZE", MIN_SIZE),
+            max_size=options.get("MAX_SIZE", MAX_SIZE),
+            timeout=options.get("TIMEOUT", TIMEOUT),
+            check_interval=options.get("CHECK_INTERVAL", CHECK_INTERVAL),
+            reset=_reset_session,
+        )
+
+    def _close(self):
+        if self.connection is None:
+            return
+        connection = self.connection
+        pool = get_pool(self.alias, self._pool_params)
+        if pool is None:
+            # connection inherited from the parent process or of a closed pool
+            connection.close()
+            return
+        # a connection closed inside an atomic block is still referenced here
+        pool.putconn(connection, discard=self.in_atomic_block)
+
+
+def _reset_session(connection):
+    if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+        connection.rollback()
+    # DISCARD ALL can not run inside a transaction block
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute("DISCARD ALL")
+
+
+def _is_alive(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        connection.rollback()
+    except Database.Error:
+        return False
+    return True
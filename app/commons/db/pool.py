@@ -0,0 +1,227 @@
+import os
+import threading
+import time
+from collections import Counter, deque
+
+
+MIN_SIZE = 1
+MAX_SIZE = 10
+TIMEOUT = 30
+CHECK_INTERVAL = 30
+
+# pools by process id and alias of the database
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no connection has been released within the timeout.
+    """
+
+
+class ConnectionPool:
+    """
+    Thread safe pool of at most max_size open connections created by connect.
+
+    min_size connections are opened with the pool. A thread asking for a
+    connection gets the most recently released one, a new one if there are
+    less than max_size of them, or waits up to timeout seconds for one to be
+    released. Connections idle for check_interval seconds are checked with
+    is_alive before they are handed out. A dead one means the server has
+    restarted or failed over, so all idle connections are closed and new ones
+    are opened to the current server. A connection discarded when it is released
+    can mean the same, so connections idle since then are checked as well.
+    Released connections are reset by the optional reset, e.g. to discard their
+    session state, and discarded if it fails.
+    """
+
+    def __init__(
+        self,
+        connect,
+        is_alive,
+        min_size=MIN_SIZE,
+        max_size=MAX_SIZE,
+        timeout=TIMEOUT,
+        check_interval=CHECK_INTERVAL,
+        reset=None,
+    ):
+        self._connect = connect
+        self._is_alive = is_alive
+        self._reset = reset
+        self.min_size = min_size
+        self.max_size = max_size
+        self._timeout = timeout
+        self._check_interval = check_interval
+        self._idle = deque()
+        self._size = 0
+        self._condition = threading.Condition()
+        self._stats = Counter()
+        # connections released before a connection was discarded are checked
+        self._discarded_at = float("-inf")
+        for _ in range(min_size):
+            self._idle.append((self._connect_new(), time.monotonic()))
+            self._size += 1
+
+    def getconn(self):
+        while True:
+            connection, released = self._take()
+            if connection is None:
+                return self._open()
+            if self._usable(connection, released):
+                self._count("reused")
+                return connection
+            self._count("failed_checks")
+            self._discard(connection)
+            self.close_idle()
+
+    def putconn(self, connection, discard=False):
+        if discard or connection.closed or not self._reset_session(connection):
+            with self._condition:
+                self._discarded_at = time.monotonic()
+            self._discard(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    def close_idle(self):
+        """
+        Close all connections which are not in use.
+        """
+        with self._condition:
+            idle, self._idle = list(self._idle), deque()
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def stats(self):
+        with self._condition:
+            idle = len(self._idle)
+            return dict(
+                self._stats,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                size=self._size,
+                idle=idle,
+                in_use=self._size - idle,
+            )
+
+    def _take(self):
+        """
+        Return idle connection with the time of its release or (None, None) if
+        a new connection can be opened.
+        """
+        deadline = time.monotonic() + self._timeout
+        with self._condition:
+            while not self._idle and self._size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                self._stats["waits"] += 1
+                if remaining <= 0 or not self._condition.wait(remaining):
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"No connection released within {self._timeout} seconds."
+                    )
+            if self._idle:
+                return self._idle.pop()
+            self._size += 1
+        return None, None
+
+    def _open(self):
+        try:
+            return self._connect_new()
+        except Exception:
+            self._forget()
+            raise
+
+    def _usable(self, connection, released):
+        """
+        Return True if the idle connection can be handed out without a check or
+        passes the check.
+        """
+        recent = time.monotonic() - released < self._check_interval
+        return (recent and released > self._discarded_at) or self._is_alive(connection)
+
+    def _reset_session(self, connection):
+        if self._reset is None:
+            return True
+        try:
+            self._reset(connection)
+        except Exception:
+            return False
+        return True
+
+    def _connect_new(self):
+        connection = self._connect()
+        self._count("created")
+        return connection
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        self._count("discarded")
+        self._forget()
+
+    def _forget(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def _count(self, name):
+        with self._condition:
+            self._stats[name] += 1
+
+
+def get_pool(alias, params, create=None):
+    """
+    Return pool of the database alias connecting with params in the current
+    process, create it with create if there is none or return None without
+    create.
+
+    Pools inherited from the parent of a forked process are kept, but never
+    used, because releasing their connections would close them for the parent.
+    A pool created for new params of the alias, e.g. after the test runner has
+    switched to the test database, replaces the pools of the old ones, which
+    are closed.
+    """
+    key = (os.getpid(), alias, repr(sorted(params.items())))
+    with _pools_lock:
+        if key in _pools or create is None:
+            return _pools.get(key)
+        stale = _forget_pools(alias)
+        _pools[key] = create()
+        pool = _pools[key]
+    for old in stale:
+        old.close_idle()
+    return pool
+
+
+def close_pools(alias):
+    """
+    Close idle connections of pools of the database alias in the current
+    process and forget the pools, so connections in use are closed when they
+    are released.
+    """
+    with _pools_lock:
+        stale = _forget_pools(alias)
+    for pool in stale:
+        pool.close_idle()
+
+
+def _forget_pools(alias):
+    pid = os.getpid()
+    keys = [key for key in _pools if key[:2] == (pid, alias)]
+    return [_pools.pop(key) for key in keys]
+
+
+def pool_stats():
+    """
+    Return statistics of pools of the current process by database alias.
+    """
+    pid = os.getpid()
+    with _pools_lock:
+        pools = {
+            alias: pool for (owner, alias, _), pool in _pools.items() if owner == pid
+        }
+    return {alias: pool.stats() for alias, pool in pools.items()}
@@ -0,0 +1,30 @@
+from django.db import models
+
+from commons.utils import normalize_email
+
+
+class EmailKeyField(models.CharField):
+    """
+    Normalized copy of the email field source used as the unique key of a model.
+
+    The key is set from the source whenever the object is inserted or saved,
+    also by bulk_create and the loaders, but not by QuerySet.update, which has
+    to set both fields itself.
+    """
+
+    def __init__(self, *args, source="email", **kwargs):
+        self.source = source
+        kwargs.setdefault("max_length", 254)
+        kwargs.setdefault("default", "")
+        kwargs.setdefault("editable", False)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs["source"] = self.source
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        value = normalize_email(getattr(model_instance, self.source))
+        setattr(model_instance, self.attname, value)
+        return value
@@ -0,0 +1,152 @@
+import heapq
+import mmap
+import tempfile
+from array import array
+from bisect import bisect_left
+
+
+HASH_SIZE = array("q").itemsize
+# bytes taken by a hash while a run is sorted as a list of Python ints
+SORT_ITEM_SIZE = 48
+MEMORY_BUDGET = 64 * 1024 * 1024
+MERGE_BUFFER_SIZE = 64 * 1024
+# hashes sorted at once even with a smaller budget, so tiny budgets spill few runs
+MIN_RUN_SIZE = 64 * 1024
+# runs of the same size merged into one, which bounds the number of open runs
+MERGE_FAN_IN = 16
+
+
+class KeyIndex:
+    """
+    Compact set of string keys stored as a sorted array of 64-bit hashes.
+
+    A key takes 8 bytes instead of a whole str object in a set. When sorting the
+    hashes would take more than memory_budget bytes, they are spilled to
+    temporary files as sorted runs of at least MIN_RUN_SIZE hashes, which are
+    merged into a single file searched through mmap, so the index has a fixed
+    memory footprint. Every MERGE_FAN_IN runs of the same size are merged into
+    one while keys are added, so the number of open files grows logarithmically
+    with the number of keys. Different keys can
+    share a hash, so a key found in the index only may exist and has to be
+    verified by the caller, while a key which is not found certainly does not
+    exist. Hashes are not stable between processes, so the index can not be
+    shared by them.
+    """
+
+    def __init__(self, memory_budget=MEMORY_BUDGET):
+        self._run_size = max(memory_budget // SORT_ITEM_SIZE, MIN_RUN_SIZE)
+        self._hashes = array("q")
+        self._runs = []
+        self._file = None
+        self._mmap = None
+        self._view = None
+        self._size = 0
+
+    @classmethod
+    def build(cls, keys, memory_budget=MEMORY_BUDGET):
+        index = cls(memory_budget)
+        for key in keys:
+            index.add(key)
+        return index.freeze()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, key):
+        hashes = self._hashes if self._mmap is None else self._view
+        key_hash = hash(key)
+        position = bisect_left(hashes, key_hash, 0, self._size)
+        return position < self._size and hashes[position] == key_hash
+
+    @property
+    def spilled(self):
+        return self._mmap is not None
+
+    def add(self, key):
+        self._hashes.append(hash(key))
+        self._size += 1
+        if len(self._hashes) >= self._run_size:
+            self._spill()
+
+    def freeze(self):
+        """
+        Sort hashes added so far, so the index can be searched, and return it.
+        """
+        if not self._runs:
+            self._hashes = array("q", sorted(self._hashes))
+            return self
+        self._spill()
+        self._file = _merge([run for _, run in self._runs])
+        self._runs = []
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap).cast("q")
+        return self
+
+    def close(self):
+        if self._mmap is not None:
+            self._view.release()
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+        for _, run in self._runs:
+            run.close()
+        self._runs = []
+
+    def _spill(self):
+        if not self._hashes:
+            return
+        run = tempfile.TemporaryFile()
+        array("q", sorted(self._hashes)).tofile(run)
+        run.seek(0)
+        self._runs.append((0, run))
+        self._hashes = array("q")
+        self._merge_full_level()
+
+    def _merge_full_level(self):
+        """
+        Merge runs of a level into a run of the next one when there are
+        MERGE_FAN_IN of them. Runs are kept from the highest level to the lowest,
+        so runs of a full level are always the last ones.
+        """
+        while len(self._runs) >= MERGE_FAN_IN and (
+            len({level for level, _ in self._runs[-MERGE_FAN_IN:]}) == 1
+        ):
+            level = self._runs[-1][0]
+            runs = [run for _, run in self._runs[-MERGE_FAN_IN:]]
+            del self._runs[-MERGE_FAN_IN:]
+            self._runs.append((level + 1, _merge(runs)))
+
+
+def _merge(runs):
+    """
+    Merge sorted runs into a new temporary file and close them.
+    """
+    merged_file = tempfile.TemporaryFile()
+    merged = array("q")
+    for value in heapq.merge(*[_read_run(run) for run in runs]):
+        merged.append(value)
+        if len(merged) >= MERGE_BUFFER_SIZE:
+            merged.tofile(merged_file)
+            merged = array("q")
+    merged.tofile(merged_file)
+    merged_file.flush()
+    merged_file.seek(0)
+    for run in runs:
+        run.close()
+    return merged_file
+
+
+def _read_run(run):
+    while True:
+        hashes = array("q")
+        data = run.read(MERGE_BUFFER_SIZE * HASH_SIZE)
+        if not data:
+            return
+        hashes.frombytes(data)
+        yield from hashes
@@ -0,0 +1,131 @@
+import csv
+import io
+
+from django.db import connection
+
+from commons.utils import chunked
+
+
+class BulkCreateLoader:
+    """
+    Loader responsible for inserting objects with bulk_create.
+
+    With ignore_conflicts objects violating a unique constraint of the table are
+    skipped by the database instead of failing the batch and number of inserted
+    objects is returned, which bulk_create does not tell.
+    """
+
+    def __init__(self, model, batch_size, ignore_conflicts=False):
+        self._model = model
+        self._batch_size = batch_size
+        self._ignore_conflicts = ignore_conflicts
+
+    def __call__(self, objs):
+        if self._ignore_conflicts:
+            return _insert_ignoring_conflicts(self._model, objs, self._batch_size)
+        self._model.objects.bulk_create(objs, self._batch_size)
+        return None
+
+
+class CopyLoader(BulkCreateLoader):
+    """
+    Loader responsible for streaming objects to PostgreSQL with COPY FROM STDIN.
+
+    Values are prepared the same way as for an INSERT, so fields like created
+    and phone numbers are stored the same as with bulk_create, but primary keys
+    are not set on the objects. COPY can not skip conflicts, so with
+    ignore_conflicts objects are copied into a TEMP table and inserted from it
+    with ON CONFLICT DO NOTHING, which returns number of inserted objects. Other
+    databases fall back to bulk_create.
+    """
+
+    def __call__(self, objs):
+        if connection.vendor != "postgresql":
+            return super().__call__(objs)
+        fields = _insert_fields(self._model)
+        columns = _columns(fields)
+        table = connection.ops.quote_name(self._model._meta.db_table)
+        with connection.cursor() as cursor:
+            if not self._ignore_conflicts:
+                cursor.copy_expert(
+                    f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)",
+                    self._rows(objs, fields),
+                )
+                return None
+            staged = connection.ops.quote_name(f"copy_{self._model._meta.db_table}")
+            cursor.execute(
+                f"CREATE TEMP TABLE IF NOT EXISTS {staged} AS "
+                f"SELECT {columns} FROM {table} WITH NO DATA"
+            )
+            cursor.execute(f"TRUNCATE {staged}")
+            cursor.copy_expert(
+                f"COPY {staged} ({columns}) FROM STDIN WITH (FORMAT csv)",
+                self._rows(objs, fields),
+            )
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {staged} "
+                "ON CONFLICT DO NOTHING"
+            )
+            return cursor.rowcount
+
+    def _rows(self, objs, fields):
+        # strings are always quoted, so only None is loaded as NULL
+        rows = io.StringIO()
+        writer = csv.writer(rows, quoting=csv.QUOTE_NONNUMERIC)
+        for obj in objs:
+            writer.writerow(_values(obj, fields))
+        rows.seek(0)
+        return rows
+
+
+class UpsertLoader(BulkCreateLoader):
+    """
+    Loader responsible for inserting objects with INSERT ... ON CONFLICT DO
+    NOTHING.
+
+    Objects violating a unique constraint of the table are always skipped by
+    the database, so objects which already exist do not have to be looked up
+    before they are written. Returns number of inserted objects and does not set
+    their primary keys.
+    """
+
+    def __call__(self, objs):
+        return _insert_ignoring_conflicts(self._model, objs, self._batch_size)
+
+
+def _insert_ignoring_conflicts(model, objs, batch_size):
+    """
+    Insert objects with multi-row INSERTs skipping conflicts, e.g. ON CONFLICT DO
+    NOTHING, and return number of inserted ones.
+    """
+    ops = connection.ops
+    fields = _insert_fields(model)
+    table = ops.quote_name(model._meta.db_table)
+    row = "({})".format(", ".join(["%s"] * len(fields)))
+    inserted = 0
+    with connection.cursor() as cursor:
+        for batch in chunked(objs, min(batch_size, ops.bulk_batch_size(fields, objs))):
+            cursor.execute(
+                f"{ops.insert_statement(ignore_conflicts=True)} {table} "
+                f"({_columns(fields)}) VALUES {', '.join([row] * len(batch))} "
+                f"{ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}",
+                [value for obj in batch for value in _values(obj, fields)],
+            )
+            inserted += cursor.rowcount
+    return inserted
+
+
+def _insert_fields(model):
+    return [field for field in model._meta.concrete_fields if not field.primary_key]
+
+
+def _columns(fields):
+    return ", ".join(connection.ops.quote_name(field.column) for field in fields)
+
+
+def _values(obj, fields):
+    # values are prepared the same way as for an INSERT of bulk_create
+    return [
+        field.get_db_prep_save(field.pre_save(obj, True), connection)
+        for field in fields
+    ]
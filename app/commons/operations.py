@@ -0,0 +1,110 @@
+from django.db.migrations.operations import AddConstraint, AddIndex
+
+
+INDEX_IS_VALID_SQL = (
+    "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)"
+)
+
+
+def drop_invalid_index(schema_editor, name):
+    """
+    Drop index left INVALID by a failed concurrent build, so building it again
+    does not skip it because of IF NOT EXISTS. A valid index is kept.
+    """
+    quoted_name = schema_editor.quote_name(name)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(INDEX_IS_VALID_SQL, [quoted_name])
+        row = cursor.fetchone()
+    if row is not None and not row[0]:
+        schema_editor.execute("DROP INDEX CONCURRENTLY IF EXISTS %s" % quoted_name)
+
+
+def create_concurrently(schema_editor, statement, name, keyword):
+    """
+    Run the CREATE [UNIQUE] INDEX statement concurrently, first dropping an
+    invalid index of the same name left by an earlier failed run.
+    """
+    drop_invalid_index(schema_editor, name)
+    statement.template = statement.template.replace(
+        keyword, keyword + " CONCURRENTLY IF NOT EXISTS", 1
+    )
+    schema_editor.execute(statement)
+
+
+class AddIndexConcurrently(AddIndex):
+    """
+    Create index with CREATE INDEX CONCURRENTLY, so the table is not locked for
+    writes while the index is built on PostgreSQL. Other databases create the
+    index as AddIndex does.
+
+    An index left INVALID by a failed concurrent build is dropped and built again
+    when the migration is retried.
+
+    The migration using it has to be non-atomic, because PostgreSQL does not
+    allow building indexes concurrently inside a transaction.
+    """
+
+    def describe(self):
+        return "Concurrently " + super().describe().lower()
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            return super().database_forwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            statement = self.index.create_sql(model, schema_editor)
+            create_concurrently(
+                schema_editor, statement, self.index.name, "CREATE INDEX"
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            return super().database_backwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.execute(
+                "DROP INDEX CONCURRENTLY IF EXISTS %s"
+                % schema_editor.quote_name(self.index.name)
+            )
+
+
+class AddConstraintConcurrently(AddConstraint):
+    """
+    Create unique constraint with a condition as a unique index built with
+    CREATE UNIQUE INDEX CONCURRENTLY on PostgreSQL, like AddIndexConcurrently.
+    Other databases create the constraint as AddConstraint does.
+
+    Only unique constraints with a condition are created this way, because
+    PostgreSQL stores them as partial unique indexes.
+    """
+
+    def describe(self):
+        return "Concurrently " + super().describe().lower()
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            return super().database_forwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            statement = self.constraint.create_sql(model, schema_editor)
+            create_concurrently(
+                schema_editor, statement, self.constraint.name, "CREATE UNIQUE INDEX"
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            return super().database_backwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.execute(
+                "DROP INDEX CONCURRENTLY IF EXISTS %s"
+                % schema_editor.quote_name(self.constraint.name)
+            )
@@ -0,0 +1,36 @@
+from commons.watermarks import after_watermark
+
+
+def keyset_chunks(queryset, chunk_size, after=None):
+    """
+    Walk queryset ordered by primary key and yield lists with at most chunk_size
+    objects.
+
+    Every chunk is fetched with a separate query filtered by the last seen primary
+    key, so only one chunk is kept in memory and the query stays cheap however
+    deep in the table it is.
+    """
+    queryset = queryset.order_by("pk")
+    while True:
+        page = queryset if after is None else queryset.filter(pk__gt=after)
+        chunk = list(page[:chunk_size])
+        if not chunk:
+            break
+        yield chunk
+        after = chunk[-1].pk
+
+
+def watermark_chunks(queryset, chunk_size, after=None):
+    """
+    Same as keyset_chunks for queryset ordered by (created, pk), which can be
+    served by an index on these columns when the queryset filters created.
+
+    after is the (created, pk) watermark of the last object which is skipped.
+    """
+    queryset = queryset.order_by("created", "pk")
+    while True:
+        chunk = list(after_watermark(queryset, after)[:chunk_size])
+        if not chunk:
+            break
+        yield chunk
+        after = (chunk[-1].created, chunk[-1].pk)
@@ -0,0 +1,142 @@
+import queue
+import threading
+
+from django.db import connection, connections
+
+
+QUEUE_SIZE = 2
+POLL_INTERVAL = 0.1
+
+_DONE = object()
+
+
+class _Stage(threading.Thread):
+    """
+    Thread running a stage of the pipeline, which keeps the raised exception
+    and closes its own database connections at the end. The optional execute
+    wrapper is installed on the default connection of the thread.
+    """
+
+    def __init__(self, target, execute_wrapper=None):
+        super().__init__(daemon=True)
+        self._stage = target
+        self._execute_wrapper = execute_wrapper
+        self.error = None
+
+    def run(self):
+        try:
+            if self._execute_wrapper is None:
+                self._stage()
+                return
+            with connection.execute_wrapper(self._execute_wrapper):
+                self._stage()
+        except BaseException as error:
+            self.error = error
+        finally:
+            connections.close_all()
+
+
+def pipelined(
+    chunks, process, write, queue_size=QUEUE_SIZE, finish=None, execute_wrapper=None
+):
+    """
+    Iterate chunks in a reader thread, pass them to process in the calling thread
+    and results of process to write in a writer thread.
+
+    Stages hand off chunks through queues with at most queue_size items, so the
+    reader prefetches next chunks and the writer writes previous ones while the
+    current one is processed. Django connections are per thread, so every stage
+    uses a separate connection. Results are written in the order of chunks, all
+    stages are finished before returning and errors raised by the reader or the
+    writer are raised again in the calling thread. Optional finish is called in
+    the writer thread after the last result is written, e.g. to commit it.
+    Optional execute_wrapper, e.g. stats of a profiled phase, is installed in
+    the reader and writer threads, whose queries are not seen by wrappers of the
+    calling thread.
+    """
+    _Pipeline(chunks, write, queue_size, finish, execute_wrapper).run(process)
+
+
+class _Pipeline:
+    """
+    Reader and writer stages of pipelined with the queues between them.
+    """
+
+    def __init__(self, chunks, write, queue_size, finish, execute_wrapper):
+        self._chunks = chunks
+        self._write = write
+        self._finish = finish
+        self._chunks_queue = queue.Queue(queue_size)
+        self._results_queue = queue.Queue(queue_size)
+        self._stop = threading.Event()
+        self._reader = _Stage(self._read, execute_wrapper)
+        self._writer = _Stage(self._write_results, execute_wrapper)
+
+    def run(self, process):
+        """
+        Process chunks of the reader in the calling thread until they run out or
+        a stage fails, then finish both stages and raise errors of them.
+        """
+        self._reader.start()
+        self._writer.start()
+        try:
+            self._process(process)
+        finally:
+            self._join()
+        for stage in [self._reader, self._writer]:
+            if stage.error is not None:
+                raise stage.error
+
+    def _process(self, process):
+        while True:
+            chunk = _get(self._chunks_queue, self._reader)
+            if chunk is _DONE:
+                return
+            if not _put(self._results_queue, process(chunk), self._writer_stopped):
+                return
+
+    def _join(self):
+        self._stop.set()
+        _put(self._results_queue, _DONE, self._writer_stopped)
+        self._reader.join()
+        self._writer.join()
+
+    def _writer_stopped(self):
+        return not self._writer.is_alive()
+
+    def _read(self):
+        for chunk in self._chunks:
+            if not _put(self._chunks_queue, chunk, self._stop.is_set):
+                return
+        _put(self._chunks_queue, _DONE, self._stop.is_set)
+
+    def _write_results(self):
+        for result in iter(self._results_queue.get, _DONE):
+            self._write(result)
+        if self._finish is not None:
+            self._finish()
+
+
+def _put(items, item, stopped):
+    """
+    Put item to the queue unless stopped returns True while it is full.
+    """
+    while not stopped():
+        try:
+            items.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(items, producer):
+    """
+    Get item from the queue, return _DONE if the producer has died.
+    """
+    while producer.is_alive() or not items.empty():
+        try:
+            return items.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            pass
+    return _DONE
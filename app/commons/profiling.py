@@ -0,0 +1,163 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+
+class PhaseStats:
+    """
+    Wall time, SQL statistics and numbers of rows of a single phase.
+
+    It is an execute wrapper which can be installed on connections of many
+    threads, e.g. of stages of a pipeline, at the same time.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.wall_time = 0.0
+        self.queries = 0
+        self.sql_time = 0.0
+        self.slowest_sql_time = 0.0
+        self.slowest_sql = None
+        self.rows_read = 0
+        self.rows_written = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add_query(sql, time.perf_counter() - start)
+
+    def add_query(self, sql, duration):
+        with self._lock:
+            self.queries += 1
+            self.sql_time += duration
+            if duration > self.slowest_sql_time:
+                self.slowest_sql_time = duration
+                self.slowest_sql = sql
+
+    def merge(self, report):
+        """
+        Add statistics reported by a worker process, but not its wall time.
+        """
+        self.queries += report["queries"]
+        self.sql_time += report["sql_time"]
+        self.rows_read += report["rows_read"]
+        self.rows_written += report["rows_written"]
+        if report["slowest_sql_time"] > self.slowest_sql_time:
+            self.slowest_sql_time = report["slowest_sql_time"]
+            self.slowest_sql = report["slowest_sql"]
+
+    def report(self):
+        return {
+            "name": self.name,
+            "wall_time": self.wall_time,
+            "queries": self.queries,
+            "sql_time": self.sql_time,
+            "slowest_sql_time": self.slowest_sql_time,
+            "slowest_sql": self.slowest_sql,
+            "rows_read": self.rows_read,
+            "rows_written": self.rows_written,
+            "rows_read_per_second": per_second(self.rows_read, self.wall_time),
+            "rows_written_per_second": per_second(self.rows_written, self.wall_time),
+        }
+
+
+class Profiler:
+    """
+    Profiler responsible for collecting statistics of phases of a command.
+
+    Queries are captured with connection.execute_wrapper, so they are counted
+    also with DEBUG turned off. Connections are per thread, so threads running
+    queries of a phase have to install its stats as their execute wrapper too.
+    Optional extras map names of additional sections of the report to functions
+    returning them, e.g. statistics of connection pools.
+    """
+
+    enabled = True
+
+    def __init__(self, extras=None):
+        self._phases = {}
+        self._extras = extras or {}
+
+    @contextmanager
+    def phase(self, name, capture_queries=True):
+        stats = self._phases.setdefault(name, PhaseStats(name))
+        start = time.perf_counter()
+        try:
+            if capture_queries:
+                with connection.execute_wrapper(stats):
+                    yield stats
+            else:
+                yield stats
+        finally:
+            stats.wall_time += time.perf_counter() - start
+
+    def merge(self, reports):
+        for report in reports:
+            stats = self._phases.setdefault(report["name"], PhaseStats(report["name"]))
+            stats.merge(report)
+
+    def report(self):
+        phases = [stats.report() for stats in self._phases.values()]
+        wall_time = sum(phase["wall_time"] for phase in phases)
+        rows_read = sum(phase["rows_read"] for phase in phases)
+        rows_written = sum(phase["rows_written"] for phase in phases)
+        report = {
+            "phases": phases,
+            "wall_time": wall_time,
+            "queries": sum(phase["queries"] for phase in phases),
+            "sql_time": sum(phase["sql_time"] for phase in phases),
+            "rows_read": rows_read,
+            "rows_written": rows_written,
+            "rows_read_per_second": per_second(rows_read, wall_time),
+            "rows_written_per_second": per_second(rows_written, wall_time),
+        }
+        for name, section in self._extras.items():
+            report[name] = section()
+        return report
+
+    def write(self, output, stdout):
+        """
+        Write JSON report to the file or to stdout if output is "-".
+        """
+        report = json.dumps(self.report(), indent=2)
+        if output == "-":
+            stdout.write(report)
+            return
+        with open(output, "w") as file:
+            file.write(report)
+
+
+class NullProfiler:
+    """
+    Profiler used when profiling is turned off, which collects nothing.
+    """
+
+    enabled = False
+
+    @contextmanager
+    def phase(self, name, capture_queries=True):
+        yield PhaseStats(name)
+
+    def merge(self, reports):
+        pass
+
+    def report(self):
+        return {"phases": []}
+
+
+def per_second(rows, seconds):
+    return rows / seconds if seconds else 0.0
+
+
+def make_profiler(enabled, extras=None):
+    """
+    Return profiler with extra report sections if profiling is enabled, otherwise
+    a profiler which collects nothing.
+    """
+    return Profiler(extras) if enabled else NullProfiler()
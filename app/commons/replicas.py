@@ -0,0 +1,60 @@
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+MAX_LAG = 60
+
+REPLICA_LAG_SQL = """
+SELECT CASE WHEN pg_is_in_recovery()
+    THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    ELSE 0
+END
+"""
+
+
+def replica_lag(alias):
+    """
+    Return seconds since the replica replayed the last transaction of the
+    primary, 0 for a primary and databases other than PostgreSQL.
+    """
+    connection = connections[alias]
+    if connection.vendor != "postgresql":
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(REPLICA_LAG_SQL)
+        return float(cursor.fetchone()[0])
+
+
+def missing_rows(alias, rows):
+    """
+    Return (model, pk) pairs from rows which are not yet on the replica.
+    """
+    return [
+        (model, pk)
+        for model, pk in rows
+        if pk is not None and not model.objects.using(alias).filter(pk=pk).exists()
+    ]
+
+
+def scan_alias(alias, max_lag, rows, warn):
+    """
+    Return alias for scans of rows up to the given (model, pk) pairs.
+
+    The replica is used only if it lags at most max_lag seconds and already has
+    all of the rows, so a scan up to them does not miss any, otherwise warn is
+    called with the reason and the primary is used.
+    """
+    if alias is None:
+        return DEFAULT_DB_ALIAS
+    lag = replica_lag(alias)
+    if lag > max_lag:
+        warn(f"Replica {alias} lags {lag:.0f}s, reading from the primary.")
+        return DEFAULT_DB_ALIAS
+    missing = missing_rows(alias, rows)
+    if missing:
+        model, pk = missing[0]
+        warn(
+            f"Replica {alias} has no {model._meta.label} {pk} yet, "
+            "reading from the primary."
+        )
+        return DEFAULT_DB_ALIAS
+    return alias
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+class PrimaryReplicaRouter:
+    """
+    Router sending all writes to the primary database.
+
+    Reads go where the queryset says, so scans explicitly use a replica with
+    using(), while objects read from it are saved to the primary. Replicas are
+    databases mirroring the primary in tests and are never migrated.
+    """
+
+    def db_for_read(self, model, **hints):
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if is_replica(db):
+            return False
+        return None
+
+
+def is_replica(alias):
+    return settings.DATABASES[alias].get("TEST", {}).get("MIRROR") is not None
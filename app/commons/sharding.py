@@ -0,0 +1,34 @@
+import multiprocessing
+
+from django.db import connections
+from django.db.models import Max, Min
+
+
+def id_ranges(queryset, shards):
+    """
+    Split primary keys of queryset into at most shards disjoint ranges.
+
+    Return list of (start, end) tuples, where start is inclusive and end is
+    exclusive, ordered by start.
+    """
+    bounds = queryset.aggregate(first=Min("pk"), last=Max("pk"))
+    if bounds["first"] is None:
+        return []
+    size = (bounds["last"] - bounds["first"]) // shards + 1
+    return [
+        (start, min(start + size, bounds["last"] + 1))
+        for start in range(bounds["first"], bounds["last"] + 1, size)
+    ]
+
+
+def run_in_processes(func, tasks, workers):
+    """
+    Call func with every tuple of arguments from tasks in a pool of processes.
+
+    Connections are closed before the processes are started, so every process
+    opens its own connection instead of sharing the parent's one. Return results
+    in the order of tasks.
+    """
+    connections.close_all()
+    with multiprocessing.Pool(workers) as pool:
+        return pool.starmap(func, tasks)
@@ -0,0 +1,82 @@
+import csv
+import io
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from commons.utils import lookup_key
+
+
+STAGED_KEYS_TABLE = "staged_keys"
+
+
+class RawSubquery(RawSQL):
+    """
+    Raw SELECT statement used as the right hand side of an IN lookup.
+
+    Lookups already wrap the statement in parentheses, while RawSQL would wrap it
+    again and turn it into a scalar subquery.
+    """
+
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+class StagedKeys:
+    """
+    Session scoped TEMP table with a set of string keys, used instead of long
+    lists of values in IN lookups.
+
+    Keys are loaded with COPY FROM STDIN on PostgreSQL and with INSERT elsewhere
+    into a table with a primary key, which is analyzed after every load, so the
+    database joins it with other tables like any small indexed table instead of
+    parsing and planning every value of the list. Loading keys replaces the ones
+    loaded before and the table lives until the connection is closed or released
+    to the pool.
+    """
+
+    def __init__(self, name=STAGED_KEYS_TABLE):
+        self._table = connection.ops.quote_name(name)
+        self._created = False
+
+    def __call__(self, values):
+        """
+        Load keys of values and return subquery selecting them for IN lookups.
+        """
+        self.load(values)
+        return RawSubquery(f"SELECT key FROM {self._table}", [])
+
+    def load(self, values):
+        keys = {lookup_key(value) for value in values if value is not None}
+        with connection.cursor() as cursor:
+            self._create(cursor)
+            if connection.vendor != "postgresql":
+                cursor.execute(f"DELETE FROM {self._table}")
+                cursor.executemany(
+                    f"INSERT INTO {self._table} (key) VALUES (%s)",
+                    [(key,) for key in keys],
+                )
+                return
+            cursor.execute(f"TRUNCATE {self._table}")
+            cursor.copy_expert(
+                f"COPY {self._table} (key) FROM STDIN WITH (FORMAT csv)",
+                _rows(keys),
+            )
+            cursor.execute(f"ANALYZE {self._table}")
+
+    def _create(self, cursor):
+        if self._created:
+            return
+        cursor.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {self._table} (key text PRIMARY KEY)"
+        )
+        self._created = True
+
+
+def _rows(keys):
+    # quoted empty strings are not loaded as NULL
+    rows = io.StringIO()
+    writer = csv.writer(rows, quoting=csv.QUOTE_ALL)
+    writer.writerows([key] for key in keys)
+    rows.seek(0)
+    return rows
@@ -0,0 +1,50 @@
+from django.test import SimpleTestCase
+
+from mock import patch
+
+from commons.keyindex import KeyIndex
+
+
+class KeyIndexTestCase(SimpleTestCase):
+    @patch("commons.keyindex.MERGE_FAN_IN", 4)
+    @patch("commons.keyindex.MIN_RUN_SIZE", 1)
+    def test_find_keys_of_merged_runs(self):
+        # Arrange
+        keys = [f"email_{number}@test.pl" for number in range(100)]
+
+        # Act
+        with KeyIndex.build(keys, memory_budget=0) as index:
+            # Assert
+            self.assertTrue(index.spilled)
+            self.assertEqual(len(index), 100)
+            self.assertTrue(all(key in index for key in keys))
+            self.assertNotIn("missing@test.pl", index)
+
+    @patch("commons.keyindex.MERGE_FAN_IN", 4)
+    @patch("commons.keyindex.MIN_RUN_SIZE", 1)
+    def test_merge_runs_of_the_same_size_while_adding_keys(self):
+        # Arrange
+        index = KeyIndex(memory_budget=0)
+
+        # Act
+        for number in range(63):
+            index.add(number)
+
+        # Assert
+        # 63 runs of one hash are 3 runs of 16, 3 of 4 and 3 of 1 hashes
+        self.assertEqual(len(index._runs), 9)
+        index.close()
+
+    @patch("commons.keyindex.MIN_RUN_SIZE", 10)
+    def test_keep_minimum_number_of_hashes_in_memory(self):
+        # Arrange
+        index = KeyIndex(memory_budget=0)
+
+        # Act
+        for number in range(9):
+            index.add(number)
+
+        # Assert
+        with index.freeze():
+            self.assertFalse(index.spilled)
+            self.assertIn(8, index)
@@ -0,0 +1,37 @@
+from django.test import TestCase
+
+from commons.loaders import BulkCreateLoader, UpsertLoader
+from user.models import User
+from user.tests.factories import UserFactory
+
+
+class LoadersTestCase(TestCase):
+    def test_return_number_of_users_inserted_without_conflicts(self):
+        # Arrange
+        UserFactory(email="existing@test.pl", phone="")
+        for loader_class in [BulkCreateLoader, UpsertLoader]:
+            with self.subTest(loader=loader_class.__name__):
+                loader = loader_class(User, batch_size=2, ignore_conflicts=True)
+                users = [
+                    User(email=f"{loader_class.__name__}@test.pl", phone=""),
+                    User(email="Existing@Test.pl", phone=""),
+                    User(email=f"other.{loader_class.__name__}@test.pl", phone=""),
+                ]
+
+                # Act
+                inserted = loader(users)
+
+                # Assert
+                self.assertEqual(inserted, 2)
+        self.assertEqual(User.objects.count(), 5)
+
+    def test_return_none_without_ignoring_conflicts(self):
+        # Arrange
+        loader = BulkCreateLoader(User, batch_size=2)
+
+        # Act
+        inserted = loader([User(email="user@test.pl", phone="")])
+
+        # Assert
+        self.assertIsNone(inserted)
+        self.assertTrue(User.objects.filter(email="user@test.pl").exists())
@@ -0,0 +1,73 @@
+from unittest import skipUnless
+
+from django.apps import apps
+from django.db import IntegrityError, connection, models
+from django.db.migrations.state import ProjectState
+from django.test import TransactionTestCase
+
+from commons.operations import (
+    INDEX_IS_VALID_SQL,
+    AddConstraintConcurrently,
+    AddIndexConcurrently,
+)
+from subscriber.tests.factories import SubscriberFactory
+
+
+INDEX_NAME = "subscriber_consent_test_idx"
+
+
+def index_is_valid(name):
+    with connection.cursor() as cursor:
+        cursor.execute(INDEX_IS_VALID_SQL, [connection.ops.quote_name(name)])
+        return cursor.fetchone()[0]
+
+
+def apply(operation):
+    state = ProjectState.from_apps(apps)
+    with connection.schema_editor(atomic=False) as schema_editor:
+        operation.database_forwards("subscriber", schema_editor, state, state)
+
+
+@skipUnless(connection.vendor == "postgresql", "Concurrent indexes need PostgreSQL")
+class ConcurrentOperationsTestCase(TransactionTestCase):
+    def setUp(self):
+        SubscriberFactory.create_batch(2, gdpr_consent=True)
+        # a unique index on duplicated values fails and is left INVALID
+        with self.assertRaises(IntegrityError), connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE UNIQUE INDEX CONCURRENTLY %s "
+                "ON subscriber_subscriber (gdpr_consent)" % INDEX_NAME
+            )
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS %s" % INDEX_NAME)
+
+    def test_index_rebuilds_invalid_index(self):
+        # Arrange
+        operation = AddIndexConcurrently(
+            model_name="subscriber",
+            index=models.Index(fields=["gdpr_consent"], name=INDEX_NAME),
+        )
+
+        # Act
+        apply(operation)
+
+        # Assert
+        self.assertTrue(index_is_valid(INDEX_NAME))
+
+    def test_constraint_retry_fails_on_invalid_index(self):
+        # Arrange
+        operation = AddConstraintConcurrently(
+            model_name="subscriber",
+            constraint=models.UniqueConstraint(
+                fields=["gdpr_consent"], condition=models.Q(id__gt=0), name=INDEX_NAME
+            ),
+        )
+
+        # Act
+        with self.assertRaises(IntegrityError):
+            apply(operation)
+
+        # Assert
+        self.assertFalse(index_is_valid(INDEX_NAME))
@@ -0,0 +1,48 @@
+from django.test import SimpleTestCase
+
+from mock import Mock
+
+from commons.pipeline import pipelined
+
+
+def fail(*args):
+    raise ValueError("stage failed")
+
+
+class PipelinedTestCase(SimpleTestCase):
+    def test_write_processed_chunks_in_order(self):
+        # Arrange
+        written = []
+        finish = Mock()
+
+        # Act
+        pipelined(range(10), lambda chunk: chunk * 2, written.append, finish=finish)
+
+        # Assert
+        self.assertEqual(written, [chunk * 2 for chunk in range(10)])
+        finish.assert_called_once_with()
+
+    def test_raise_error_of_reader(self):
+        # Arrange
+        chunks = map(fail, range(10))
+        write = Mock()
+
+        # Act
+        with self.assertRaisesMessage(ValueError, "stage failed"):
+            pipelined(chunks, lambda chunk: chunk, write)
+
+        # Assert
+        write.assert_not_called()
+
+    def test_raise_error_of_writer(self):
+        # Arrange
+        process = Mock(side_effect=lambda chunk: chunk)
+        finish = Mock()
+
+        # Act
+        with self.assertRaisesMessage(ValueError, "stage failed"):
+            pipelined(range(100), process, fail, finish=finish)
+
+        # Assert
+        finish.assert_not_called()
+        self.assertLess(process.call_count, 100)
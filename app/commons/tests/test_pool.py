@@ -0,0 +1,386 @@
+import threading
+from contextlib import contextmanager
+from unittest import skipUnless
+
+from django.db import connection
+from django.db.backends.postgresql import creation
+from django.test import SimpleTestCase, TransactionTestCase
+
+from mock import Mock, patch
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+
+from commons.db import pool as pool_module
+from commons.db.backends.postgresql_pool.base import Database, DatabaseWrapper
+from commons.db.pool import ConnectionPool, PoolTimeout, get_pool, pool_stats
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.alive = True
+
+    def close(self):
+        self.closed = 1
+
+
+class FakePgConnection(FakeConnection):
+    isolation_level = None
+
+    def __init__(self, **params):
+        super().__init__()
+        self.params = params
+        self.status = TRANSACTION_STATUS_IDLE
+        self.rolled_back = False
+        self.autocommit = False
+        self.executed = []
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rolled_back = True
+
+    @contextmanager
+    def cursor(self):
+        cursor = Mock()
+        cursor.execute.side_effect = self.executed.append
+        yield cursor
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+    def _pool(self, **kwargs):
+        options = dict(min_size=1, max_size=2, timeout=0.1, check_interval=0)
+        options.update(kwargs)
+        return ConnectionPool(FakeConnection, lambda conn: conn.alive, **options)
+
+    def test_open_min_size_connections(self):
+        # Act
+        pool = self._pool(min_size=2)
+
+        # Assert
+        self.assertEqual(pool.stats()["idle"], 2)
+        self.assertEqual(pool.stats()["created"], 2)
+
+    def test_reuse_released_connection(self):
+        # Arrange
+        pool = self._pool()
+        connection = pool.getconn()
+
+        # Act
+        pool.putconn(connection)
+
+        # Assert
+        self.assertIs(pool.getconn(), connection)
+        self.assertEqual(pool.stats()["reused"], 2)
+        self.assertEqual(pool.stats()["in_use"], 1)
+
+    def test_wait_for_released_connection(self):
+        # Arrange
+        pool = self._pool(timeout=5)
+        connections = [pool.getconn(), pool.getconn()]
+        threading.Timer(0.05, pool.putconn, [connections[0]]).start()
+
+        # Act
+        connection = pool.getconn()
+
+        # Assert
+        self.assertIs(connection, connections[0])
+        self.assertGreater(pool.stats()["waits"], 0)
+
+    def test_raise_timeout_when_pool_is_exhausted(self):
+        # Arrange
+        pool = self._pool()
+        pool.getconn()
+        pool.getconn()
+
+        # Act
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+
+        # Assert
+        self.assertEqual(pool.stats()["timeouts"], 1)
+
+    def test_discard_broken_connections(self):
+        # Arrange
+        pool = self._pool()
+        connection = pool.getconn()
+
+        # Act
+        pool.putconn(connection, discard=True)
+
+        # Assert
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()["size"], 0)
+
+    def test_reconnect_all_idle_connections_after_failover(self):
+        # Arrange
+        pool = self._pool(min_size=2)
+        old = [pool.getconn(), pool.getconn()]
+        for released in old:
+            pool.putconn(released)
+            released.alive = False
+
+        # Act
+        connection = pool.getconn()
+
+        # Assert
+        self.assertNotIn(connection, old)
+        self.assertTrue(all(released.closed for released in old))
+        self.assertEqual(pool.stats()["failed_checks"], 1)
+        self.assertEqual(pool.stats()["size"], 1)
+
+    def test_not_check_recently_released_connections(self):
+        # Arrange
+        pool = self._pool(check_interval=60)
+        connection = pool.getconn()
+        pool.putconn(connection)
+        connection.alive = False
+
+        # Act
+        reused = pool.getconn()
+
+        # Assert
+        self.assertIs(reused, connection)
+
+    def test_check_idle_connections_after_discarding_broken_one(self):
+        # Arrange
+        pool = self._pool(min_size=0, check_interval=60)
+        idle, broken = pool.getconn(), pool.getconn()
+        pool.putconn(idle)
+        idle.alive = False
+
+        # Act
+        pool.putconn(broken, discard=True)
+        connection = pool.getconn()
+
+        # Assert
+        self.assertIsNot(connection, idle)
+        self.assertTrue(idle.closed)
+        self.assertEqual(pool.stats()["failed_checks"], 1)
+
+    def test_reset_released_connection(self):
+        # Arrange
+        reset = Mock()
+        pool = self._pool(reset=reset)
+        connection = pool.getconn()
+
+        # Act
+        pool.putconn(connection)
+
+        # Assert
+        reset.assert_called_once_with(connection)
+        self.assertEqual(pool.stats()["idle"], 1)
+
+    def test_discard_connection_which_fails_to_reset(self):
+        # Arrange
+        pool = self._pool(reset=Mock(side_effect=OSError))
+        connection = pool.getconn()
+
+        # Act
+        pool.putconn(connection)
+
+        # Assert
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.stats()["size"], 0)
+
+
+class PoolRegistryTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = patch.object(pool_module, "_pools", {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _create(self):
+        return ConnectionPool(FakeConnection, bool)
+
+    def test_pools_are_created_once_per_process(self):
+        # Arrange
+        first = get_pool("default", {"database": "app"}, self._create)
+
+        # Act
+        second = get_pool(
+            "default", {"database": "app"}, lambda: self.fail("Pool created twice")
+        )
+        with patch("os.getpid", return_value=-1):
+            forked = get_pool("default", {"database": "app"})
+
+        # Assert
+        self.assertIs(first, second)
+        self.assertIsNone(forked)
+        self.assertEqual(pool_stats()["default"]["size"], 1)
+
+    def test_replace_pool_when_params_change(self):
+        # Arrange
+        old = get_pool("default", {"database": "app"}, self._create)
+        idle = old.getconn()
+        old.putconn(idle)
+
+        # Act
+        new = get_pool("default", {"database": "test_app"}, self._create)
+
+        # Assert
+        self.assertIsNot(new, old)
+        self.assertTrue(idle.closed)
+        self.assertIsNone(get_pool("default", {"database": "app"}))
+
+    def test_close_pools_of_alias(self):
+        # Arrange
+        pool = get_pool("default", {"database": "app"}, self._create)
+        other = get_pool("other", {"database": "app"}, self._create)
+
+        # Act
+        pool_module.close_pools("default")
+
+        # Assert
+        self.assertEqual(pool.stats()["idle"], 0)
+        self.assertIsNone(get_pool("default", {"database": "app"}))
+        self.assertIs(get_pool("other", {"database": "app"}), other)
+
+
+class PooledDatabaseWrapperTestCase(SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        patchers = [
+            patch.object(pool_module, "_pools", {}),
+            patch.object(Database, "connect", side_effect=FakePgConnection),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        settings_dict = dict(
+            connection.settings_dict,
+            ENGINE="commons.db.backends.postgresql_pool",
+            NAME="app",
+            OPTIONS={},
+            POOL={"MIN_SIZE": 0, "MAX_SIZE": 1, "TIMEOUT": 0.1},
+        )
+        self._wrapper = DatabaseWrapper(settings_dict, alias="pooled")
+
+    def _connect(self):
+        params = self._wrapper.get_connection_params()
+        self._wrapper.connection = self._wrapper.get_new_connection(params)
+        return self._wrapper.connection
+
+    def _switch_database(self, name):
+        self._wrapper.settings_dict["NAME"] = name
+        self._wrapper.connection = None
+
+    def test_release_connection_to_pool(self):
+        # Arrange
+        released = self._connect()
+
+        # Act
+        self._wrapper._close()
+
+        # Assert
+        self.assertFalse(released.closed)
+        self.assertIs(self._connect(), released)
+
+    def test_rollback_unfinished_transaction_before_release(self):
+        # Arrange
+        released = self._connect()
+        released.status = TRANSACTION_STATUS_INTRANS
+
+        # Act
+        self._wrapper._close()
+
+        # Assert
+        self.assertTrue(released.rolled_back)
+        self.assertFalse(released.closed)
+
+    def test_discard_session_state_before_release(self):
+        # Arrange
+        released = self._connect()
+
+        # Act
+        self._wrapper._close()
+
+        # Assert
+        self.assertTrue(released.autocommit)
+        self.assertEqual(released.executed, ["DISCARD ALL"])
+
+    def test_discard_connection_closed_in_atomic_block(self):
+        # Arrange
+        discarded = self._connect()
+        self._wrapper.in_atomic_block = True
+
+        # Act
+        self._wrapper._close()
+
+        # Assert
+        self.assertTrue(discarded.closed)
+        self.assertIsNot(self._connect(), discarded)
+
+    def test_raise_operational_error_when_pool_is_exhausted(self):
+        # Arrange
+        self._connect()
+
+        # Act & Assert
+        with self.assertRaises(Database.OperationalError):
+            self._connect()
+
+    def test_connect_to_new_database_when_its_name_changes(self):
+        # Arrange
+        old = self._connect()
+        self._wrapper._close()
+        self._switch_database("test_app")
+
+        # Act
+        new = self._connect()
+
+        # Assert
+        self.assertEqual(new.params["database"], "test_app")
+        self.assertTrue(old.closed)
+
+    def test_close_connection_released_after_database_changed(self):
+        # Arrange
+        other = DatabaseWrapper(dict(self._wrapper.settings_dict), alias="pooled")
+        other.connection = old = other.get_new_connection(other.get_connection_params())
+        self._switch_database("test_app")
+        self._connect()
+
+        # Act
+        other._close()
+
+        # Assert
+        self.assertTrue(old.closed)
+
+    def test_close_idle_connections_before_test_database_is_destroyed(self):
+        # Arrange
+        idle = self._connect()
+        self._wrapper._close()
+
+        # Act
+        with patch.object(creation.DatabaseCreation, "_destroy_test_db") as destroy:
+            self._wrapper.creation._destroy_test_db("test_app", verbosity=0)
+
+        # Assert
+        self.assertTrue(idle.closed)
+        destroy.assert_called_once_with("test_app", 0)
+
+
+@skipUnless(connection.vendor == "postgresql", "Pooled backend requires PostgreSQL")
+class PooledSessionTestCase(TransactionTestCase):
+    def test_not_leak_session_state_to_next_user_of_connection(self):
+        # Arrange
+        with connection.cursor() as cursor:
+            cursor.execute("SET application_name = 'leaked'")
+            cursor.execute("CREATE TEMP TABLE leaked (id int)")
+            cursor.execute("SELECT pg_backend_pid()")
+            (pid,) = cursor.fetchone()
+
+        # Act
+        connection.close()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_backend_pid(), current_setting('application_name')"
+            )
+            reused_pid, application_name = cursor.fetchone()
+            cursor.execute("SELECT to_regclass('pg_temp.leaked')")
+            (table,) = cursor.fetchone()
+
+        # Assert
+        self.assertEqual(reused_pid, pid)
+        self.assertNotEqual(application_name, "leaked")
+        self.assertIsNone(table)
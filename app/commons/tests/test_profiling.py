@@ -0,0 +1,46 @@
+from django.db import connection
+from django.test import TestCase
+
+from commons.pipeline import pipelined
+from commons.profiling import Profiler
+
+
+def _select(value):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT %s", [value])
+        return cursor.fetchone()[0]
+
+
+class ProfilerTestCase(TestCase):
+    def test_count_queries_of_pipeline_stages(self):
+        # Arrange
+        profiler = Profiler()
+        written = []
+
+        def chunks():
+            for value in range(3):
+                yield _select(value)
+
+        # Act
+        with profiler.phase("pipeline") as stats:
+            pipelined(
+                chunks(),
+                lambda chunk: chunk,
+                lambda result: written.append(_select(result)),
+                execute_wrapper=stats,
+            )
+
+        # Assert
+        self.assertEqual(written, [0, 1, 2])
+        self.assertEqual(profiler.report()["queries"], 6)
+
+    def test_add_extra_sections_to_report(self):
+        # Arrange
+        profiler = Profiler(extras={"pools": lambda: {"default": {"size": 1}}})
+
+        # Act
+        report = profiler.report()
+
+        # Assert
+        self.assertEqual(report["pools"], {"default": {"size": 1}})
+        self.assertNotIn("pools", Profiler().report())
@@ -0,0 +1,75 @@
+from django.db import DEFAULT_DB_ALIAS
+from django.test import TestCase
+
+from mock import Mock, patch
+
+from commons.replicas import scan_alias
+from commons.routers import PrimaryReplicaRouter
+from subscriber.models import Subscriber
+from subscriber.tests.factories import SubscriberFactory
+
+
+class ScanAliasTestCase(TestCase):
+    def test_primary_without_alias(self):
+        # Arrange
+        warn = Mock()
+
+        # Act
+        alias = scan_alias(None, 60, [], warn)
+
+        # Assert
+        self.assertEqual(alias, DEFAULT_DB_ALIAS)
+        warn.assert_not_called()
+
+    def test_replica_with_all_rows(self):
+        # Arrange
+        subscriber = SubscriberFactory()
+        warn = Mock()
+
+        # Act
+        alias = scan_alias("default", 60, [(Subscriber, subscriber.pk)], warn)
+
+        # Assert
+        self.assertEqual(alias, "default")
+        warn.assert_not_called()
+
+    def test_primary_when_replica_lags(self):
+        # Arrange
+        warn = Mock()
+
+        # Act
+        with patch("commons.replicas.replica_lag", return_value=61):
+            alias = scan_alias("other", 60, [], warn)
+
+        # Assert
+        self.assertEqual(alias, DEFAULT_DB_ALIAS)
+        warn.assert_called_once_with(
+            "Replica other lags 61s, reading from the primary."
+        )
+
+    def test_primary_when_replica_misses_rows(self):
+        # Arrange
+        warn = Mock()
+
+        # Act
+        alias = scan_alias("default", 60, [(Subscriber, 0), (Subscriber, None)], warn)
+
+        # Assert
+        self.assertEqual(alias, DEFAULT_DB_ALIAS)
+        warn.assert_called_once_with(
+            "Replica default has no subscriber.Subscriber 0 yet, reading from the "
+            "primary."
+        )
+
+
+class PrimaryReplicaRouterTestCase(TestCase):
+    def test_write_to_primary(self):
+        # Arrange
+        router = PrimaryReplicaRouter()
+
+        # Act
+        alias = router.db_for_write(Subscriber, instance=Subscriber(id=1))
+
+        # Assert
+        self.assertEqual(alias, DEFAULT_DB_ALIAS)
+        self.assertIsNone(router.db_for_read(Subscriber))
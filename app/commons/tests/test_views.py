@@ -0,0 +1,34 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from mock import patch
+
+
+class DbPoolMetricsViewTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self._url = reverse("db_pool_metrics")
+
+    def test_return_pool_stats_to_staff(self):
+        # Arrange
+        admin = get_user_model().objects.create_superuser(
+            "admin", "admin@test.pl", "password"
+        )
+        self.client.force_login(admin)
+
+        # Act
+        with patch("commons.views.pool_stats", return_value={"default": {}}):
+            response = self.client.get(self._url)
+
+        # Assert
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"default": {}})
+
+    def test_require_staff_member(self):
+        # Act
+        response = self.client.get(self._url)
+
+        # Assert
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse("admin:login"), response["Location"])
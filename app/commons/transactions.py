@@ -0,0 +1,66 @@
+import threading
+
+from django.db import DatabaseError, connection, transaction
+
+
+class TransactionBatches:
+    """
+    Writer grouping batches into transactions of size batches.
+
+    Every batch runs in its own savepoint, so a batch failing with a database
+    error is rolled back alone and reported by returning False, while batches
+    written before it are committed with the rest of the transaction. Without
+    synchronous commit PostgreSQL does not wait for the WAL flush when a group
+    is committed, so a crash can lose the last committed groups, but not make
+    the database inconsistent. Every thread writes its own transaction, which
+    is committed by commit or at the exit of the context in that thread.
+    """
+
+    def __init__(self, size=1, synchronous_commit=True):
+        self._size = size
+        self._synchronous_commit = synchronous_commit
+        self._local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._close(exc_type, exc_value, traceback)
+
+    def __call__(self, write, *args):
+        """
+        Write batch with write in the current transaction, return True if it is
+        written and False if it has been rolled back because of a database error.
+        """
+        self._begin()
+        try:
+            with transaction.atomic():
+                write(*args)
+        except DatabaseError:
+            written = False
+        else:
+            written = True
+        self._local.batches += 1
+        if self._local.batches >= self._size:
+            self.commit()
+        return written
+
+    def commit(self):
+        self._close(None, None, None)
+
+    def _begin(self):
+        if getattr(self._local, "atomic", None) is not None:
+            return
+        self._local.atomic = transaction.atomic()
+        self._local.atomic.__enter__()
+        self._local.batches = 0
+        if not self._synchronous_commit and connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL synchronous_commit = off")
+
+    def _close(self, exc_type, exc_value, traceback):
+        atomic = getattr(self._local, "atomic", None)
+        if atomic is None:
+            return
+        self._local.atomic = None
+        atomic.__exit__(exc_type, exc_value, traceback)
@@ -0,0 +1,57 @@
+from functools import lru_cache
+from itertools import islice
+
+from django.db.models import ExpressionWrapper, F, TextField
+
+from phonenumber_field.phonenumber import to_python
+
+
+PHONE_CACHE_SIZE = 100000
+
+
+def chunked(iterable, size):
+    """
+    Split iterable into lists with at most size elements.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            break
+        yield chunk
+
+
+def lookup_key(value):
+    """
+    Return hashable representation of email or phone number the same as stored
+    in the database.
+    """
+    if value is None:
+        return ""
+    return str(value)
+
+
+def normalize_email(value):
+    """
+    Return email in the form used as its unique key, emails differing only in
+    the case of letters are the same key.
+    """
+    return (value or "").lower()
+
+
+def raw_value(field):
+    """
+    Return expression selecting the column of field as a plain string.
+
+    Values are not converted by the model field, so phone numbers are read and
+    compared as E.164 strings stored in the database without parsing them.
+    """
+    return ExpressionWrapper(F(field), output_field=TextField())
+
+
+@lru_cache(maxsize=PHONE_CACHE_SIZE)
+def phone_number(value):
+    """
+    Return PhoneNumber parsed from the string, the same numbers are parsed once.
+    """
+    return to_python(value)
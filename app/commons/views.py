@@ -0,0 +1,15 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+
+from commons.db.pool import pool_stats
+
+
+@require_GET
+@staff_member_required
+def db_pool_metrics(request):
+    """
+    Return statistics of database connection pools of the serving process to
+    staff members.
+    """
+    return JsonResponse(pool_stats())
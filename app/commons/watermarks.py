@@ -0,0 +1,30 @@
+from django.db.models import Q
+
+
+def latest_watermark(queryset):
+    """
+    Return (created, pk) of the newest object in queryset or None if it is empty.
+
+    The primary key breaks ties between objects created at the same time.
+    """
+    return queryset.order_by("-created", "-pk").values_list("created", "pk").first()
+
+
+def after_watermark(queryset, watermark):
+    """
+    Return objects created after the watermark, all of them if there is none.
+    """
+    if watermark is None:
+        return queryset
+    created, pk = watermark
+    return queryset.filter(Q(created__gt=created) | Q(created=created, pk__gt=pk))
+
+
+def up_to_watermark(queryset, watermark):
+    """
+    Return objects created not later than the watermark, none if there is none.
+    """
+    if watermark is None:
+        return queryset.none()
+    created, pk = watermark
+    return queryset.filter(Q(created__lt=created) | Q(created=created, pk__lte=pk))
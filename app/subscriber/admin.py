@@ -0,0 +1,16 @@
+from django.contrib import admin
+
+from commons.admin import LargeTableAdmin
+from subscriber.models import Subscriber, SubscriberSMS
+
+
+@admin.register(Subscriber)
+class SubscriberAdmin(LargeTableAdmin):
+    list_display = ("email", "gdpr_consent", "created")
+    search_fields = ("email",)
+
+
+@admin.register(SubscriberSMS)
+class SubscriberSMSAdmin(LargeTableAdmin):
+    list_display = ("phone", "gdpr_consent", "created")
+    search_fields = ("phone",)
@@ -0,0 +1,134 @@
+import resource
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.utils import timezone
+
+from commons.profiling import Profiler
+from commons.utils import chunked
+from subscriber.models import (
+    MigrationCheckpoint,
+    MigrationConflict,
+    MigrationRun,
+    Subscriber,
+    SubscriberSMS,
+)
+from user.consents import invalidate_user_consents
+from user.models import Client, User
+
+
+BATCH_SIZE = 5000
+
+# models filled by generate_dataset, in the order they can be deleted
+DATASET_MODELS = [
+    MigrationConflict,
+    MigrationCheckpoint,
+    MigrationRun,
+    User,
+    Client,
+    SubscriberSMS,
+    Subscriber,
+]
+
+
+def subscriber_email(index):
+    return f"subscriber_{index}@bench.pl"
+
+
+def subscriber_phone(index):
+    return f"+4850{index:07d}"
+
+
+def generate_dataset(size, overlap, duplicate_phones, batch_size=BATCH_SIZE):
+    """
+    Insert size subscribers and size SMS subscribers with matching clients and
+    users.
+
+    Clients are created for the first overlap part of subscribers and users for
+    the same number of subscribers starting in the middle of clients, so some
+    subscribers match only a client, some only a user and some both of them.
+    The first duplicate_phones part of SMS subscribers gets a second client with
+    the same phone, which makes the migration report them as conflicts. Users are
+    older than subscribers, so their consents are updated by the missing data
+    migration. Rows are generated lazily and inserted in batches, so memory usage
+    does not depend on size.
+    """
+    matched = int(size * overlap)
+    duplicated = min(int(size * duplicate_phones), matched)
+    first_user = matched // 2
+
+    insert(User, (user(index) for index in range(first_user, first_user + matched)))
+    User.objects.update(created=timezone.now() - timedelta(days=30))
+    insert(Client, (client(index) for index in range(matched)))
+    insert(Client, (duplicate_client(index) for index in range(duplicated)))
+    insert(Subscriber, (subscriber(index) for index in range(size)))
+    insert(SubscriberSMS, (subscriber_sms(index) for index in range(size)))
+
+
+def insert(model, objs, batch_size=BATCH_SIZE):
+    for batch in chunked(objs, batch_size):
+        # bulk_create splits the batch further to fit limits of the database
+        model.objects.bulk_create(batch)
+
+
+def subscriber(index):
+    return Subscriber(email=subscriber_email(index), gdpr_consent=index % 2 == 0)
+
+
+def subscriber_sms(index):
+    return SubscriberSMS(phone=subscriber_phone(index), gdpr_consent=index % 3 == 0)
+
+
+def client(index):
+    return Client(email=subscriber_email(index), phone=subscriber_phone(index))
+
+
+def duplicate_client(index):
+    return Client(email=f"duplicate_{index}@bench.pl", phone=subscriber_phone(index))
+
+
+def user(index):
+    return User(email=subscriber_email(index), phone=subscriber_phone(index))
+
+
+def delete_dataset():
+    """
+    Delete rows of the dataset models with one DELETE query per model. Rows are
+    not collected and delete signals are not sent per row, so cached consents of
+    users are invalidated in batches first.
+    """
+    user_pks = User.objects.values_list("pk", flat=True)
+    for pks in chunked(user_pks.iterator(), BATCH_SIZE):
+        invalidate_user_consents(User.objects.filter(pk__in=pks))
+    for model in DATASET_MODELS:
+        queryset = model.objects.all()
+        queryset._raw_delete(queryset.db)
+
+
+def dataset_exists():
+    return any(model.objects.exists() for model in DATASET_MODELS)
+
+
+def measure_command(command, options, rows):
+    """
+    Run the management command and return its wall time, number of queries, peak
+    RSS of the process in kilobytes and number of read rows per second.
+
+    Queries of worker processes started by the command are not counted.
+    """
+    profiler = Profiler()
+    with profiler.phase(command) as stats:
+        call_command(command, stdout=StringIO(), **options)
+    stats.rows_read = rows
+    report = stats.report()
+    return {
+        "command": command,
+        "options": options,
+        "rows": rows,
+        "wall_time": report["wall_time"],
+        "queries": report["queries"],
+        "sql_time": report["sql_time"],
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "rows_per_second": report["rows_read_per_second"],
+    }
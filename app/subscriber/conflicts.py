@@ -0,0 +1,141 @@
+import csv
+import gzip
+import io
+import os
+from contextlib import contextmanager
+
+from subscriber.models import MigrationConflict
+
+
+BUFFER_SIZE = 1024 * 1024
+
+
+class FileConflictSink:
+    """
+    Sink responsible for writing ids and migrated values of subscribers in conflict
+    to a CSV file per source model.
+
+    Conflicts of a chunk are written and synced to disk before the checkpoint of
+    the chunk is committed, which records the end of the file as the offset of
+    conflicts of committed chunks. A resumed checkpoint overwrites the file from
+    the offset, dropping conflicts of chunks which have not been committed. With
+    gzip every chunk is compressed as a separate gzip member, so the file can be
+    cut after any of them. Shards write separate files, which are merged into
+    the file of the model.
+    """
+
+    def __init__(self, compress=False):
+        self._compress = compress
+
+    @contextmanager
+    def writer(self, model, field, checkpoint, shard=None):
+        """
+        Yield function writing conflicts of the checkpoint of the model and
+        returning the offset to record in the checkpoint.
+        """
+        file_name = conflicts_file_name(model, shard, self._compress)
+        fresh = checkpoint.last_id is None
+        with open(file_name, "wb" if fresh else "r+b") as file:
+            if fresh and shard is None:
+                file.write(self._encode([["ID", field.upper()]]))
+            # checkpoints saved without the offset resume at the end of the file
+            end = file.seek(0, os.SEEK_END)
+
+            def write(conflicts):
+                offset = _offset(checkpoint, end)
+                if not conflicts:
+                    return offset
+                file.seek(offset)
+                file.truncate()
+                file.write(self._encode(conflict[:2] for conflict in conflicts))
+                file.flush()
+                os.fsync(file.fileno())
+                return file.tell()
+
+            yield write
+            file.truncate(_offset(checkpoint, end))
+
+    def merge(self, model, field, shards):
+        """
+        Merge files of shards into the file of the model and remove them.
+        """
+        file_names = [
+            conflicts_file_name(model, shard, self._compress) for shard in shards
+        ]
+        file_name = conflicts_file_name(model, compress=self._compress)
+        with self._open(file_name, "w") as file:
+            writer = csv.writer(file)
+            writer.writerow(["ID", field.upper()])
+            for shard_file_name in file_names:
+                with self._open(shard_file_name, "r") as shard_file:
+                    writer.writerows(csv.reader(shard_file))
+        for shard_file_name in file_names:
+            os.remove(shard_file_name)
+
+    def _encode(self, rows):
+        text = io.StringIO()
+        writer = csv.writer(text)
+        for row in rows:
+            writer.writerow(row)
+        data = text.getvalue().encode()
+        return gzip.compress(data) if self._compress else data
+
+    def _open(self, file_name, mode):
+        if self._compress:
+            return gzip.open(file_name, f"{mode}t", encoding="utf-8", newline="")
+        return open(
+            file_name, mode, encoding="utf-8", newline="", buffering=BUFFER_SIZE
+        )
+
+
+class TableConflictSink:
+    """
+    Sink responsible for saving conflicts in the MigrationConflict table, so they
+    can be looked up by run, source or key.
+
+    Conflicts of a chunk are inserted at once with the loader, in the transaction
+    which commits users and the checkpoint of the chunk.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+
+    @contextmanager
+    def writer(self, model, field, checkpoint, shard=None):
+        """
+        Yield function writing conflicts of the checkpoint of the model, which
+        has no offset to record.
+        """
+        source = model._meta.label
+
+        def write(conflicts):
+            if not conflicts:
+                return
+            self._loader(
+                [
+                    MigrationConflict(
+                        run_id=checkpoint.run_id,
+                        source=source,
+                        source_id=subscriber_id,
+                        key=value,
+                        reason=reason,
+                    )
+                    for subscriber_id, value, reason in conflicts
+                ]
+            )
+
+        yield write
+
+    def merge(self, model, field, shards):
+        pass
+
+
+def _offset(checkpoint, end):
+    return end if checkpoint.conflicts_offset is None else checkpoint.conflicts_offset
+
+
+def conflicts_file_name(model, shard=None, compress=False):
+    name = f"{model.__name__}_conflicts".lower()
+    if shard is not None:
+        name = f"{name}.{shard}"
+    return f"{name}.csv.gz" if compress else f"{name}.csv"
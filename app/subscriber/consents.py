@@ -0,0 +1,106 @@
+from commons.utils import lookup_key, raw_value
+from subscriber.models import Subscriber, SubscriberSMS
+from user.models import User
+
+
+def newest_consents(users, staging=None):
+    """
+    Copy to users the consent of the newest subscriber created after them.
+
+    Subscribers matching the chunk of users are loaded with two queries, which
+    match emails and phones of users with lists or with the staging table. When both
+    Subscriber and SubscriberSMS are newer than the user the latest one wins and
+    SubscriberSMS wins a tie. Return users whose consent has changed.
+    """
+    subscribers = {
+        lookup_key(subscriber.email): (subscriber.created, subscriber.gdpr_consent)
+        for subscriber in Subscriber.objects.filter(
+            email__in=_in([user.email for user in users], staging)
+        )
+    }
+    subscribers_sms = {
+        lookup_key(subscriber_sms.phone): (
+            subscriber_sms.created,
+            subscriber_sms.gdpr_consent,
+        )
+        for subscriber_sms in SubscriberSMS.objects.filter(
+            phone__in=_in([user.phone for user in users if user.phone], staging)
+        )
+    }
+    changed = []
+    for user in users:
+        gdpr_consent = newest_consent(
+            user.created,
+            subscribers.get(lookup_key(user.email)),
+            subscribers_sms.get(lookup_key(user.phone)),
+        )
+        if gdpr_consent is not None and gdpr_consent != user.gdpr_consent:
+            user.gdpr_consent = gdpr_consent
+            changed.append(user)
+    return changed
+
+
+def user_rows(users):
+    """
+    Return queryset of raw values of users used by newest_raw_consents.
+    """
+    return users.annotate(raw_phone=raw_value("phone")).values_list(
+        "pk", "email", "raw_phone", "created", "gdpr_consent", named=True
+    )
+
+
+def newest_raw_consents(rows, staging=None):
+    """
+    Same as newest_consents for rows returned by user_rows.
+
+    Subscribers are read as raw values as well, so no phone number is parsed, and
+    users are instantiated only with primary keys and consents which have changed.
+    """
+    subscribers = {
+        email: (created, gdpr_consent)
+        for email, created, gdpr_consent in Subscriber.objects.filter(
+            email__in=_in([row.email for row in rows], staging)
+        ).values_list("email", "created", "gdpr_consent")
+    }
+    subscribers_sms = {
+        phone: (created, gdpr_consent)
+        for phone, created, gdpr_consent in SubscriberSMS.objects.annotate(
+            raw_phone=raw_value("phone")
+        )
+        .filter(
+            raw_phone__in=_in([row.raw_phone for row in rows if row.raw_phone], staging)
+        )
+        .values_list("raw_phone", "created", "gdpr_consent")
+    }
+    changed = []
+    for row in rows:
+        gdpr_consent = newest_consent(
+            row.created,
+            subscribers.get(row.email),
+            subscribers_sms.get(row.raw_phone),
+        )
+        if gdpr_consent is not None and gdpr_consent != row.gdpr_consent:
+            changed.append(User(pk=row.pk, gdpr_consent=gdpr_consent))
+    return changed
+
+
+def newest_consent(created, subscriber, subscriber_sms):
+    """
+    Return consent of the newest of (created, consent) pairs of subscriber and
+    SMS subscriber created after created or None if there is no such one.
+    """
+    candidates = [
+        (subscriber_created, priority, gdpr_consent)
+        for priority, (subscriber_created, gdpr_consent) in enumerate(
+            [subscriber or (None, None), subscriber_sms or (None, None)]
+        )
+        if subscriber_created is not None and subscriber_created > created
+    ]
+    if not candidates:
+        return None
+    _, _, gdpr_consent = max(candidates)
+    return gdpr_consent
+
+
+def _in(values, staging):
+    return values if staging is None else staging(values)
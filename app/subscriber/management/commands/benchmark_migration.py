@@ -0,0 +1,118 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from commons.sharding import run_in_processes
+from subscriber.benchmarks import (
+    dataset_exists,
+    delete_dataset,
+    generate_dataset,
+    measure_command,
+)
+from subscriber.models import Subscriber, SubscriberSMS
+from user.models import User
+
+
+SIZES = [10000, 100000, 1000000]
+OVERLAP = 0.2
+DUPLICATE_PHONES = 0.01
+
+MIGRATE_COMMAND = "migrate_subscriber_to_user"
+UPDATE_COMMAND = "migrate_missing_data_from_subscriber_to_user"
+
+
+class Command(BaseCommand):
+    help = """
+    Command responsible for measuring how migration commands scale with generated
+    datasets of different sizes. It deletes all subscribers, clients and users, so
+    it must be run against a dedicated database.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            nargs="+",
+            type=int,
+            default=SIZES,
+            help="Numbers of subscribers and SMS subscribers of generated datasets.",
+        )
+        parser.add_argument(
+            "--overlap",
+            type=float,
+            default=OVERLAP,
+            help="Part of subscribers matching clients and users.",
+        )
+        parser.add_argument(
+            "--duplicate-phones",
+            type=float,
+            default=DUPLICATE_PHONES,
+            help="Part of SMS subscribers matching two clients with the same phone.",
+        )
+        parser.add_argument(
+            "--migrate-options",
+            type=json.loads,
+            default={},
+            help=f"JSON object with options of {MIGRATE_COMMAND}.",
+        )
+        parser.add_argument(
+            "--update-options",
+            type=json.loads,
+            default={},
+            help=f"JSON object with options of {UPDATE_COMMAND}.",
+        )
+        parser.add_argument(
+            "--flush",
+            action="store_true",
+            help="Delete existing subscribers, clients and users before the first run.",
+        )
+        parser.add_argument(
+            "--in-process",
+            action="store_true",
+            help=(
+                "Run commands in this process instead of a new one for every run, "
+                "so peak RSS is the maximum of all runs so far."
+            ),
+        )
+        parser.add_argument(
+            "--output",
+            default="-",
+            help="File for JSON results, they are written to stdout by default.",
+        )
+
+    def handle(self, *args, **options):
+        if dataset_exists() and not options["flush"]:
+            raise CommandError(
+                "Database already contains subscribers, clients or users, "
+                "use --flush to delete them."
+            )
+        results = []
+        for size in options["sizes"]:
+            delete_dataset()
+            generate_dataset(size, options["overlap"], options["duplicate_phones"])
+            subscribers = Subscriber.objects.count() + SubscriberSMS.objects.count()
+            result = self._measure(
+                MIGRATE_COMMAND, options["migrate_options"], subscribers, options
+            )
+            results.append(dict(result, size=size))
+            # users created by the migration are updated as well
+            result = self._measure(
+                UPDATE_COMMAND, options["update_options"], User.objects.count(), options
+            )
+            results.append(dict(result, size=size))
+        delete_dataset()
+        self._write(results, options["output"])
+
+    def _measure(self, command, command_options, rows, options):
+        task = (command, command_options, rows)
+        if options["in_process"]:
+            return measure_command(*task)
+        # a new process for every run keeps peak RSS of earlier runs out of it
+        return run_in_processes(measure_command, [task], 1)[0]
+
+    def _write(self, results, output):
+        report = json.dumps(results, indent=2)
+        if output == "-":
+            self.stdout.write(report)
+            return
+        with open(output, "w") as file:
+            file.write(report)
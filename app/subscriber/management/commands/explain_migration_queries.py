@@ -0,0 +1,113 @@
+import json
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from commons.watermarks import after_watermark
+from subscriber.models import Subscriber, SubscriberSMS
+from user.models import Client, User
+
+
+SAMPLE_EMAIL = "sample@example.com"
+SAMPLE_PHONE = "+48500600700"
+
+SQLITE_SEQ_SCAN = re.compile(r"\bSCAN (?:TABLE )?(\w+)\b(?! USING)")
+
+
+class Command(BaseCommand):
+    help = """
+    Command responsible for running EXPLAIN on queries issued by the migration
+    commands and reporting the ones which still read whole tables.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fail-on-seq-scan",
+            action="store_true",
+            help="Exit with an error if any query needs a sequential scan.",
+        )
+
+    def handle(self, *args, **options):
+        seq_scans = 0
+        for name, queryset in query_shapes():
+            tables = self._seq_scans(queryset)
+            if tables:
+                seq_scans += 1
+                self.stdout.write(
+                    self.style.WARNING(f"SEQ SCAN {name}: {', '.join(tables)}")
+                )
+            else:
+                self.stdout.write(self.style.SUCCESS(f"OK {name}"))
+        if seq_scans and options["fail_on_seq_scan"]:
+            raise CommandError(f"{seq_scans} queries need a sequential scan.")
+
+    def _seq_scans(self, queryset):
+        if connection.vendor != "postgresql":
+            return sorted(set(SQLITE_SEQ_SCAN.findall(queryset.explain())))
+        # with sequential scans disabled the planner still uses them only if
+        # there is no index which could serve the query
+        sql, params = queryset.query.sql_with_params()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return sorted(set(seq_scan_relations(plan[0]["Plan"])))
+
+
+def seq_scan_relations(plan):
+    """
+    Yield names of relations read with Seq Scan nodes of the PostgreSQL plan.
+    """
+    if plan["Node Type"] == "Seq Scan":
+        yield plan["Relation Name"]
+    for subplan in plan.get("Plans", []):
+        yield from seq_scan_relations(subplan)
+
+
+def query_shapes():
+    """
+    Return names and querysets with the shapes of queries issued by
+    migrate_subscriber_to_user and migrate_missing_data_from_subscriber_to_user.
+    """
+    email = User.objects.values_list("email", flat=True).first() or SAMPLE_EMAIL
+    phone = User.objects.values_list("phone", flat=True).first() or SAMPLE_PHONE
+    watermark = (timezone.now(), 0)
+    return [
+        ("users by emails", User.objects.filter(email__in=[email])),
+        ("users by phones", User.objects.filter(phone__in=[phone])),
+        ("client by email", Client.objects.filter(email=email)),
+        ("client by phone", Client.objects.filter(phone=phone)),
+        (
+            "users with client phone",
+            User.objects.filter(Q(phone=phone) & ~Q(email=email)),
+        ),
+        (
+            "users with client email",
+            User.objects.filter(Q(email=email) & ~Q(phone=phone)),
+        ),
+        (
+            "newer subscriber by email",
+            Subscriber.objects.filter(email=email, created__gt=watermark[0]),
+        ),
+        (
+            "newer subscriber sms by phone",
+            SubscriberSMS.objects.filter(phone=phone, created__gt=watermark[0]),
+        ),
+        ("subscribers page", Subscriber.objects.filter(pk__gt=0).order_by("pk")[:100]),
+        ("users page", User.objects.filter(pk__gt=0).order_by("pk")[:100]),
+        ("users after watermark", after_watermark(User.objects.all(), watermark)),
+        (
+            "subscribers after watermark",
+            after_watermark(Subscriber.objects.all(), watermark),
+        ),
+        (
+            "subscribers sms after watermark",
+            after_watermark(SubscriberSMS.objects.all(), watermark),
+        ),
+        ("latest user", User.objects.order_by("-created", "-pk")[:1]),
+    ]
@@ -1,13 +1,64 @@
-from itertools import islice
+import sys
+from contextlib import contextmanager
+from functools import partial
+from operator import attrgetter
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, OutputWrapper
+from django.db import connection
 from django.db.models import Q
+from django.utils import timezone
 
-from subscriber.models import Subscriber, SubscriberSMS
+from commons.buffers import WriteBuffer
+from commons.db.pool import pool_stats
+from commons.keyindex import MEMORY_BUDGET, KeyIndex
+from commons.pagination import keyset_chunks
+from commons.pipeline import pipelined
+from commons.profiling import make_profiler
+from commons.replicas import MAX_LAG, scan_alias
+from commons.sharding import id_ranges, run_in_processes
+from commons.staging import StagedKeys
+from commons.transactions import TransactionBatches
+from commons.utils import chunked, lookup_key, raw_value
+from commons.watermarks import after_watermark, latest_watermark
+from subscriber.consents import newest_consents, newest_raw_consents, user_rows
+from subscriber.models import MigrationCheckpoint, MigrationRun, Subscriber, SubscriberSMS
+from subscriber.planning import consents_plan, plan_lines
+from subscriber.sql import matched_user_ids, update_consents
+from user.consents import invalidate_user_consents
 from user.models import User
 
 
 BATCH_SIZE = 100
+CHUNK_SIZE = 10000
+
+ENGINE_PYTHON = "python"
+ENGINE_SQL = "sql"
+ENGINE_RAW = "raw"
+
+COMMAND = __name__.rsplit(".", 1)[-1]
+
+# models which changes can change consents of users
+SOURCE_MODELS = [User, Subscriber, SubscriberSMS]
+
+# options passed to worker processes
+WORKER_OPTIONS = [
+    "engine",
+    "stream",
+    "chunk_size",
+    "batch_size",
+    "workers",
+    "incremental",
+    "profile",
+    "pipeline",
+    "key_index",
+    "memory_budget",
+    "staging",
+    "transaction_size",
+    "async_commit",
+    "read_alias",
+    "max_replica_lag",
+]
 
 
 class Command(BaseCommand):
@@ -15,52 +66,459 @@ class Command(BaseCommand):
     Command responsible for migrate missing data from subscribers to  User.
     """
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--engine",
+            choices=[ENGINE_PYTHON, ENGINE_RAW, ENGINE_SQL],
+            default=ENGINE_PYTHON,
+            help=(
+                f"'{ENGINE_PYTHON}' compares users with subscribers one by one, "
+                f"'{ENGINE_RAW}' compares chunks of raw values of users and "
+                "subscribers without instantiating models, "
+                f"'{ENGINE_SQL}' updates consents with one UPDATE statement per "
+                "chunk of users (PostgreSQL only)."
+            ),
+        )
+        parser.add_argument(
+            "--stream",
+            action="store_true",
+            help=(
+                "Walk users by primary key and match them with subscribers for "
+                "the whole chunk, so memory usage does not depend on table size."
+            ),
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=CHUNK_SIZE,
+            help="Number of users processed at once.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=BATCH_SIZE,
+            help="Number of pending users which triggers writing them to database.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help=(
+                "Number of processes. Users are split into ranges of ids and "
+                "every range is updated in a separate process."
+            ),
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help=(
+                "Update only users and subscribers created after the watermark "
+                "of the last finished run."
+            ),
+        )
+        parser.add_argument(
+            "--pipeline",
+            action="store_true",
+            help=(
+                "Read next chunks of users and write previous ones in separate "
+                "threads while the current chunk is compared with subscribers "
+                f"('{ENGINE_PYTHON}' engine only)."
+            ),
+        )
+        parser.add_argument(
+            "--key-index",
+            action="store_true",
+            help=(
+                "Keep hashes of emails and phones of subscribers in a compact "
+                "index, so only users which may match a subscriber are compared "
+                f"with them ('{ENGINE_PYTHON}' and '{ENGINE_RAW}' engines only)."
+            ),
+        )
+        parser.add_argument(
+            "--memory-budget",
+            type=int,
+            default=MEMORY_BUDGET // (1024 * 1024),
+            help="Megabytes of memory for the key index, above it goes to disk.",
+        )
+        parser.add_argument(
+            "--staging",
+            action="store_true",
+            help=(
+                "Load emails and phones of every chunk of users into a TEMP table "
+                "and join it with subscribers instead of sending them as IN lists "
+                f"('{ENGINE_PYTHON}' and '{ENGINE_RAW}' engines only)."
+            ),
+        )
+        parser.add_argument(
+            "--transaction-size",
+            type=int,
+            default=1,
+            help=(
+                "Number of batches of users committed in one transaction. Every "
+                "batch is written in a savepoint and a batch which fails is "
+                "skipped instead of stopping the run "
+                f"('{ENGINE_PYTHON}' and '{ENGINE_RAW}' engines only)."
+            ),
+        )
+        parser.add_argument(
+            "--async-commit",
+            action="store_true",
+            help=(
+                "Turn off synchronous_commit in transactions of the run on "
+                "PostgreSQL. A crash can lose the last committed batches."
+            ),
+        )
+        parser.add_argument(
+            "--read-alias",
+            help=(
+                "Database alias of a replica which scans users and subscribers. "
+                "Subscribers matched with users and writes use the primary "
+                f"('{ENGINE_PYTHON}' and '{ENGINE_RAW}' engines only)."
+            ),
+        )
+        parser.add_argument(
+            "--max-replica-lag",
+            type=float,
+            default=MAX_LAG,
+            help=(
+                "Seconds of replication lag above which scans fall back to the "
+                "primary."
+            ),
+        )
+        parser.add_argument(
+            "--plan",
+            action="store_true",
+            help=(
+                "Only count users whose consents would be updated, without "
+                "writing anything."
+            ),
+        )
+        parser.add_argument(
+            "--profile",
+            nargs="?",
+            const="-",
+            metavar="FILE",
+            help=(
+                "Write JSON report with wall time, queries and rows per second of "
+                "every phase to the file or to stdout if no file is given."
+            ),
+        )
+
     def handle(self, *args, **options):
-        self._users_batch = []
+        self._validate(options)
+        if options["plan"]:
+            self._plan(options["incremental"])
+            return
+        profiler = make_profiler(options["profile"], {"pools": pool_stats})
+        with profiler.phase("setup"):
+            run = self._start_run()
+        if options["workers"] > 1:
+            updated = self._update_in_workers(options, run, profiler)
+        else:
+            checkpoints = run.checkpoints.all()
+            users = users_to_update(checkpoints, options["incremental"])
+            update = ConsentUpdate(options, profiler, self.stderr.write)
+            updated = update(users, checkpoints)
+        with profiler.phase("finish"):
+            run.checkpoints.update(finished=True)
+            run.finished = timezone.now()
+            run.save(update_fields=["finished"])
+        self.stdout.write(f"Updated users: {updated}")
+        if profiler.enabled:
+            profiler.write(options["profile"], self.stdout)
+
+    def _validate(self, options):
+        if options["engine"] == ENGINE_SQL and connection.vendor != "postgresql":
+            raise CommandError(f"Engine '{ENGINE_SQL}' requires PostgreSQL database.")
+        if options["read_alias"] and options["read_alias"] not in settings.DATABASES:
+            raise CommandError(f"Unknown database alias '{options['read_alias']}'.")
+
+    def _plan(self, incremental):
+        users = users_to_update(watermark_checkpoints(), incremental)
+        for line in plan_lines(User._meta.label, consents_plan(users)):
+            self.stdout.write(line)
+
+    def _start_run(self):
+        run = MigrationRun.objects.create(command=COMMAND)
+        for checkpoint in watermark_checkpoints():
+            checkpoint.run = run
+            checkpoint.save()
+        return run
+
+    def _update_in_workers(self, options, run, profiler):
+        options = {name: options[name] for name in WORKER_OPTIONS}
+        users = users_to_update(run.checkpoints.all(), options["incremental"])
+        tasks = [
+            (options, run.pk, start, end)
+            for start, end in id_ranges(users, options["workers"])
+        ]
+        # queries of shards are profiled by the shards themselves
+        with profiler.phase("update", capture_queries=False):
+            results = run_in_processes(update_shard, tasks, options["workers"])
+        for result in results:
+            profiler.merge(result["profile"]["phases"])
+        return sum(result["updated"] for result in results)
+
+
+class ConsentUpdate:
+    """
+    Update of consents of users configured by options of the command.
+
+    Calling it updates consents of users up to the watermarks of checkpoints and
+    returns number of written users.
+    """
+
+    def __init__(self, options, profiler, warn):
+        self._engine = options["engine"]
+        self._stream = options["stream"]
+        self._chunk_size = options["chunk_size"]
+        self._batch_size = options["batch_size"]
+        self._pipeline = options["pipeline"]
+        self._key_index = options["key_index"] and self._engine != ENGINE_SQL
+        self._memory_budget = options["memory_budget"] * 1024 * 1024
+        self._staging = options["staging"]
+        self._transaction_size = options["transaction_size"]
+        self._synchronous_commit = not options["async_commit"]
+        self._read_alias = options["read_alias"]
+        self._max_replica_lag = options["max_replica_lag"]
+        self._profiler = profiler
+        self._warn = warn
+        self._keys = (
+            attrgetter("email", "raw_phone")
+            if self._engine == ENGINE_RAW
+            else _user_keys
+        )
         self._subscribers = Subscriber.objects.all()
         self._subscribers_sms = SubscriberSMS.objects.all()
-        query_subscribers = Q(
-            email__in=self._subscribers.values_list("email", flat=True)
+        # state of a run, set when the update is called
+        self._stats = None
+        self._failed = 0
+        self._transactions = None
+        self._users_buffer = None
+        self._emails = None
+        self._phones = None
+
+    def __call__(self, users, checkpoints):
+        with self._profiler.phase("update") as self._stats:
+            if self._engine == ENGINE_SQL:
+                updated = update_consents(users, self._chunk_size)
+            else:
+                updated = self._update_in_python(users, checkpoints)
+            self._stats.rows_written += updated
+        return updated
+
+    def _update_in_python(self, users, checkpoints):
+        read_alias = scan_alias(
+            self._read_alias,
+            self._max_replica_lag,
+            _watermark_rows(checkpoints),
+            self._warn,
         )
-        query_subscribers_sms = Q(
-            phone__in=self._subscribers_sms.values_list("phone", flat=True)
+        self._failed = 0
+        with self._subscriber_indexes(read_alias), TransactionBatches(
+            self._transaction_size, self._synchronous_commit
+        ) as self._transactions, WriteBuffer(
+            self._update_users, self._batch_size
+        ) as self._users_buffer:
+            self._update_engine_chunks(users.using(read_alias))
+        return self._users_buffer.written - self._failed
+
+    def _update_engine_chunks(self, users):
+        staging = StagedKeys() if self._staging else None
+        if self._engine == ENGINE_RAW:
+            chunks = keyset_chunks(user_rows(users), self._chunk_size)
+            self._update_chunks(chunks, partial(newest_raw_consents, staging=staging))
+        elif self._stream:
+            chunks = keyset_chunks(users, self._chunk_size)
+            self._update_chunks(chunks, partial(newest_consents, staging=staging))
+        else:
+            self._update_matched_users(users)
+
+    def _update_matched_users(self, users):
+        if self._staging:
+            users = users.filter(pk__in=matched_user_ids())
+        elif not self._key_index:
+            query_subscribers = Q(
+                email__in=self._subscribers.values_list("email", flat=True)
+            )
+            query_subscribers_sms = Q(
+                phone__in=self._subscribers_sms.values_list("phone", flat=True)
+            )
+            users = users.filter(query_subscribers | query_subscribers_sms)
+        chunks = chunked(users.iterator(chunk_size=self._chunk_size), self._chunk_size)
+        self._update_chunks(chunks, self._prepare_users_for_update)
+
+    def _update_chunks(self, chunks, prepare):
+        """
+        Pass users prepared from every chunk to the buffer of updated users.
+        """
+        prepare_chunk = partial(self._prepare_chunk, prepare)
+        if self._pipeline:
+            pipelined(
+                chunks,
+                prepare_chunk,
+                self._users_buffer.extend,
+                finish=self._transactions.commit,
+                execute_wrapper=self._stats if self._profiler.enabled else None,
+            )
+            return
+        for chunk in chunks:
+            self._users_buffer.extend(prepare_chunk(chunk))
+
+    def _prepare_chunk(self, prepare, chunk):
+        self._stats.rows_read += len(chunk)
+        if self._key_index:
+            chunk = [user for user in chunk if self._may_match(user)]
+        return prepare(chunk) if chunk else []
+
+    @contextmanager
+    def _subscriber_indexes(self, read_alias):
+        """
+        Build indexes of emails of subscribers and phones of SMS subscribers for
+        the duration of the update if they are turned on.
+        """
+        if not self._key_index:
+            yield
+            return
+        emails = Subscriber.objects.using(read_alias).values_list("email", flat=True)
+        phones = (
+            SubscriberSMS.objects.using(read_alias)
+            .annotate(raw_phone=raw_value("phone"))
+            .values_list("raw_phone", flat=True)
         )
-        users = User.objects.filter(query_subscribers | query_subscribers_sms)
-        self._prepare_users_for_update(users)
-        self._users_batch = iter(self._users_batch)
-        self._update_users()
+        # every index gets a half of the budget
+        budget = self._memory_budget // 2
+        with KeyIndex.build(
+            emails.iterator(chunk_size=self._chunk_size), budget
+        ) as self._emails, KeyIndex.build(
+            phones.iterator(chunk_size=self._chunk_size), budget
+        ) as self._phones:
+            yield
+
+    def _may_match(self, user):
+        """
+        Return False for users which certainly do not match any subscriber.
+        """
+        email, phone = self._keys(user)
+        return email in self._emails or phone in self._phones
 
     def _prepare_users_for_update(self, users):
         for user in users:
-            subscriber = None
-            subscriber_sms = None
-            try:
-                subscriber = self._subscribers.get(
-                    email=user.email, created__gt=user.created
-                )
-            except Subscriber.DoesNotExist:
-                pass
-            try:
-                subscriber_sms = self._subscribers_sms.get(
-                    phone=user.phone, created__gt=user.created
-                )
-            except SubscriberSMS.DoesNotExist:
-                pass
-            if subscriber and subscriber_sms:
-                if subscriber.created > subscriber_sms.created:
-                    user.gdpr_consent = subscriber.gdpr_consent
-                else:
-                    user.gdpr_consent = subscriber_sms.gdpr_consent
-            elif subscriber:
+            subscriber = self._newest_subscriber(user)
+            if subscriber is not None:
                 user.gdpr_consent = subscriber.gdpr_consent
-            elif subscriber_sms:
-                user.gdpr_consent = subscriber_sms.gdpr_consent
-            self._users_batch.append(user)
-
-    def _update_users(self):
-        if self._users_batch:
-            while True:
-                batch = list(islice(self._users_batch, BATCH_SIZE))
-                if not batch:
-                    break
-                User.objects.bulk_update(batch, ["gdpr_consent"], BATCH_SIZE)
+        return users
+
+    def _newest_subscriber(self, user):
+        """
+        Return the newer of the subscriber and the SMS subscriber of the user
+        created after the user or None if there is neither of them.
+        """
+        subscriber = _get_or_none(
+            self._subscribers, email=user.email, created__gt=user.created
+        )
+        subscriber_sms = _get_or_none(
+            self._subscribers_sms, phone=user.phone, created__gt=user.created
+        )
+        # max keeps the first of subscribers created at once, SMS wins the tie
+        found = [
+            candidate
+            for candidate in (subscriber_sms, subscriber)
+            if candidate is not None
+        ]
+        return max(found, key=attrgetter("created"), default=None)
+
+    def _update_users(self, users):
+        if not self._transactions(self._write_users, users):
+            self._failed += len(users)
+            self._warn(
+                f"Could not update users with ids from {users[0].pk} to "
+                f"{users[-1].pk}."
+            )
+
+    def _write_users(self, users):
+        User.objects.bulk_update(users, ["gdpr_consent"], self._batch_size)
+        # bulk updates do not send signals which invalidate cached consents
+        invalidate_user_consents(
+            User.objects.filter(pk__in=[user.pk for user in users])
+        )
+
+
+def watermark_checkpoints():
+    """
+    Return unsaved checkpoints with current watermarks of source models.
+    """
+    checkpoints = []
+    for model in SOURCE_MODELS:
+        created, last_id = latest_watermark(model.objects.all()) or (None, None)
+        checkpoints.append(
+            MigrationCheckpoint(
+                phase=model._meta.label,
+                watermark_created=created,
+                watermark_id=last_id,
+            )
+        )
+    return checkpoints
+
+
+def _watermark_rows(checkpoints):
+    """
+    Return (model, pk) pairs of the last rows of source models of checkpoints.
+    """
+    models = {model._meta.label: model for model in SOURCE_MODELS}
+    return [
+        (models[checkpoint.phase], checkpoint.watermark_id)
+        for checkpoint in checkpoints
+    ]
+
+
+def users_to_update(checkpoints, incremental):
+    """
+    Return users whose consents could have changed up to the watermarks of
+    checkpoints of a run.
+
+    In the incremental mode these are only users created after the last finished
+    run and users matching subscribers created after it.
+    """
+    checkpoints = {checkpoint.phase: checkpoint for checkpoint in checkpoints}
+
+    def changed(model):
+        phase = model._meta.label
+        objects = checkpoints[phase].remaining(model.objects.all())
+        if incremental:
+            watermark = MigrationCheckpoint.objects.last_watermark(COMMAND, phase)
+            objects = after_watermark(objects, watermark)
+        return objects
+
+    users = changed(User)
+    if not incremental:
+        return users
+    return User.objects.filter(
+        Q(pk__in=users.values("pk"))
+        | Q(email__in=changed(Subscriber).values("email"))
+        | Q(phone__in=changed(SubscriberSMS).values("phone"))
+    )
+
+
+def update_shard(options, run_id, start, end):
+    """
+    Update users with ids from the given range in a worker process.
+    """
+    run = MigrationRun.objects.get(pk=run_id)
+    checkpoints = run.checkpoints.all()
+    users = users_to_update(checkpoints, options["incremental"])
+    profiler = make_profiler(options["profile"], {"pools": pool_stats})
+    update = ConsentUpdate(options, profiler, OutputWrapper(sys.stderr).write)
+    updated = update(users.filter(pk__gte=start, pk__lt=end), checkpoints)
+    return {"updated": updated, "profile": profiler.report()}
+
+
+def _get_or_none(queryset, **lookups):
+    try:
+        return queryset.get(**lookups)
+    except queryset.model.DoesNotExist:
+        return None
+
+
+def _user_keys(user):
+    return user.email, lookup_key(user.phone)
@@ -1,103 +1,708 @@
-import csv
-from itertools import islice
+import sys
+from collections import Counter, defaultdict, namedtuple
+from contextlib import ExitStack, contextmanager
+from itertools import zip_longest
 
-from django.core.management.base import BaseCommand
-from django.db.models import Q
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, OutputWrapper
+from django.db.models import Max
+from django.utils import timezone
 
-from subscriber.models import Subscriber, SubscriberSMS
-from user.models import Client, User
+from commons.buffers import WriteBuffer
+from commons.db.pool import pool_stats
+from commons.keyindex import MEMORY_BUDGET, KeyIndex
+from commons.loaders import BulkCreateLoader, CopyLoader, UpsertLoader
+from commons.pagination import keyset_chunks
+from commons.pipeline import pipelined
+from commons.profiling import make_profiler
+from commons.replicas import MAX_LAG, scan_alias
+from commons.sharding import id_ranges, run_in_processes
+from commons.staging import StagedKeys
+from commons.transactions import TransactionBatches
+from commons.utils import chunked, raw_value
+from commons.watermarks import after_watermark, latest_watermark
+from subscriber.conflicts import FileConflictSink, TableConflictSink
+from subscriber.models import MigrationCheckpoint, MigrationConflict, MigrationRun
+from subscriber.planning import migration_plan, plan_lines
+from subscriber.resolvers import (
+    InMemoryResolver,
+    QueryResolver,
+    RawResolver,
+    SharedLookups,
+)
+from subscriber.sources import SOURCES
+from user.consents import consent_keys, invalidate_consents
+from user.models import User
 
 
 BATCH_SIZE = 100
+CHUNK_SIZE = 2000
+
+RESOLVER_QUERY = "query"
+RESOLVER_MEMORY = "memory"
+RESOLVER_RAW = "raw"
+RESOLVERS = {
+    RESOLVER_QUERY: QueryResolver,
+    RESOLVER_MEMORY: InMemoryResolver,
+    RESOLVER_RAW: RawResolver,
+}
+
+LOADER_BULK_CREATE = "bulk_create"
+LOADER_COPY = "copy"
+LOADER_UPSERT = "upsert"
+LOADERS = {
+    LOADER_BULK_CREATE: BulkCreateLoader,
+    LOADER_COPY: CopyLoader,
+    LOADER_UPSERT: UpsertLoader,
+}
+
+CONFLICTS_FILE = "file"
+CONFLICTS_TABLE = "table"
+
+# source migrated by the command with its checkpoint, the resolver of its chunks
+# and the function writing its conflicts
+Step = namedtuple("Step", ["source", "checkpoint", "resolver", "write_conflicts"])
+
+COMMAND = __name__.rsplit(".", 1)[-1]
+
+# options passed to worker processes
+WORKER_OPTIONS = [
+    "resolver",
+    "stream",
+    "chunk_size",
+    "batch_size",
+    "loader",
+    "workers",
+    "incremental",
+    "profile",
+    "conflicts",
+    "gzip",
+    "pipeline",
+    "key_index",
+    "memory_budget",
+    "staging",
+    "transaction_size",
+    "async_commit",
+    "shared_lookups",
+    "read_alias",
+    "max_replica_lag",
+]
 
 
 class Command(BaseCommand):
     help = "Command responsible for migrate data from subscribers to User."
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--resolver",
+            choices=list(RESOLVERS),
+            default=RESOLVER_QUERY,
+            help=(
+                "How subscribers are matched with clients and users: "
+                f"'{RESOLVER_QUERY}' runs queries for every subscriber, "
+                f"'{RESOLVER_MEMORY}' loads data for chunks of subscribers "
+                f"and matches them in memory, '{RESOLVER_RAW}' does the same "
+                "with raw values instead of models."
+            ),
+        )
+        parser.add_argument(
+            "--stream",
+            action="store_true",
+            help=(
+                "Walk subscribers by primary key with a separate query for every "
+                "chunk instead of a single cursor over the whole table."
+            ),
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=CHUNK_SIZE,
+            help="Number of subscribers processed at once.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=BATCH_SIZE,
+            help="Number of pending users which triggers writing them to database.",
+        )
+        parser.add_argument(
+            "--loader",
+            choices=list(LOADERS),
+            default=LOADER_BULK_CREATE,
+            help=(
+                f"How new users are inserted: '{LOADER_COPY}' streams them with "
+                "COPY FROM STDIN on PostgreSQL and uses bulk_create elsewhere, "
+                f"'{LOADER_UPSERT}' inserts them with ON CONFLICT DO NOTHING, so "
+                "users with an existing email or phone are skipped by the database "
+                "without looking them up first."
+            ),
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help=(
+                "Number of processes. Subscribers are split into ranges of ids "
+                "and every range is migrated in a separate process."
+            ),
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help=(
+                "Continue the last unfinished run from its checkpoints instead of "
+                "starting from scratch."
+            ),
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help=(
+                "Migrate only subscribers created after the watermark of the last "
+                "finished run."
+            ),
+        )
+        parser.add_argument(
+            "--profile",
+            nargs="?",
+            const="-",
+            metavar="FILE",
+            help=(
+                "Write JSON report with wall time, queries and rows per second of "
+                "every phase to the file or to stdout if no file is given."
+            ),
+        )
+        parser.add_argument(
+            "--conflicts",
+            choices=[CONFLICTS_FILE, CONFLICTS_TABLE],
+            default=CONFLICTS_FILE,
+            help=(
+                f"Where subscribers in conflict are reported: '{CONFLICTS_FILE}' "
+                "writes CSV file per source model, "
+                f"'{CONFLICTS_TABLE}' saves them in the MigrationConflict table."
+            ),
+        )
+        parser.add_argument(
+            "--pipeline",
+            action="store_true",
+            help=(
+                "Read next chunks of subscribers and write users of previous ones "
+                "in separate threads while the current chunk is resolved."
+            ),
+        )
+        parser.add_argument(
+            "--key-index",
+            action="store_true",
+            help=(
+                "Keep hashes of keys of existing users in a compact index, so only "
+                "subscribers which may already have a user are looked up."
+            ),
+        )
+        parser.add_argument(
+            "--memory-budget",
+            type=int,
+            default=MEMORY_BUDGET // (1024 * 1024),
+            help="Megabytes of memory for the key index, above it goes to disk.",
+        )
+        parser.add_argument(
+            "--staging",
+            action="store_true",
+            help=(
+                "Load values of every chunk into a TEMP table and join it with "
+                "users and clients instead of sending them as IN lists."
+            ),
+        )
+        parser.add_argument(
+            "--transaction-size",
+            type=int,
+            default=1,
+            help=(
+                "Number of chunks committed in one transaction. Every chunk is "
+                "written in a savepoint and subscribers of a chunk which fails "
+                "are reported as conflicts instead of stopping the run."
+            ),
+        )
+        parser.add_argument(
+            "--async-commit",
+            action="store_true",
+            help=(
+                "Turn off synchronous_commit in transactions of the run on "
+                "PostgreSQL. A crash can lose the last committed chunks, which "
+                "are migrated again by --resume."
+            ),
+        )
+        parser.add_argument(
+            "--shared-lookups",
+            action="store_true",
+            help=(
+                "Read a chunk of every source at once and load clients and users "
+                "for all of them with one query each, instead of a separate pass "
+                f"per source ('{RESOLVER_MEMORY}' and '{RESOLVER_RAW}' resolvers "
+                "only, ignored by shards)."
+            ),
+        )
+        parser.add_argument(
+            "--read-alias",
+            help=(
+                "Database alias of a replica which scans subscribers and users. "
+                "Existence checks of resolvers and writes use the primary."
+            ),
+        )
+        parser.add_argument(
+            "--max-replica-lag",
+            type=float,
+            default=MAX_LAG,
+            help=(
+                "Seconds of replication lag above which scans fall back to the "
+                "primary."
+            ),
+        )
+        parser.add_argument(
+            "--plan",
+            action="store_true",
+            help=(
+                "Only count subscribers which would be migrated, skipped or "
+                "reported as conflicts, without writing anything."
+            ),
+        )
+        parser.add_argument(
+            "--gzip",
+            action="store_true",
+            help="Compress CSV files with conflicts with gzip.",
+        )
+
     def handle(self, *args, **options):
-        self._users_batch = []
-        models_with_params = [
-            {
-                "model": Subscriber,
-                "fields": {"field_to_migrate": "email", "field_to_check": "phone"},
-            },
-            {
-                "model": SubscriberSMS,
-                "fields": {
-                    "field_to_migrate": "phone",
-                    "field_to_check": "email",
-                },
-            },
+        if options["read_alias"] and options["read_alias"] not in settings.DATABASES:
+            raise CommandError(f"Unknown database alias '{options['read_alias']}'.")
+        if options["plan"]:
+            self._plan(SOURCES, options["incremental"])
+            return
+        profiler = make_profiler(options["profile"], {"pools": pool_stats})
+        with profiler.phase("setup"):
+            run = self._get_run(options["resume"])
+        migration = Migration(options, run, profiler, self.stderr.write)
+        migration.migrate(SOURCES)
+        run.finished = timezone.now()
+        run.save(update_fields=["finished"])
+        self.stdout.write(
+            f"Created users: {migration.counters['created']}, "
+            f"conflicts: {migration.counters['conflicts']}"
+        )
+        if profiler.enabled:
+            profiler.write(options["profile"], self.stdout)
+
+    def _plan(self, sources, incremental):
+        for source in sources:
+            plan = migration_plan(
+                subscribers(source.model, incremental),
+                source.fields,
+                User.objects.all(),
+            )
+            for line in plan_lines(source.phase, plan):
+                self.stdout.write(line)
+
+    def _get_run(self, resume):
+        run = None
+        if resume:
+            run = (
+                MigrationRun.objects.filter(command=COMMAND, finished__isnull=True)
+                .order_by("pk")
+                .last()
+            )
+        if run is None:
+            # users created by this run must not change decisions about next chunks
+            last_user_id = User.objects.aggregate(Max("pk"))["pk__max"] or 0
+            run = MigrationRun.objects.create(
+                command=COMMAND, last_user_id=last_user_id
+            )
+        return run
+
+
+class Migration:
+    """
+    Migration of subscribers to users by a run configured by options of the command.
+    """
+
+    def __init__(self, options, run, profiler, warn):
+        self._options = {name: options[name] for name in WORKER_OPTIONS}
+        self._resolver_class = RESOLVERS[options["resolver"]]
+        self._stream = options["stream"]
+        self._chunk_size = options["chunk_size"]
+        self._batch_size = options["batch_size"]
+        self._workers = options["workers"]
+        self._incremental = options["incremental"]
+        self._pipeline = options["pipeline"]
+        self._key_index = options["key_index"]
+        self._memory_budget = options["memory_budget"] * 1024 * 1024
+        self._staging = options["staging"]
+        self._transaction_size = options["transaction_size"]
+        self._synchronous_commit = not options["async_commit"]
+        self._read_alias = options["read_alias"]
+        self._max_replica_lag = options["max_replica_lag"]
+        self._loader = user_loader(options)
+        # unique keys of users let the upsert skip existing users by itself
+        self._check_existing = options["loader"] != LOADER_UPSERT
+        self._conflicts = conflict_sink(options)
+        self._share_lookups = options["shared_lookups"]
+        self._group = _together if self._share_lookups else _apart
+        self._run = run
+        self._users = User.objects.filter(pk__lte=run.last_user_id)
+        self._profiler = profiler
+        self._warn = warn
+        self.counters = Counter()
+
+    def migrate(self, sources):
+        """
+        Migrate sources, whole tables in groups and tables split into shards
+        one by one.
+        """
+        whole = []
+        for index, source in enumerate(sources):
+            checkpoints = self._checkpoints(source.model)
+            if len(checkpoints) > 1 or checkpoints[0].start_id is not None:
+                self._migrate_in_shards(index, source, checkpoints)
+            else:
+                whole.append((source, checkpoints[0]))
+        for group in self._group(whole):
+            self._migrate_whole_tables(group)
+
+    def migrate_shard(self, source, checkpoint):
+        """
+        Migrate subscribers from the range of the checkpoint and return counters
+        and profile of the shard.
+        """
+        with self._step(
+            source, checkpoint, self._staged_keys(), shard=checkpoint.start_id
+        ) as step:
+            self._migrate_steps(source.phase, [step])
+        return {"counters": dict(self.counters), "profile": self._profiler.report()}
+
+    def _checkpoints(self, model):
+        """
+        Return checkpoints of the run for model, create them for a new run.
+        """
+        phase = model._meta.label
+        checkpoints = list(self._run.checkpoints.filter(phase=phase).order_by("pk"))
+        if checkpoints:
+            return checkpoints
+        created, last_id = latest_watermark(model.objects.all()) or (None, None)
+        ranges = [(None, None)]
+        if self._workers > 1:
+            # an empty table is migrated as a whole without shards
+            shards = id_ranges(subscribers(model, self._incremental), self._workers)
+            ranges = shards or ranges
+        return [
+            self._run.checkpoints.create(
+                phase=phase,
+                start_id=start,
+                end_id=end,
+                watermark_created=created,
+                watermark_id=last_id,
+            )
+            for start, end in ranges
         ]
-        self._prepare_users_for_migration(models_with_params)
-        self._users_batch = iter(self._users_batch)
-        self._create_users()
-
-    def _prepare_users_for_migration(self, models_with_params):
-        for data in models_with_params:
-            model = data["model"]
-            field_to_migrate = data["fields"]["field_to_migrate"]
-            subscribers = data[
-                "model"
-            ].objects.all()  # probaly I should thing over also chunk the subscribers  # noqa
-            file_name = f"{model.__name__}_conflicts.csv"
-
-            with open(file_name.lower(), "w", newline="") as file:
-                writer = csv.writer(file)
-                writer.writerow(["ID", field_to_migrate.upper()])
-                filter_attr = {
-                    f"{field_to_migrate}__in": [
-                        getattr(subscriber, field_to_migrate)
-                        for subscriber in subscribers
-                    ]
-                }
-                skip_values = User.objects.filter(**filter_attr).values_list(
-                    field_to_migrate, flat=True
-                )
-                subscribers = subscribers.exclude(
-                    **{f"{field_to_migrate}__in": skip_values}
-                )
-                for subscriber in subscribers:
-                    self._check_data_in_clients(subscriber, writer, data["fields"])
-
-    def _check_data_in_clients(self, subscriber, writer, fields):
-        field_to_migrate = fields["field_to_migrate"]
-        field_to_check = fields["field_to_check"]
-
-        # should be impletmented in this way to reduce the number of queries
-        # clients = Client.objects.filter(
-        #     **{f'{field_to_migrate}__in': [
-        #         getattr(subscriber, field_to_migrate)
-        #         for subscriber in subscribers
-        #     ]}
-        # )
-        try:
-            client = Client.objects.get(
-                **{field_to_migrate: getattr(subscriber, field_to_migrate)}
+
+    def _staged_keys(self):
+        return StagedKeys() if self._staging else None
+
+    def _shared_lookups(self, staging):
+        """
+        Return lookups shared by resolvers of a group of whole tables or None if
+        every resolver looks clients and users up by itself.
+        """
+        if not (
+            self._share_lookups and issubclass(self._resolver_class, InMemoryResolver)
+        ):
+            return None
+        raw = issubclass(self._resolver_class, RawResolver)
+        return SharedLookups(self._users, staging, raw=raw)
+
+    def _migrate_whole_tables(self, sources):
+        """
+        Migrate whole tables of (source, checkpoint) pairs together.
+        """
+        sources = [
+            (source, checkpoint)
+            for source, checkpoint in sources
+            if not checkpoint.finished
+        ]
+        if not sources:
+            return
+        staging = self._staged_keys()
+        lookups = self._shared_lookups(staging)
+        with ExitStack() as stack:
+            steps = [
+                stack.enter_context(self._step(source, checkpoint, staging, lookups))
+                for source, checkpoint in sources
+            ]
+            phase = "+".join(source.phase for source, _ in sources)
+            self._migrate_steps(phase, steps, lookups)
+
+    @contextmanager
+    def _step(self, source, checkpoint, staging, lookups=None, shard=None):
+        """
+        Yield step migrating the source from the checkpoint.
+        """
+        field = source.field_to_migrate
+        with self._conflicts.writer(
+            source.model, field, checkpoint, shard=shard
+        ) as write_conflicts, self._existing_index(field, lookups is None) as existing:
+            resolver = self._resolver_class(
+                source.fields,
+                self._users,
+                existing,
+                staging,
+                self._check_existing,
+                lookups,
             )
-            query_1 = Q(**{field_to_check: getattr(client, field_to_check)})
-            query_2 = Q(**{field_to_migrate: getattr(client, field_to_migrate)})
-            if User.objects.filter(query_1 & ~query_2).exists():
-                writer.writerow([subscriber.id, getattr(subscriber, field_to_migrate)])
-            elif not User.objects.filter(query_1 & ~query_2).exists():
-                user = User(
-                    email=client.email,
-                    phone=client.phone,
+            yield Step(source, checkpoint, resolver, write_conflicts)
+
+    @contextmanager
+    def _existing_index(self, field, enabled=True):
+        """
+        Yield index of keys of the field of users or None if it is turned off.
+        """
+        if not (self._key_index and self._check_existing and enabled):
+            yield None
+            return
+        alias = self._scan_alias([(User, self._run.last_user_id or None)])
+        keys = (
+            self._users.using(alias)
+            .annotate(key=raw_value(field))
+            .values_list("key", flat=True)
+        )
+        with KeyIndex.build(
+            keys.iterator(chunk_size=self._chunk_size), self._memory_budget
+        ) as index:
+            yield index
+
+    def _migrate_steps(self, phase, steps, lookups=None):
+        """
+        Migrate subscribers of steps in rounds of one chunk of every step.
+        """
+        with self._profiler.phase(phase) as stats, WriteBuffer(
+            self._loader, self._batch_size
+        ) as users_buffer, TransactionBatches(
+            self._transaction_size, self._synchronous_commit
+        ) as transactions:
+            rounds = _Rounds(
+                phase,
+                steps,
+                lookups,
+                users_buffer,
+                transactions,
+                stats,
+                self._failed_chunk,
+            )
+            chunks = zip_longest(*[self._extract(step) for step in steps])
+            if self._pipeline:
+                pipelined(
+                    chunks,
+                    rounds.resolve,
+                    rounds.write,
+                    finish=transactions.commit,
+                    execute_wrapper=stats if self._profiler.enabled else None,
                 )
-                self._users_batch.append(user)
-        except Client.DoesNotExist:
-            user = User(
-                email=getattr(subscriber, field_to_migrate),
-                gdpr_consent=subscriber.gdpr_consent,
+            else:
+                for round_chunks in chunks:
+                    rounds.write(rounds.resolve(round_chunks))
+        self.counters.update(rounds.counters)
+        for step in steps:
+            step.checkpoint.finished = True
+            step.checkpoint.save(update_fields=["finished"])
+
+    def _extract(self, step):
+        """
+        Return chunks of subscribers remaining for the checkpoint of the step.
+        """
+        model = step.source.model
+        alias = self._scan_alias([(model, step.checkpoint.watermark_id)])
+        remaining = step.checkpoint.remaining(subscribers(model, self._incremental))
+        return self._subscribers_chunks(step.resolver.rows(remaining.using(alias)))
+
+    def _failed_chunk(self, step, chunk):
+        """
+        Return resolved chunk which could not be written with its subscribers
+        reported as conflicts instead of users.
+        """
+        self._warn(
+            f"Could not write {step.checkpoint.phase} with ids from "
+            f"{chunk[0].pk} to {chunk[-1].pk}, reported as conflicts."
+        )
+        conflicts = [
+            (
+                subscriber.pk,
+                step.resolver.key(subscriber),
+                MigrationConflict.WRITE_ERROR,
+            )
+            for subscriber in chunk
+        ]
+        return step, chunk, [], conflicts
+
+    def _scan_alias(self, rows):
+        """
+        Return database alias for scans of rows up to (model, pk) pairs.
+        """
+        return scan_alias(self._read_alias, self._max_replica_lag, rows, self._warn)
+
+    def _subscribers_chunks(self, subscribers):
+        if self._stream:
+            return keyset_chunks(subscribers, self._chunk_size)
+        subscribers = subscribers.order_by("pk").iterator(chunk_size=self._chunk_size)
+        return chunked(subscribers, self._chunk_size)
+
+    def _migrate_in_shards(self, index, source, checkpoints):
+        tasks = [
+            (self._options, index, checkpoint.pk)
+            for checkpoint in checkpoints
+            if not checkpoint.finished
+        ]
+        if not tasks:
+            return
+        # queries of shards are profiled by the shards themselves
+        with self._profiler.phase(source.phase, capture_queries=False):
+            if self._workers > 1:
+                results = run_in_processes(migrate_shard, tasks, self._workers)
+            else:
+                results = [migrate_shard(*task) for task in tasks]
+        for result in results:
+            self.counters.update(result["counters"])
+            self._profiler.merge(result["profile"]["phases"])
+        shards = [checkpoint.start_id for checkpoint in checkpoints]
+        self._conflicts.merge(source.model, source.field_to_migrate, shards)
+
+
+class _Rounds:
+    """
+    Rounds of one chunk of every step of a phase.
+
+    Chunks of a round are resolved with the optional lookups shared by all steps
+    and loaded in one transaction.
+    """
+
+    def __init__(
+        self, phase, steps, lookups, users_buffer, transactions, stats, failed_chunk
+    ):
+        self._phase = phase
+        self._steps = steps
+        self._lookups = lookups
+        self._users_buffer = users_buffer
+        self._transactions = transactions
+        self._stats = stats
+        self._failed_chunk = failed_chunk
+        self.counters = Counter()
+
+    def resolve(self, chunks):
+        extracted = [(step, chunk) for step, chunk in zip(self._steps, chunks) if chunk]
+        if self._lookups is not None:
+            self._load_lookups(extracted)
+        return [
+            (step, chunk, *step.resolver.resolve(chunk)) for step, chunk in extracted
+        ]
+
+    def write(self, resolved):
+        """
+        Load the resolved round, if it fails load it again with chunks replaced
+        by their failed versions.
+        """
+        written = self._users_buffer.written
+        if not self._transactions(self._load, resolved):
+            # offsets of conflicts of the rolled back round are dropped as well
+            for step, _, _, _ in resolved:
+                step.checkpoint.refresh_from_db(fields=["last_id", "conflicts_offset"])
+            resolved = [
+                self._failed_chunk(step, chunk) for step, chunk, _, _ in resolved
+            ]
+            written = self._users_buffer.written
+            if not self._transactions(self._load, resolved):
+                raise CommandError(f"Could not write {self._phase}.")
+        # loaders skipping existing users create less users than resolved
+        created = self._users_buffer.written - written
+        conflicts = sum(len(conflicts) for _, _, _, conflicts in resolved)
+        self.counters.update(created=created, conflicts=conflicts)
+        self._stats.rows_read += sum(len(chunk) for _, chunk, _, _ in resolved)
+        self._stats.rows_written += created
+
+    def _load_lookups(self, extracted):
+        values = defaultdict(list)
+        for step, chunk in extracted:
+            values[step.source.field_to_migrate].extend(
+                step.resolver.key(subscriber) for subscriber in chunk
             )
-            self._users_batch.append(user)
-        except Client.MultipleObjectsReturned:
-            writer.writerow([subscriber.id, getattr(subscriber, field_to_migrate)])
-
-    def _create_users(self):
-        if self._users_batch:
-            while True:
-                batch = list(islice(self._users_batch, BATCH_SIZE))
-                if not batch:
-                    break
-                User.objects.bulk_create(batch, BATCH_SIZE)
+        self._lookups.load(values)
+
+    def _load(self, resolved):
+        # users of the round are committed together with the checkpoints, which
+        # record the offset of conflicts written after the users, so resumed
+        # files get only conflicts of chunks which have been committed
+        for step, chunk, users, conflicts in resolved:
+            self._users_buffer.extend(users)
+        self._users_buffer.flush()
+        for step, chunk, users, conflicts in resolved:
+            step.checkpoint.conflicts_offset = step.write_conflicts(conflicts)
+            step.checkpoint.last_id = chunk[-1].pk
+            step.checkpoint.save(update_fields=["last_id", "conflicts_offset"])
+            # bulk inserts do not send signals which invalidate cached consents
+            invalidate_consents(consent_keys(users))
+
+
+def user_loader(options):
+    """
+    Return loader of users chosen by options.
+
+    Users created by a previous phase are skipped instead of failing the chunk on
+    unique keys, only the upsert counts them exactly.
+    """
+    return LOADERS[options["loader"]](
+        User, options["batch_size"], ignore_conflicts=True
+    )
+
+
+def conflict_sink(options):
+    """
+    Return sink of conflicts chosen by options.
+    """
+    if options["conflicts"] == CONFLICTS_TABLE:
+        loader = LOADERS[options["loader"]](MigrationConflict, options["batch_size"])
+        return TableConflictSink(loader)
+    return FileConflictSink(compress=options["gzip"])
+
+
+def subscribers(model, incremental):
+    """
+    Return subscribers of the model, in the incremental mode only these created
+    after the last finished run.
+    """
+    objects = model.objects.all()
+    if incremental:
+        watermark = MigrationCheckpoint.objects.last_watermark(
+            COMMAND, model._meta.label
+        )
+        objects = after_watermark(objects, watermark)
+    return objects
+
+
+def migrate_shard(options, index, checkpoint_id):
+    """
+    Migrate subscribers from the range of the checkpoint in a worker process.
+    """
+    checkpoint = MigrationCheckpoint.objects.select_related("run").get(pk=checkpoint_id)
+    profiler = make_profiler(options["profile"], {"pools": pool_stats})
+    migration = Migration(
+        options, checkpoint.run, profiler, OutputWrapper(sys.stderr).write
+    )
+    return migration.migrate_shard(SOURCES[index], checkpoint)
+
+
+def _together(pairs):
+    """
+    Group all whole tables to migrate them with shared lookups.
+    """
+    return [pairs] if pairs else []
+
+
+def _apart(pairs):
+    """
+    Group every whole table alone to migrate it with lookups of its resolver.
+    """
+    return [[pair] for pair in pairs]
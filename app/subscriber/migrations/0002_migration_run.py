@@ -0,0 +1,39 @@
+# Generated by Django 2.2.6 on 2026-10-18 14:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriber', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MigrationRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('command', models.CharField(max_length=100)),
+                ('last_user_id', models.IntegerField(default=0)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='MigrationCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phase', models.CharField(max_length=100)),
+                ('start_id', models.IntegerField(blank=True, null=True)),
+                ('end_id', models.IntegerField(blank=True, null=True)),
+                ('last_id', models.IntegerField(blank=True, null=True)),
+                ('finished', models.BooleanField(default=False)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='subscriber.MigrationRun')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.6 on 2026-10-18 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriber', '0002_migration_run'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='migrationcheckpoint',
+            name='watermark_created',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='migrationcheckpoint',
+            name='watermark_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.6 on 2026-10-18 15:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriber', '0003_created_watermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MigrationConflict',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=100)),
+                ('source_id', models.IntegerField()),
+                ('key', models.CharField(max_length=254)),
+                ('reason', models.CharField(choices=[('user_clash', 'User with the checked field of the client exists'), ('multiple_clients', 'Many clients match the subscriber')], max_length=20)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conflicts', to='subscriber.MigrationRun')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='migrationconflict',
+            index=models.Index(fields=['source', 'source_id'], name='conflict_source_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='migrationconflict',
+            index=models.Index(fields=['key'], name='conflict_key_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.6 on 2026-10-18 15:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriber', '0004_migration_conflict'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='migrationconflict',
+            name='reason',
+            field=models.CharField(choices=[('user_clash', 'User with the checked field of the client exists'), ('multiple_clients', 'Many clients match the subscriber'), ('write_error', 'Chunk of the subscriber could not be written')], max_length=20),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.6 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+from commons.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('subscriber', '0006_migration_conflict_merged_duplicate'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='subscriber',
+            index=models.Index(fields=['created', 'id'], name='subscriber_created_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='subscribersms',
+            index=models.Index(fields=['created', 'id'], name='subscribersms_created_id_idx'),
+        ),
+    ]
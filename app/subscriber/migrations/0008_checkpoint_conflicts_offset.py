@@ -0,0 +1,18 @@
+# Generated by Django 2.2.6 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscriber', '0007_created_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='migrationcheckpoint',
+            name='conflicts_offset',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
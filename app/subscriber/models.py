@@ -3,6 +3,7 @@ from django.db import models
 from phonenumber_field.modelfields import PhoneNumberField
 
 from commons.models import AbstractTimeStampedModel
+from commons.watermarks import up_to_watermark
 
 
 class AbstractSubscriber(AbstractTimeStampedModel):
@@ -15,6 +16,123 @@ class AbstractSubscriber(AbstractTimeStampedModel):
 class Subscriber(AbstractSubscriber):
     email = models.EmailField(unique=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["created", "id"], name="subscriber_created_id_idx")
+        ]
+
 
 class SubscriberSMS(AbstractSubscriber):
     phone = PhoneNumberField(unique=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created", "id"], name="subscribersms_created_id_idx")
+        ]
+
+
+class MigrationRun(AbstractTimeStampedModel):
+    """
+    State of a single run of a migration command, which lets it be resumed.
+    """
+
+    command = models.CharField(max_length=100)
+    # users with greater ids were created by the run itself
+    last_user_id = models.IntegerField(default=0)
+    finished = models.DateTimeField(null=True, blank=True)
+
+
+class MigrationCheckpointQuerySet(models.QuerySet):
+    def last_watermark(self, command, phase):
+        """
+        Return watermark of the phase from the last finished run of the command.
+        """
+        run = (
+            MigrationRun.objects.filter(command=command, finished__isnull=False)
+            .order_by("pk")
+            .last()
+        )
+        if run is None:
+            return None
+        checkpoint = (
+            self.filter(run=run, phase=phase, watermark_id__isnull=False)
+            .order_by("watermark_created", "watermark_id")
+            .last()
+        )
+        return None if checkpoint is None else checkpoint.watermark
+
+
+class MigrationCheckpoint(models.Model):
+    """
+    Last committed id of the source model within the range of ids handled by
+    a phase of a migration run.
+
+    The watermark is the (created, id) of the newest object of the source model
+    when the phase started. The phase handles objects up to the watermark and the
+    next incremental run starts right after it.
+    """
+
+    run = models.ForeignKey(
+        MigrationRun, related_name="checkpoints", on_delete=models.CASCADE
+    )
+    phase = models.CharField(max_length=100)
+    start_id = models.IntegerField(null=True, blank=True)
+    end_id = models.IntegerField(null=True, blank=True)
+    last_id = models.IntegerField(null=True, blank=True)
+    finished = models.BooleanField(default=False)
+    watermark_created = models.DateTimeField(null=True, blank=True)
+    watermark_id = models.IntegerField(null=True, blank=True)
+    # end of conflicts of committed chunks in the conflicts file
+    conflicts_offset = models.BigIntegerField(null=True, blank=True)
+
+    objects = MigrationCheckpointQuerySet.as_manager()
+
+    @property
+    def watermark(self):
+        if self.watermark_id is None:
+            return None
+        return self.watermark_created, self.watermark_id
+
+    def remaining(self, queryset):
+        """
+        Return objects from queryset which have not been handled yet.
+        """
+        if self.start_id is not None:
+            queryset = queryset.filter(pk__gte=self.start_id)
+        if self.end_id is not None:
+            queryset = queryset.filter(pk__lt=self.end_id)
+        if self.last_id is not None:
+            queryset = queryset.filter(pk__gt=self.last_id)
+        return up_to_watermark(queryset, self.watermark)
+
+
+class MigrationConflict(models.Model):
+    """
+    Subscriber which could not be migrated to a user by a migration run or
+    contact of a duplicate user dropped when users were merged.
+    """
+
+    USER_CLASH = "user_clash"
+    MULTIPLE_CLIENTS = "multiple_clients"
+    WRITE_ERROR = "write_error"
+    MERGED_DUPLICATE = "merged_duplicate"
+    REASONS = [
+        (USER_CLASH, "User with the checked field of the client exists"),
+        (MULTIPLE_CLIENTS, "Many clients match the subscriber"),
+        (WRITE_ERROR, "Chunk of the subscriber could not be written"),
+        (MERGED_DUPLICATE, "Contact of a merged duplicate user was dropped"),
+    ]
+
+    run = models.ForeignKey(
+        MigrationRun, related_name="conflicts", on_delete=models.CASCADE
+    )
+    source = models.CharField(max_length=100)
+    source_id = models.IntegerField()
+    key = models.CharField(max_length=254)
+    reason = models.CharField(max_length=20, choices=REASONS)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["source", "source_id"], name="conflict_source_idx"),
+            models.Index(fields=["key"], name="conflict_key_idx"),
+        ]
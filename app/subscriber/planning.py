@@ -0,0 +1,190 @@
+from django.db import connections
+from django.db.models import (
+    BooleanField,
+    Case,
+    CharField,
+    Count,
+    Exists,
+    F,
+    IntegerField,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Lower
+
+from subscriber.models import MigrationConflict, Subscriber, SubscriberSMS
+from user.models import Client
+
+
+SAMPLE_SIZE = 10
+
+CREATE = "create"
+SKIP = "skip"
+UPDATE = "update"
+UNCHANGED = "unchanged"
+
+MIGRATION_OUTCOMES = [
+    CREATE,
+    SKIP,
+    MigrationConflict.USER_CLASH,
+    MigrationConflict.MULTIPLE_CLIENTS,
+]
+CONSENT_OUTCOMES = [UPDATE, UNCHANGED]
+
+PLAN_SQL = """
+SELECT outcome, count, plan_pk FROM (
+    SELECT
+        outcome,
+        plan_pk,
+        COUNT(*) OVER (PARTITION BY outcome) AS count,
+        ROW_NUMBER() OVER (PARTITION BY outcome ORDER BY plan_pk) AS position
+    FROM ({outcomes}) AS outcomes
+) AS ranked
+WHERE position <= %s
+ORDER BY outcome, plan_pk
+"""
+
+
+def migration_plan(subscribers, fields, users, sample_size=SAMPLE_SIZE):
+    """
+    Return numbers and sample ids of subscribers which would be skipped, migrated
+    to new users or reported as conflicts.
+
+    The decisions of the resolvers are expressed with correlated subqueries, so
+    subscribers are counted by the database without loading them. Subscribers
+    with a user having the same unique key, e.g. the email in another case, are
+    skipped, because their users would not be inserted.
+    """
+    field_to_migrate = fields["field_to_migrate"]
+    field_to_check = fields["field_to_check"]
+    clients = Client.objects.filter(**{field_to_migrate: OuterRef(field_to_migrate)})
+    subscribers = subscribers.annotate(
+        existing=Exists(
+            users.filter(**_key_lookup(field_to_migrate, OuterRef(field_to_migrate)))
+        ),
+        clients=Coalesce(
+            Subquery(
+                clients.order_by()
+                .values(field_to_migrate)
+                .annotate(count=Count("pk"))
+                .values("count"),
+                output_field=IntegerField(),
+            ),
+            0,
+        ),
+        client_check=Subquery(clients.values(field_to_check)[:1]),
+    )
+    subscribers = subscribers.annotate(
+        clash=Exists(
+            users.filter(
+                Q(**{field_to_check: OuterRef("client_check")})
+                & ~Q(**{field_to_migrate: OuterRef(field_to_migrate)})
+            )
+        ),
+        taken=Exists(
+            users.filter(**_key_lookup(field_to_check, OuterRef("client_check")))
+        ),
+    ).annotate(
+        outcome=Case(
+            When(existing=True, then=Value(SKIP)),
+            When(clients=0, then=Value(CREATE)),
+            When(clients__gt=1, then=Value(MigrationConflict.MULTIPLE_CLIENTS)),
+            When(clash=True, then=Value(MigrationConflict.USER_CLASH)),
+            # the unique key of the checked field skips the insert of the user
+            When(taken=True, then=Value(SKIP)),
+            default=Value(CREATE),
+            output_field=CharField(),
+        )
+    )
+    return _plan(subscribers, MIGRATION_OUTCOMES, sample_size)
+
+
+def consents_plan(users, sample_size=SAMPLE_SIZE):
+    """
+    Return numbers and sample ids of users matching subscribers created after
+    them, whose consents would be updated or stay unchanged.
+    """
+    subscribers = Subscriber.objects.filter(
+        email=OuterRef("email"), created__gt=OuterRef("created")
+    )
+    subscribers_sms = SubscriberSMS.objects.filter(
+        phone=OuterRef("phone"), created__gt=OuterRef("created")
+    )
+    users = users.annotate(
+        subscriber_created=Subquery(subscribers.values("created")[:1]),
+        subscriber_consent=Subquery(subscribers.values("gdpr_consent")[:1]),
+        subscriber_sms_created=Subquery(subscribers_sms.values("created")[:1]),
+        subscriber_sms_consent=Subquery(subscribers_sms.values("gdpr_consent")[:1]),
+    )
+    # the newest subscriber wins and SubscriberSMS wins a tie
+    users = users.annotate(
+        consent=Case(
+            When(subscriber_sms_created__isnull=True, then=F("subscriber_consent")),
+            When(subscriber_created__isnull=True, then=F("subscriber_sms_consent")),
+            When(
+                subscriber_created__gt=F("subscriber_sms_created"),
+                then=F("subscriber_consent"),
+            ),
+            default=F("subscriber_sms_consent"),
+            output_field=BooleanField(),
+        )
+    ).filter(consent__isnull=False)
+    users = users.annotate(
+        outcome=Case(
+            When(consent=F("gdpr_consent"), then=Value(UNCHANGED)),
+            default=Value(UPDATE),
+            output_field=CharField(),
+        )
+    )
+    return _plan(users, CONSENT_OUTCOMES, sample_size)
+
+
+def _key_lookup(field, value):
+    """
+    Return lookup of users with the unique key of the field equal to the key of
+    the value.
+    """
+    if field == "email":
+        return {"email_key": Lower(value)}
+    return {field: value}
+
+
+def _plan(queryset, outcomes, sample_size):
+    """
+    Count objects by outcome and take samples of their ids in a single scan of
+    the queryset, ranking objects of every outcome with window functions.
+    """
+    sql, params = (
+        queryset.order_by()
+        .values("outcome", plan_pk=F("pk"))
+        .query.get_compiler(queryset.db)
+        .as_sql()
+    )
+    counts = {outcome: 0 for outcome in outcomes}
+    samples = {outcome: [] for outcome in outcomes}
+    with connections[queryset.db].cursor() as cursor:
+        # the first object of every outcome carries its count
+        cursor.execute(PLAN_SQL.format(outcomes=sql), [*params, max(sample_size, 1)])
+        for outcome, count, pk in cursor.fetchall():
+            counts[outcome] = count
+            samples[outcome].append(pk)
+    return [
+        {
+            "outcome": outcome,
+            "count": counts[outcome],
+            "sample": samples[outcome][:sample_size],
+        }
+        for outcome in outcomes
+    ]
+
+
+def plan_lines(phase, plan):
+    """
+    Yield lines describing outcomes of the plan of the phase.
+    """
+    for row in plan:
+        sample = ", ".join(str(pk) for pk in row["sample"])
+        yield f"{phase} {row['outcome']}: {row['count']} (sample ids: {sample})"
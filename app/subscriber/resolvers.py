@@ -0,0 +1,401 @@
+from abc import ABC, abstractmethod
+from collections import defaultdict, namedtuple
+
+from django.db.models import Q
+
+from commons.utils import lookup_key, phone_number, raw_value
+from subscriber.models import MigrationConflict
+from user.models import Client, User
+
+
+class Conflict(Exception):
+    """
+    Raised when subscriber can not be migrated, with the reason of the conflict.
+    """
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class BaseResolver(ABC):
+    """
+    Base resolver responsible for deciding what should happen with subscribers:
+    skip them, create a new user or report them as conflicts.
+
+    Users are looked up in the users queryset, which lets the caller hide users
+    created during the migration. The optional existing index with keys of the
+    migrated field of these users lets the resolver query only for subscribers
+    which may already have a user. Without check_existing only subscribers in
+    conflict are looked up, for writers which skip existing users themselves.
+    Values of the chunk are matched with lists of values or with the optional
+    staging table holding them. Resolvers which match chunks in memory can share
+    clients and users loaded by SharedLookups for chunks of all sources.
+    """
+
+    def __init__(
+        self,
+        fields,
+        users=None,
+        existing=None,
+        staging=None,
+        check_existing=True,
+        lookups=None,
+    ):
+        self._field_to_migrate = fields["field_to_migrate"]
+        self._field_to_check = fields["field_to_check"]
+        self._users = User.objects.all() if users is None else users
+        self._existing = existing
+        self._staging = staging
+        self._check_existing = check_existing
+        self._lookups = lookups
+
+    def rows(self, subscribers):
+        """
+        Return queryset of subscribers in the form expected by resolve.
+        """
+        return subscribers
+
+    def resolve(self, subscribers):
+        """
+        Return users which should be created and conflicts as tuples with id and
+        migrated value of the subscriber and the reason of the conflict.
+        """
+        values = [self._value(subscriber) for subscriber in subscribers]
+        existing = self._existing_keys(values) if self._check_existing else set()
+        self._prepare(values)
+        users, conflicts, conflicted = self._resolve_all(
+            [
+                subscriber
+                for subscriber in subscribers
+                if self.key(subscriber) not in existing
+            ]
+        )
+        if conflicts and not self._check_existing:
+            # subscribers with a user are skipped rather than reported
+            existing = self._existing_keys(conflicted)
+            conflicts = [
+                conflict for conflict in conflicts if conflict[1] not in existing
+            ]
+        return users, conflicts
+
+    def _resolve_all(self, subscribers):
+        """
+        Return users, conflicts and migrated values of subscribers in conflict.
+        """
+        users, conflicts, conflicted = [], [], []
+        for subscriber in subscribers:
+            try:
+                users.append(self._resolve_subscriber(subscriber))
+            except Conflict as conflict:
+                conflicts.append((subscriber.pk, self.key(subscriber), conflict.reason))
+                conflicted.append(self._value(subscriber))
+        return users, conflicts, conflicted
+
+    def key(self, subscriber):
+        """
+        Return migrated value of the subscriber as stored in the database.
+        """
+        return lookup_key(self._value(subscriber))
+
+    def _value(self, subscriber):
+        return getattr(subscriber, self._field_to_migrate)
+
+    def _existing_keys(self, values):
+        if self._lookups is not None:
+            return self._lookups.existing_keys(self._field_to_migrate)
+        if self._existing is not None:
+            # keys found in the index are verified with the query below
+            values = [value for value in values if lookup_key(value) in self._existing]
+            if not values:
+                return set()
+        users = self._values_list(
+            self._users, self._field_to_migrate, values, self._field_to_migrate
+        )
+        return {lookup_key(value) for (value,) in users}
+
+    def _values_list(self, queryset, field, values, *fields):
+        """
+        Return values of fields of objects from queryset with field in values.
+        """
+        return queryset.filter(**{f"{field}__in": self._in(values)}).values_list(
+            *fields
+        )
+
+    def _in(self, values):
+        """
+        Return right hand side of the IN lookup matching values.
+        """
+        return values if self._staging is None else self._staging(values)
+
+    def _prepare(self, values):
+        pass
+
+    @abstractmethod
+    def _resolve_subscriber(self, subscriber):
+        """
+        Return user which should be created or raise Conflict.
+        """
+
+    def _subscriber_user(self, subscriber):
+        return User(
+            **{
+                self._field_to_migrate: self._value(subscriber),
+                "gdpr_consent": subscriber.gdpr_consent,
+            }
+        )
+
+    def _client_user(self, client):
+        return User(email=client.email, phone=client.phone)
+
+
+class QueryResolver(BaseResolver):
+    """
+    Resolver responsible for checking every subscriber with separate queries.
+    """
+
+    def _resolve_subscriber(self, subscriber):
+        client = self._client(subscriber)
+        if client is None:
+            return self._subscriber_user(subscriber)
+        query_1 = Q(**{self._field_to_check: getattr(client, self._field_to_check)})
+        query_2 = Q(**{self._field_to_migrate: getattr(client, self._field_to_migrate)})
+        if self._users.filter(query_1 & ~query_2).exists():
+            raise Conflict(MigrationConflict.USER_CLASH)
+        return self._client_user(client)
+
+    def _client(self, subscriber):
+        """
+        Return the only client with the migrated value of the subscriber or None.
+        """
+        try:
+            return Client.objects.get(
+                **{self._field_to_migrate: getattr(subscriber, self._field_to_migrate)}
+            )
+        except Client.DoesNotExist:
+            return None
+        except Client.MultipleObjectsReturned:
+            raise Conflict(MigrationConflict.MULTIPLE_CLIENTS)
+
+
+class InMemoryResolver(BaseResolver):
+    """
+    Resolver responsible for deciding about the whole chunk of subscribers at once.
+
+    Users and clients related with the chunk are loaded with a constant number of
+    queries into hash indexes and subscribers are matched with them in memory.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._clients = {}
+        self._taken = {}
+
+    def _prepare(self, values):
+        if self._lookups is not None:
+            self._clients = self._lookups.clients(self._field_to_migrate)
+            self._taken = self._lookups.taken_keys(
+                self._field_to_check, self._field_to_migrate
+            )
+            return
+        self._clients = self._clients_index(values)
+        self._taken = self._taken_keys(self._clients)
+
+    def _clients_index(self, values):
+        clients = defaultdict(list)
+        for client in Client.objects.filter(
+            **{f"{self._field_to_migrate}__in": self._in(values)}
+        ):
+            clients[lookup_key(getattr(client, self._field_to_migrate))].append(client)
+        return clients
+
+    def _taken_keys(self, clients):
+        """
+        Map value of the checked field to values of the migrated field for users
+        which could be in conflict with clients.
+        """
+        check_values = [
+            getattr(matched[0], self._field_to_check)
+            for matched in clients.values()
+            if len(matched) == 1
+        ]
+        taken = defaultdict(set)
+        users = self._values_list(
+            self._users,
+            self._field_to_check,
+            check_values,
+            self._field_to_check,
+            self._field_to_migrate,
+        )
+        for check_value, migrate_value in users:
+            taken[lookup_key(check_value)].add(lookup_key(migrate_value))
+        return taken
+
+    def _resolve_subscriber(self, subscriber):
+        clients = self._clients.get(lookup_key(self._value(subscriber)), [])
+        if len(clients) > 1:
+            raise Conflict(MigrationConflict.MULTIPLE_CLIENTS)
+        if not clients:
+            return self._subscriber_user(subscriber)
+        client = clients[0]
+        check_key = lookup_key(getattr(client, self._field_to_check))
+        migrate_key = lookup_key(getattr(client, self._field_to_migrate))
+        if self._taken.get(check_key, set()) - {migrate_key}:
+            raise Conflict(MigrationConflict.USER_CLASH)
+        return self._client_user(client)
+
+
+ClientRow = namedtuple("ClientRow", ["email", "phone"])
+
+_USER_FIELDS = ["email", "phone"]
+
+
+class RawResolver(InMemoryResolver):
+    """
+    In-memory resolver working on raw values of columns instead of model instances.
+
+    Subscribers, clients and users are read as tuples of strings stored in the
+    database, so phone numbers are compared as E.164 strings without parsing
+    them. Models are instantiated only for users which are created and phone
+    numbers of these users are parsed with a bounded cache.
+    """
+
+    def rows(self, subscribers):
+        return subscribers.annotate(key=raw_value(self._field_to_migrate)).values_list(
+            "pk", "key", "gdpr_consent", named=True
+        )
+
+    def _value(self, subscriber):
+        return subscriber.key
+
+    def _values_list(self, queryset, field, values, *fields):
+        raw_fields = {f"raw_{name}": raw_value(name) for name in {field, *fields}}
+        return (
+            queryset.annotate(**raw_fields)
+            .filter(**{f"raw_{field}__in": self._in(values)})
+            .values_list(*[f"raw_{name}" for name in fields])
+        )
+
+    def _clients_index(self, values):
+        clients = defaultdict(list)
+        rows = self._values_list(
+            Client.objects.all(), self._field_to_migrate, values, "email", "phone"
+        )
+        for client in map(ClientRow._make, rows):
+            clients[lookup_key(getattr(client, self._field_to_migrate))].append(client)
+        return clients
+
+    def _subscriber_user(self, subscriber):
+        value = subscriber.key
+        if self._field_to_migrate == "phone":
+            value = phone_number(value)
+        return User(
+            **{self._field_to_migrate: value, "gdpr_consent": subscriber.gdpr_consent}
+        )
+
+    def _client_user(self, client):
+        return User(email=client.email, phone=phone_number(client.phone))
+
+
+class SharedLookups:
+    """
+    Clients and users related with chunks of all sources read in one round.
+
+    Clients with any of the migrated values of the round are loaded with one
+    query and users with these values or with values of the loaded clients with
+    another one, so resolvers of all sources are prepared from the same rows
+    instead of querying clients and users for every source. Clients are loaded
+    as models or as raw rows for RawResolver.
+    """
+
+    def __init__(self, users=None, staging=None, raw=False):
+        self._users = User.objects.all() if users is None else users
+        self._staging = staging
+        self._raw = raw
+        self._clients = {}
+        self._user_rows = []
+
+    def load(self, values):
+        """
+        Load clients and users for keys of migrated values by field.
+        """
+        keys = {
+            field: {lookup_key(value) for value in values[field]} for field in values
+        }
+        clients = self._load_clients(keys)
+        self._clients = {field: defaultdict(list) for field in keys}
+        for client in clients:
+            self._add_client(client, keys)
+        self._user_rows = list(
+            self._filter(self._users, self._user_keys(keys, clients)).values_list(
+                "raw_email", "raw_phone"
+            )
+        )
+
+    def _load_clients(self, keys):
+        """
+        Return clients with any of the keys as models or as raw rows.
+        """
+        clients = self._filter(Client.objects.all(), keys)
+        if not self._raw:
+            return list(clients)
+        return list(map(ClientRow._make, clients.values_list("raw_email", "raw_phone")))
+
+    def _add_client(self, client, keys):
+        for field in keys:
+            key = lookup_key(getattr(client, field))
+            if key in keys[field]:
+                self._clients[field][key].append(client)
+
+    def _user_keys(self, keys, clients):
+        """
+        Return keys of users to load by field, users with values of clients can
+        clash with them.
+        """
+        user_keys = {field: set(keys.get(field, ())) for field in _USER_FIELDS}
+        for client in clients:
+            for field in user_keys:
+                user_keys[field].add(lookup_key(getattr(client, field)))
+        return user_keys
+
+    def clients(self, field):
+        """
+        Return clients of the round by key of the field.
+        """
+        return self._clients[field]
+
+    def existing_keys(self, field):
+        """
+        Return keys of the field of users of the round.
+        """
+        index = _USER_FIELDS.index(field)
+        return {lookup_key(row[index]) for row in self._user_rows}
+
+    def taken_keys(self, field_to_check, field_to_migrate):
+        """
+        Map value of the checked field to values of the migrated field for users
+        of the round, like InMemoryResolver does for its chunk.
+        """
+        check = _USER_FIELDS.index(field_to_check)
+        migrate = _USER_FIELDS.index(field_to_migrate)
+        taken = defaultdict(set)
+        for row in self._user_rows:
+            taken[lookup_key(row[check])].add(lookup_key(row[migrate]))
+        return taken
+
+    def _filter(self, queryset, keys):
+        """
+        Return objects from queryset with a raw value of any field among keys.
+        """
+        keys = {field: values for field, values in keys.items() if values}
+        if self._staging is not None:
+            # a single table holds keys of all fields, emails never look like phones
+            staged = self._staging(set().union(*keys.values()))
+            keys = {field: staged for field in keys}
+        query = Q()
+        for field, values in keys.items():
+            query |= Q(**{f"raw_{field}__in": values})
+        queryset = queryset.annotate(
+            raw_email=raw_value("email"), raw_phone=raw_value("phone")
+        )
+        return queryset.filter(query) if query else queryset.none()
@@ -0,0 +1,34 @@
+from subscriber.models import Subscriber, SubscriberSMS
+
+
+class Source:
+    """
+    Channel of subscribers migrated to users.
+
+    Subscribers of the model are matched with clients and users by the migrated
+    field, which is copied to new users, while the checked field of a matched
+    client must not belong to another user. Adding a channel to SOURCES is
+    enough to migrate it with every resolver, loader and mode of the command.
+    """
+
+    def __init__(self, model, field_to_migrate, field_to_check):
+        self.model = model
+        self.field_to_migrate = field_to_migrate
+        self.field_to_check = field_to_check
+
+    @property
+    def phase(self):
+        return self.model._meta.label
+
+    @property
+    def fields(self):
+        return {
+            "field_to_migrate": self.field_to_migrate,
+            "field_to_check": self.field_to_check,
+        }
+
+
+SOURCES = [
+    Source(Subscriber, field_to_migrate="email", field_to_check="phone"),
+    Source(SubscriberSMS, field_to_migrate="phone", field_to_check="email"),
+]
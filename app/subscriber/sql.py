@@ -0,0 +1,96 @@
+from django.db import connection
+from django.db.models import Max, Min
+
+from commons.staging import RawSubquery
+from subscriber.models import Subscriber, SubscriberSMS
+from user.consents import invalidate_consents
+from user.models import User
+
+
+UPDATE_CONSENTS_SQL = """
+WITH chunk AS (
+    SELECT u.id, u.email, u.phone, u.created
+    FROM {user} AS u
+    WHERE u.id >= %s AND u.id < %s AND u.id IN ({users})
+)
+UPDATE {user} AS u
+SET gdpr_consent = latest.gdpr_consent
+FROM (
+    SELECT DISTINCT ON (consents.user_id) consents.user_id, consents.gdpr_consent
+    FROM (
+        SELECT c.id AS user_id, s.gdpr_consent, s.created, 0 AS priority
+        FROM chunk AS c
+        JOIN {subscriber} AS s ON s.email = c.email AND s.created > c.created
+        UNION ALL
+        SELECT c.id AS user_id, s.gdpr_consent, s.created, 1 AS priority
+        FROM chunk AS c
+        JOIN {subscriber_sms} AS s ON s.phone = c.phone AND s.created > c.created
+    ) AS consents
+    ORDER BY consents.user_id, consents.created DESC, consents.priority DESC
+) AS latest
+WHERE u.id = latest.user_id AND u.gdpr_consent IS DISTINCT FROM latest.gdpr_consent
+RETURNING u.email, u.phone
+"""
+
+MATCHED_USERS_SQL = """
+SELECT u.id FROM {user} AS u JOIN {subscriber} AS s ON s.email = u.email
+UNION
+SELECT u.id FROM {user} AS u JOIN {subscriber_sms} AS s ON s.phone = u.phone
+"""
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def update_consents_sql(users):
+    """
+    Return statement which copies the newest consent of subscribers to users from
+    the queryset with ids from a range and its params without the range bounds.
+
+    Consent of a subscriber wins only if it was created after the user. When both
+    Subscriber and SubscriberSMS are newer the latest one wins and SubscriberSMS
+    wins a tie, the same as in the Python implementation of the command.
+    """
+    users_sql, users_params = users.values("pk").query.sql_with_params()
+    sql = UPDATE_CONSENTS_SQL.format(
+        user=_table(User),
+        users=users_sql,
+        subscriber=_table(Subscriber),
+        subscriber_sms=_table(SubscriberSMS),
+    )
+    return sql, list(users_params)
+
+
+def matched_user_ids():
+    """
+    Return subquery selecting ids of users with the email of a subscriber or the
+    phone of an SMS subscriber, joining the tables instead of using IN lists.
+    """
+    sql = MATCHED_USERS_SQL.format(
+        user=_table(User),
+        subscriber=_table(Subscriber),
+        subscriber_sms=_table(SubscriberSMS),
+    )
+    return RawSubquery(sql, [])
+
+
+def update_consents(users, chunk_size):
+    """
+    Update consents of users from the queryset with one statement per range of
+    user ids.
+
+    Return number of updated users.
+    """
+    updated = 0
+    bounds = users.aggregate(first=Min("pk"), last=Max("pk"))
+    if bounds["first"] is None:
+        return updated
+    sql, params = update_consents_sql(users)
+    with connection.cursor() as cursor:
+        for start in range(bounds["first"], bounds["last"] + 1, chunk_size):
+            end = min(start + chunk_size, bounds["last"] + 1)
+            cursor.execute(sql, [start, end, *params])
+            updated += cursor.rowcount
+            invalidate_consents(cursor.fetchall())
+    return updated
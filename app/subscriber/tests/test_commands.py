@@ -1,20 +1,85 @@
+import csv
+import gzip
+import json
+import os
+import tempfile
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from functools import wraps
+from io import StringIO
+from unittest import skipUnless
 
 from django.conf import settings
-from django.core.management import call_command
-from django.db import connection, reset_queries
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, reset_queries, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 from freezegun import freeze_time
 from mock import Mock, patch
-
+from phonenumber_field.phonenumber import PhoneNumber
+
+from commons import loaders
+from commons.utils import phone_number
+from subscriber.benchmarks import dataset_exists, delete_dataset
+from subscriber.consents import newest_consents
+from subscriber.models import MigrationConflict, MigrationRun, Subscriber
+from subscriber.resolvers import QueryResolver
+from user.consents import EMAIL, PHONE, get_consent
 from user.models import User
 from user.tests.factories import ClientFactory, UserFactory
 
 from .factories import SubscriberFactory, SubscriberSMSFactory
 
 
-class CommandsMigrateSubscriberToUserTestCase(TestCase):
+# the SQL engine of migrate_missing_data_from_subscriber_to_user needs PostgreSQL
+SQL_ENGINES = [{"engine": "sql"}] if connection.vendor == "postgresql" else []
+
+
+@contextmanager
+def rolled_back():
+    """
+    Roll back changes made in the block, also when it succeeds.
+    """
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def in_temporary_directory(test_case):
+    """
+    Run the test in a temporary directory removed after it, so conflict files
+    written to the working directory do not leak between tests.
+    """
+    directory = tempfile.TemporaryDirectory()
+    test_case.addCleanup(directory.cleanup)
+    test_case.addCleanup(os.chdir, os.getcwd())
+    os.chdir(directory.name)
+
+
+def for_each_variant(test):
+    """
+    Run the test with command_options of every variant from command_variants of
+    its class, each in a subtest whose changes are rolled back.
+    """
+
+    @wraps(test)
+    def run_variants(self, *args):
+        for options in self.command_variants:
+            with self.subTest(**options), rolled_back():
+                self.command_options = options
+                reset_queries()
+                test(self, *args)
+
+    return run_variants
+
+
+class MigrateSubscriberToUserTestCase(TestCase):
+    command_options = {}
+
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
@@ -26,19 +91,48 @@ class CommandsMigrateSubscriberToUserTestCase(TestCase):
         self._subscribers_sms = SubscriberSMSFactory.create_batch(10)
         reset_queries()
 
+
+# runs of one hash make the index spill and merge runs with a few keys
+@patch("commons.keyindex.MIN_RUN_SIZE", 1)
+class CommandsMigrateSubscriberToUserTestCase(MigrateSubscriberToUserTestCase):
+    # variants of the command which have to give the same results
+    command_variants = [
+        {},
+        {"resolver": "memory"},
+        {"resolver": "raw"},
+        {"stream": True, "chunk_size": 3},
+        {"resolver": "memory", "stream": True, "chunk_size": 3},
+        {"resolver": "raw", "stream": True, "chunk_size": 3},
+        {"loader": "copy"},
+        {"loader": "upsert", "key_index": True, "batch_size": 7},
+        {"key_index": True},
+        # no memory budget makes the index spill every key to disk
+        {"resolver": "raw", "key_index": True, "memory_budget": 0},
+        {"staging": True},
+        {"resolver": "memory", "staging": True, "chunk_size": 3},
+        {"resolver": "raw", "staging": True},
+        {"chunk_size": 3, "transaction_size": 2, "async_commit": True},
+        {"resolver": "memory", "shared_lookups": True, "chunk_size": 3},
+        {"resolver": "raw", "shared_lookups": True, "staging": True, "chunk_size": 3},
+        {"read_alias": "default", "key_index": True},
+        {"incremental": True},
+    ]
+
+    @for_each_variant
     def test_migrate_subscriber_and_subscribersms_to_empty_user(self):
         # Arrange
         expected_users_count = 20
 
         # Act
 
-        call_command("migrate_subscriber_to_user")
+        call_command("migrate_subscriber_to_user", **self.command_options)
 
         # Assert
         user_count = User.objects.count()
         self.assertEqual(user_count, expected_users_count)
         print(len(connection.queries))
 
+    @for_each_variant
     def test_user_with_the_same_email_like_subscriber_exists(self):
         """jeśli istnieje User z polem email takim samym jak w Subscriber
         - pomiń subskrybenta i nie twórz nowego użytkownika"""
@@ -49,13 +143,14 @@ class CommandsMigrateSubscriberToUserTestCase(TestCase):
         UserFactory(email=first_subscriber.email)
 
         # Act
-        call_command("migrate_subscriber_to_user")
+        call_command("migrate_subscriber_to_user", **self.command_options)
 
         # Assert
         user_count = User.objects.count()
         self.assertEqual(user_count, expected_users_count)
         print(len(connection.queries))
 
+    @for_each_variant
     def test_user_with_the_same_phone_like_subscriber_exists(self):
         """jeśli istnieje User z polem phone takim samym jak w Subscriber
         - pomiń subskrybenta i nie twórz nowego użytkownika"""
@@ -66,13 +161,14 @@ class CommandsMigrateSubscriberToUserTestCase(TestCase):
         UserFactory(phone=first_subscriber_sms.phone)
 
         # Act
-        call_command("migrate_subscriber_to_user")
+        call_command("migrate_subscriber_to_user", **self.command_options)
 
         # Assert
         user_count = User.objects.count()
         self.assertEqual(user_count, expected_users_count)
         print(len(connection.queries))
 
+    @for_each_variant
     def test_create_user_base_on_client_data_for_email(self):
         """
         jeśli istnieje Client z polem email takim jak Subscriber.email
@@ -86,7 +182,7 @@ class CommandsMigrateSubscriberToUserTestCase(TestCase):
         client = ClientFactory.create(email=first_subscriber.email)
 
         # Act
-        call_command("migrate_subscriber_to_user")
+        call_command("migrate_subscriber_to_user", **self.command_options)
 
         # Assert
         self.assertTrue(
@@ -98,6 +194,7 @@ class CommandsMigrateSubscriberToUserTestCase(TestCase):
         self.assertEqual(User.objects.filter(gdpr_consent=True).count(), 19)
         print(len(connection.queries))
 
+    @for_each_variant
     def test_create_user_base_on_client_data_for_phone(self):
         """
         jeśli istnieje Client z polem phone takim jak Subscriber.phone
@@ -111,7 +208,7 @@ class CommandsMigrateSubscriberToUserTestCase(TestCase):
         client = ClientFactory.create(phone=first_subscriber.phone)
 
         # Act
-        call_command("migrate_subscriber_to_user")
+        call_command("migrate_subscriber_to_user", **self.command_options)
 
         # Assert
         self.assertTrue(
@@ -123,7 +220,8 @@ class CommandsMigrateSubscriberToUserTestCase(TestCase):
         self.assertEqual(User.objects.filter(gdpr_consent=True).count(), 19)
         print(len(connection.queries))
 
-    @patch("subscriber.management.commands.migrate_subscriber_to_user.csv")
+    @patch("subscriber.conflicts.csv")
+    @for_each_variant
     def test_return_data_to_csv_if_two_clients_with_same_phone(self, csv):
         """
         jeśli istnieje 2 Clientów z polem phone takim jak Subscriber.phone
@@ -140,7 +238,7 @@ class CommandsMigrateSubscriberToUserTestCase(TestCase):
         client = ClientFactory.create_batch(2, phone=first_subscriber.phone)[0]
 
         # Act
-        call_command("migrate_subscriber_to_user")
+        call_command("migrate_subscriber_to_user", **self.command_options)
 
         # Assert
         self.assertFalse(
@@ -152,6 +250,7 @@ class CommandsMigrateSubscriberToUserTestCase(TestCase):
         self.assertEqual(writer.writerow.call_count, 3)
         print(len(connection.queries))
 
+    @for_each_variant
     def test_not_create_user_base_on_client_data(self):
         """
         jeśli istnieje Client z polem email takim jak Subscriber.email
@@ -166,7 +265,7 @@ class CommandsMigrateSubscriberToUserTestCase(TestCase):
         UserFactory.create(email=client.email)
 
         # Act
-        call_command("migrate_subscriber_to_user")
+        call_command("migrate_subscriber_to_user", **self.command_options)
 
         # Assert
         self.assertFalse(
@@ -177,7 +276,8 @@ class CommandsMigrateSubscriberToUserTestCase(TestCase):
         )
         print(len(connection.queries))
 
-    @patch("subscriber.management.commands.migrate_subscriber_to_user.csv")
+    @patch("subscriber.conflicts.csv")
+    @for_each_variant
     def test_return_data_to_csv_for_email(self, csv):
         """
         jeśli istnieje Client z polem email takim jak Subscriber.email
@@ -195,13 +295,14 @@ class CommandsMigrateSubscriberToUserTestCase(TestCase):
         UserFactory.create(phone=client.phone)
 
         # Act
-        call_command("migrate_subscriber_to_user")
+        call_command("migrate_subscriber_to_user", **self.command_options)
 
         # Assert
         self.assertEqual(writer.writerow.call_count, 3)
         print(len(connection.queries))
 
-    @patch("subscriber.management.commands.migrate_subscriber_to_user.csv")
+    @patch("subscriber.conflicts.csv")
+    @for_each_variant
     def test_return_data_to_csv_for_phone(self, csv):
         """
         jeśli istnieje Client z polem phone takim jak Subscriber.phone
@@ -219,13 +320,14 @@ class CommandsMigrateSubscriberToUserTestCase(TestCase):
         UserFactory.create(email=client.email)
 
         # Act
-        call_command("migrate_subscriber_to_user")
+        call_command("migrate_subscriber_to_user", **self.command_options)
 
         # Assert
         self.assertEqual(writer.writerow.call_count, 3)
         print(len(connection.queries))
 
-    @patch("subscriber.management.commands.migrate_subscriber_to_user.csv")
+    @patch("subscriber.conflicts.csv")
+    @for_each_variant
     def test_not_return_data_to_csv(self, csv):
         """
         jeśli istnieje Client z polem email takim jak Subscriber.email
@@ -244,12 +346,13 @@ class CommandsMigrateSubscriberToUserTestCase(TestCase):
         UserFactory.create(email=client.email)
 
         # Act
-        call_command("migrate_subscriber_to_user")
+        call_command("migrate_subscriber_to_user", **self.command_options)
 
         # Assert
         self.assertEqual(writer.writerow._mock_call_count, 2)
         print(len(connection.queries))
 
+    @for_each_variant
     def test_create_user_with_empty_phone_number(self):
         """
         jeśli nie istnieje Client z polem email takim jak Subscriber.email, stwórz
@@ -262,7 +365,7 @@ class CommandsMigrateSubscriberToUserTestCase(TestCase):
         UserFactory.create(email=first_subscriber.email, phone="")
 
         # Act
-        call_command("migrate_subscriber_to_user")
+        call_command("migrate_subscriber_to_user", **self.command_options)
 
         # Assert
         self.assertTrue(
@@ -273,9 +376,770 @@ class CommandsMigrateSubscriberToUserTestCase(TestCase):
         )
         print(len(connection.queries))
 
+    @for_each_variant
+    def test_create_one_user_of_client_matching_both_subscribers(self):
+        # Arrange
+        client = ClientFactory.create(
+            email=self._subscribers[0].email, phone=self._subscribers_sms[0].phone
+        )
+        out = StringIO()
+
+        # Act
+        call_command("migrate_subscriber_to_user", stdout=out, **self.command_options)
+
+        # Assert
+        self.assertEqual(User.objects.count(), 19)
+        self.assertEqual(User.objects.filter(phone=client.phone).count(), 1)
+        self.assertIn("conflicts: 0", out.getvalue())
+
+    def test_create_users_in_batches_of_given_size(self):
+        # Arrange
+        options = dict(self.command_options, batch_size=7, chunk_size=100)
+
+        # Act
+        with CaptureQueriesContext(connection) as context:
+            call_command("migrate_subscriber_to_user", **options)
+
+        # Assert
+        # SQLite skips conflicts with INSERT OR IGNORE
+        inserts = [
+            query
+            for query in context.captured_queries
+            if query["sql"].startswith(
+                ('INSERT INTO "user_user"', 'INSERT OR IGNORE INTO "user_user"')
+            )
+        ]
+        self.assertEqual(len(inserts), 4)
+        self.assertEqual(User.objects.count(), 20)
+
+    def test_write_profile_of_phases(self):
+        # Arrange
+        out = StringIO()
+
+        # Act
+        call_command(
+            "migrate_subscriber_to_user",
+            profile="-",
+            stdout=out,
+            **self.command_options,
+        )
+
+        # Assert
+        report = json.loads(out.getvalue().split("\n", 1)[1])
+        phases = {phase["name"]: phase for phase in report["phases"]}
+        self.assertEqual(
+            list(phases), ["setup", "subscriber.Subscriber", "subscriber.SubscriberSMS"]
+        )
+        self.assertEqual(phases["subscriber.Subscriber"]["rows_read"], 10)
+        self.assertEqual(phases["subscriber.Subscriber"]["rows_written"], 10)
+        self.assertGreater(phases["subscriber.Subscriber"]["queries"], 0)
+        self.assertEqual(report["rows_written"], 20)
+
+
+class CommandsMigrateSubscriberToUserInMemoryTestCase(MigrateSubscriberToUserTestCase):
+    command_options = {"resolver": "memory"}
+
+    def test_number_of_queries_does_not_depend_on_number_of_subscribers(self):
+        # Arrange
+        ClientFactory.create(email=self._subscribers[0].email)
+        ClientFactory.create_batch(2, phone=self._subscribers_sms[0].phone)
+        with CaptureQueriesContext(connection) as small_run:
+            call_command("migrate_subscriber_to_user", **self.command_options)
+        User.objects.all().delete()
+        SubscriberFactory.create_batch(30)
+        SubscriberSMSFactory.create_batch(30)
+
+        # Act
+        with CaptureQueriesContext(connection) as big_run:
+            call_command("migrate_subscriber_to_user", **self.command_options)
+
+        # Assert
+        self.assertEqual(len(small_run.captured_queries), len(big_run.captured_queries))
+
+
+class CommandsMigrateSubscriberToUserRawTestCase(
+    CommandsMigrateSubscriberToUserInMemoryTestCase
+):
+    command_options = {"resolver": "raw"}
+
+    def test_parse_phone_numbers_only_of_created_users(self):
+        # Arrange
+        for subscriber_sms in self._subscribers_sms[:4]:
+            UserFactory.create(phone=subscriber_sms.phone)
+        phone_number.cache_clear()
+        from_string = Mock(wraps=PhoneNumber.from_string)
+
+        # Act
+        with patch.object(PhoneNumber, "from_string", from_string):
+            call_command("migrate_subscriber_to_user", **self.command_options)
+
+        # Assert
+        self.assertEqual(from_string.call_count, 6)
+        self.assertEqual(User.objects.count(), 20)
+
+
+class CommandsMigrateSubscriberToUserStreamTestCase(MigrateSubscriberToUserTestCase):
+    command_options = {"stream": True, "chunk_size": 3}
+
+    def test_read_subscribers_in_chunks_after_last_primary_key(self):
+        # Act
+        with CaptureQueriesContext(connection) as queries:
+            call_command("migrate_subscriber_to_user", **self.command_options)
+
+        # Assert
+        self.assertEqual(User.objects.count(), 20)
+        chunks = [
+            query["sql"]
+            for query in queries
+            if 'FROM "subscriber_subscriber"' in query["sql"]
+            and query["sql"].endswith("LIMIT 3")
+        ]
+        # 4 chunks of 10 subscribers and the empty one which ends the scan
+        self.assertEqual(len(chunks), 5)
+        self.assertNotIn('"subscriber_subscriber"."id" >', chunks[0])
+        for sql in chunks[1:]:
+            self.assertIn('"subscriber_subscriber"."id" >', sql)
+
+
+class CommandsMigrateSubscriberToUserCopyTestCase(MigrateSubscriberToUserTestCase):
+    command_options = {"loader": "copy"}
+
+    def test_create_users_in_batches_of_given_size(self):
+        # Arrange
+        options = dict(self.command_options, batch_size=7)
+
+        # Act
+        call_command("migrate_subscriber_to_user", **options)
+
+        # Assert
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(User.objects.filter(gdpr_consent=True).count(), 20)
+        self.assertFalse(User.objects.filter(created__isnull=True).exists())
+
+
+class CommandsMigrateSubscriberToUserUpsertTestCase(MigrateSubscriberToUserTestCase):
+    command_options = {"loader": "upsert", "key_index": True, "batch_size": 7}
+
+    def test_skip_existing_users_without_looking_them_up(self):
+        # Arrange
+        UserFactory(email=self._subscribers[0].email.upper(), phone="")
+        out = StringIO()
+
+        # Act
+        with CaptureQueriesContext(connection) as queries:
+            call_command(
+                "migrate_subscriber_to_user", stdout=out, **self.command_options
+            )
+
+        # Assert
+        self.assertEqual(User.objects.count(), 20)
+        self.assertIn("Created users: 19, conflicts: 0", out.getvalue())
+        user_lookups = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith('SELECT "user_user"."email" FROM')
+        ]
+        self.assertEqual(user_lookups, [])
+
+    def test_rerun_creates_no_users(self):
+        # Arrange
+        call_command("migrate_subscriber_to_user", **self.command_options)
+        out = StringIO()
+
+        # Act
+        call_command("migrate_subscriber_to_user", stdout=out, **self.command_options)
+
+        # Assert
+        self.assertEqual(User.objects.count(), 20)
+        self.assertIn("Created users: 0, conflicts: 0", out.getvalue())
+
+
+class CommandsMigrateSubscriberToUserKeyIndexTestCase(MigrateSubscriberToUserTestCase):
+    command_options = {"key_index": True, "chunk_size": 100}
+
+    def test_look_up_only_users_with_keys_found_in_index(self):
+        # Arrange
+        UserFactory(email=self._subscribers[0].email, phone="")
+
+        # Act
+        with CaptureQueriesContext(connection) as queries:
+            call_command("migrate_subscriber_to_user", **self.command_options)
+
+        # Assert
+        self.assertEqual(User.objects.count(), 20)
+        lookups = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith(
+                ('SELECT "user_user"."email" FROM', 'SELECT "user_user"."phone" FROM')
+            )
+        ]
+        self.assertEqual(len(lookups), 1)
+        self.assertIn(self._subscribers[0].email, lookups[0])
+
+
+class CommandsMigrateSubscriberToUserRawStagingTestCase(
+    MigrateSubscriberToUserTestCase
+):
+    command_options = {"resolver": "raw", "staging": True}
+
+    def test_match_values_with_staging_table(self):
+        # Arrange
+        UserFactory.create(email=self._subscribers[0].email)
+
+        # Act
+        with CaptureQueriesContext(connection) as queries:
+            call_command("migrate_subscriber_to_user", **self.command_options)
+
+        # Assert
+        self.assertEqual(User.objects.count(), 20)
+        lookups = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith("SELECT") and " IN (" in query["sql"]
+        ]
+        self.assertTrue(lookups)
+        for sql in lookups:
+            self.assertIn("SELECT key FROM", sql)
+
+
+class CommandsMigrateSubscriberToUserSharedLookupsTestCase(
+    MigrateSubscriberToUserTestCase
+):
+    command_options = {"resolver": "memory", "shared_lookups": True, "chunk_size": 3}
+    phase = "subscriber.Subscriber+subscriber.SubscriberSMS"
+
+    def test_write_profile_of_phases(self):
+        # Arrange
+        out = StringIO()
+
+        # Act
+        call_command(
+            "migrate_subscriber_to_user",
+            profile="-",
+            stdout=out,
+            **self.command_options,
+        )
+
+        # Assert
+        report = json.loads(out.getvalue().split("\n", 1)[1])
+        phases = {phase["name"]: phase for phase in report["phases"]}
+        self.assertEqual(list(phases), ["setup", self.phase])
+        self.assertEqual(phases[self.phase]["rows_read"], 20)
+        self.assertEqual(phases[self.phase]["rows_written"], 20)
+
+    def test_create_users_in_batches_of_given_size(self):
+        # Arrange
+        options = dict(self.command_options, batch_size=7, chunk_size=100)
+
+        # Act
+        with CaptureQueriesContext(connection) as context:
+            call_command("migrate_subscriber_to_user", **options)
+
+        # Assert
+        # users of both sources share batches
+        inserts = [
+            query
+            for query in context.captured_queries
+            if query["sql"].startswith(
+                ('INSERT INTO "user_user"', 'INSERT OR IGNORE INTO "user_user"')
+            )
+        ]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(User.objects.count(), 20)
+
+    def test_load_clients_once_for_all_sources(self):
+        # Arrange
+        ClientFactory.create(email=self._subscribers[0].email)
+        ClientFactory.create(phone=self._subscribers_sms[0].phone)
+        options = dict(self.command_options, chunk_size=100)
+
+        # Act
+        with CaptureQueriesContext(connection) as queries:
+            call_command("migrate_subscriber_to_user", **options)
+
+        # Assert
+        self.assertEqual(User.objects.count(), 20)
+        clients = [query for query in queries if 'FROM "user_client"' in query["sql"]]
+        self.assertEqual(len(clients), 1)
+
+
+class CommandsMigrateSubscriberToUserRawSharedLookupsTestCase(
+    CommandsMigrateSubscriberToUserSharedLookupsTestCase
+):
+    command_options = {
+        "resolver": "raw",
+        "shared_lookups": True,
+        "staging": True,
+        "chunk_size": 3,
+    }
+
+
+class CommandsMigrateSubscriberToUserReadAliasTestCase(MigrateSubscriberToUserTestCase):
+    command_options = {"read_alias": "default", "key_index": True}
+
+    def test_unknown_read_alias(self):
+        # Act & Assert
+        with self.assertRaises(CommandError):
+            call_command("migrate_subscriber_to_user", read_alias="unknown")
+
+    def test_read_from_primary_when_replica_lags(self):
+        # Arrange
+        err = StringIO()
+
+        # Act
+        with patch("commons.replicas.replica_lag", return_value=120):
+            call_command(
+                "migrate_subscriber_to_user", stderr=err, **self.command_options
+            )
+
+        # Assert
+        self.assertEqual(User.objects.count(), 20)
+        self.assertIn("Replica default lags 120s", err.getvalue())
+
+
+@skipUnless(connection.vendor == "postgresql", "pipeline requires PostgreSQL")
+class CommandsMigrateSubscriberToUserPipelineTestCase(TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self._subscribers = SubscriberFactory.create_batch(10)
+        self._subscribers_sms = SubscriberSMSFactory.create_batch(10)
+        ClientFactory.create(email=self._subscribers[0].email)
+        ClientFactory.create_batch(2, phone=self._subscribers_sms[0].phone)
+
+    def test_pipeline_gives_the_same_result_as_sequential_run(self):
+        # Arrange
+        call_command("migrate_subscriber_to_user", chunk_size=3, conflicts="table")
+        expected = sorted(User.objects.values_list("email", "phone", "gdpr_consent"))
+        User.objects.all().delete()
+        MigrationRun.objects.all().delete()
+
+        # Act
+        call_command(
+            "migrate_subscriber_to_user",
+            chunk_size=3,
+            conflicts="table",
+            pipeline=True,
+        )
+
+        # Assert
+        result = sorted(User.objects.values_list("email", "phone", "gdpr_consent"))
+        self.assertEqual(result, expected)
+        self.assertEqual(len(result), 19)
+        self.assertEqual(MigrationConflict.objects.count(), 1)
+        checkpoints = MigrationRun.objects.get().checkpoints.all()
+        self.assertTrue(all(checkpoint.finished for checkpoint in checkpoints))
+
+    def test_pipeline_commits_chunks_grouped_in_transactions(self):
+        # Act
+        call_command(
+            "migrate_subscriber_to_user",
+            chunk_size=3,
+            pipeline=True,
+            transaction_size=2,
+        )
+
+        # Assert
+        self.assertEqual(User.objects.count(), 19)
+        checkpoints = MigrationRun.objects.get().checkpoints.all()
+        self.assertTrue(all(checkpoint.finished for checkpoint in checkpoints))
+
+
+class CommandsMigrateSubscriberToUserIncrementalTestCase(
+    MigrateSubscriberToUserTestCase
+):
+    command_options = {"incremental": True}
+
+    def test_migrate_only_subscribers_created_after_last_run(self):
+        # Arrange
+        call_command("migrate_subscriber_to_user", **self.command_options)
+        User.objects.filter(email=self._subscribers[0].email).delete()
+        new_subscribers = SubscriberFactory.create_batch(2)
+
+        # Act
+        call_command("migrate_subscriber_to_user", **self.command_options)
+
+        # Assert
+        self.assertEqual(User.objects.count(), 21)
+        self.assertFalse(User.objects.filter(email=self._subscribers[0].email).exists())
+        for subscriber in new_subscribers:
+            self.assertTrue(User.objects.filter(email=subscriber.email).exists())
+
+
+class CommandsMigrateSubscriberToUserResumeTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        in_temporary_directory(self)
+        self._subscribers = SubscriberFactory.create_batch(10)
+        self._subscribers_sms = SubscriberSMSFactory.create_batch(10)
+        ClientFactory.create_batch(2, phone=self._subscribers_sms[9].phone)
+
+    def _fail_on_chunk(self, number):
+        resolve = QueryResolver.resolve
+        chunks = []
+
+        def failing_resolve(resolver, subscribers):
+            chunks.append(subscribers)
+            if len(chunks) == number:
+                raise RuntimeError("Connection lost")
+            return resolve(resolver, subscribers)
+
+        return patch.object(QueryResolver, "resolve", failing_resolve)
+
+    def test_resume_migration_from_last_checkpoint(self):
+        # Arrange
+        with self._fail_on_chunk(5):
+            with self.assertRaises(RuntimeError):
+                call_command("migrate_subscriber_to_user", chunk_size=4)
+        users_count = User.objects.count()
+        run = MigrationRun.objects.get()
+        checkpoint = run.checkpoints.get(phase="subscriber.SubscriberSMS")
+
+        # Act
+        call_command("migrate_subscriber_to_user", chunk_size=4, resume=True)
+
+        # Assert
+        self.assertEqual(users_count, 14)
+        self.assertEqual(checkpoint.last_id, self._subscribers_sms[3].pk)
+        self.assertEqual(User.objects.count(), 19)
+        run.refresh_from_db()
+        self.assertIsNotNone(run.finished)
+        conflict = self._subscribers_sms[9]
+        with open("subscribersms_conflicts.csv") as file:
+            self.assertEqual(
+                list(csv.reader(file)),
+                [["ID", "PHONE"], [str(conflict.pk), str(conflict.phone)]],
+            )
+
+    def test_sync_conflicts_of_committed_chunks_to_disk(self):
+        # Arrange
+        conflict = self._subscribers_sms[1]
+        ClientFactory.create_batch(2, phone=conflict.phone)
+        resolve = QueryResolver.resolve
+        on_disk = []
+
+        def killing_resolve(resolver, subscribers):
+            if subscribers[0] == self._subscribers_sms[4]:
+                with open("subscribersms_conflicts.csv") as file:
+                    on_disk.extend(csv.reader(file))
+                raise RuntimeError("Process killed")
+            return resolve(resolver, subscribers)
+
+        # Act
+        with patch.object(QueryResolver, "resolve", killing_resolve):
+            with self.assertRaises(RuntimeError):
+                call_command("migrate_subscriber_to_user", chunk_size=4)
+
+        # Assert
+        self.assertEqual(
+            on_disk, [["ID", "PHONE"], [str(conflict.pk), str(conflict.phone)]]
+        )
+
+    @patch(
+        "subscriber.management.commands.migrate_subscriber_to_user.invalidate_consents"
+    )
+    def test_resume_drops_conflicts_of_rolled_back_chunks(self, invalidate):
+        # Arrange
+        last_user = str(self._subscribers_sms[8].phone)
+
+        def fail_after_conflicts(keys):
+            if any(phone == last_user for _, phone in keys):
+                raise RuntimeError("Connection lost")
+
+        invalidate.side_effect = fail_after_conflicts
+        with self.assertRaises(RuntimeError):
+            call_command("migrate_subscriber_to_user", chunk_size=4)
+        invalidate.side_effect = None
+
+        # Act
+        call_command("migrate_subscriber_to_user", chunk_size=4, resume=True)
+
+        # Assert
+        conflict = self._subscribers_sms[9]
+        with open("subscribersms_conflicts.csv") as file:
+            self.assertEqual(
+                list(csv.reader(file)),
+                [["ID", "PHONE"], [str(conflict.pk), str(conflict.phone)]],
+            )
+
+    def test_start_new_run_without_resume(self):
+        # Arrange
+        with self._fail_on_chunk(2):
+            with self.assertRaises(RuntimeError):
+                call_command("migrate_subscriber_to_user", chunk_size=4)
+
+        # Act
+        call_command("migrate_subscriber_to_user", chunk_size=4)
+
+        # Assert
+        self.assertEqual(MigrationRun.objects.filter(finished__isnull=True).count(), 1)
+        self.assertEqual(User.objects.count(), 19)
+
+
+class CommandsMigrateSubscriberToUserConflictsTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        in_temporary_directory(self)
+        self._subscribers = SubscriberFactory.create_batch(3)
+        self._subscribers_sms = SubscriberSMSFactory.create_batch(3)
+        client = ClientFactory.create(email=self._subscribers[0].email)
+        UserFactory.create(phone=client.phone)
+        ClientFactory.create_batch(2, phone=self._subscribers_sms[0].phone)
+
+    def _expected_conflicts(self):
+        subscriber = self._subscribers[0]
+        subscriber_sms = self._subscribers_sms[0]
+        return [
+            (
+                "subscriber.Subscriber",
+                subscriber.pk,
+                subscriber.email,
+                MigrationConflict.USER_CLASH,
+            ),
+            (
+                "subscriber.SubscriberSMS",
+                subscriber_sms.pk,
+                str(subscriber_sms.phone),
+                MigrationConflict.MULTIPLE_CLIENTS,
+            ),
+        ]
+
+    def test_save_conflicts_in_table(self):
+        # Act
+        call_command("migrate_subscriber_to_user", conflicts="table")
+
+        # Assert
+        run = MigrationRun.objects.get()
+        self.assertEqual(
+            sorted(run.conflicts.values_list("source", "source_id", "key", "reason")),
+            self._expected_conflicts(),
+        )
+
+    def test_save_conflicts_in_table_with_copy(self):
+        # Act
+        call_command("migrate_subscriber_to_user", conflicts="table", loader="copy")
+
+        # Assert
+        self.assertEqual(
+            sorted(
+                MigrationConflict.objects.values_list(
+                    "source", "source_id", "key", "reason"
+                )
+            ),
+            self._expected_conflicts(),
+        )
+
+    def test_save_conflicts_in_table_with_shared_lookups(self):
+        for resolver in ["memory", "raw"]:
+            with self.subTest(resolver=resolver), transaction.atomic():
+                # Act
+                call_command(
+                    "migrate_subscriber_to_user",
+                    conflicts="table",
+                    resolver=resolver,
+                    shared_lookups=True,
+                )
+
+                # Assert
+                self.assertEqual(
+                    sorted(
+                        MigrationConflict.objects.values_list(
+                            "source", "source_id", "key", "reason"
+                        )
+                    ),
+                    self._expected_conflicts(),
+                )
+                transaction.set_rollback(True)
+
+    def test_report_subscribers_of_failed_chunk_as_conflicts(self):
+        # Arrange
+        failing = self._subscribers[2]
+        insert = loaders._insert_ignoring_conflicts
+
+        def failing_insert(model, users, *args, **kwargs):
+            if any(user.email == failing.email for user in users):
+                raise IntegrityError("Invalid user")
+            return insert(model, users, *args, **kwargs)
+
+        # Act
+        with patch.object(loaders, "_insert_ignoring_conflicts", failing_insert):
+            call_command(
+                "migrate_subscriber_to_user",
+                conflicts="table",
+                chunk_size=1,
+                transaction_size=2,
+                stderr=StringIO(),
+            )
+
+        # Assert
+        self.assertEqual(
+            sorted(
+                MigrationConflict.objects.values_list(
+                    "source", "source_id", "key", "reason"
+                )
+            ),
+            sorted(
+                self._expected_conflicts()
+                + [
+                    (
+                        "subscriber.Subscriber",
+                        failing.pk,
+                        failing.email,
+                        MigrationConflict.WRITE_ERROR,
+                    )
+                ]
+            ),
+        )
+        self.assertFalse(User.objects.filter(email=failing.email).exists())
+        self.assertTrue(User.objects.filter(email=self._subscribers[1].email).exists())
+
+    def test_plan_counts_outcomes_without_writing(self):
+        # Arrange
+        out = StringIO()
+
+        # Act
+        call_command("migrate_subscriber_to_user", plan=True, stdout=out)
+
+        # Assert
+        lines = out.getvalue().splitlines()
+        self.assertIn("subscriber.Subscriber create: 2", lines[0])
+        self.assertIn("subscriber.Subscriber skip: 0", lines[1])
+        self.assertEqual(
+            lines[2],
+            "subscriber.Subscriber user_clash: 1 "
+            f"(sample ids: {self._subscribers[0].pk})",
+        )
+        self.assertIn("subscriber.SubscriberSMS create: 2", lines[4])
+        self.assertIn("subscriber.SubscriberSMS multiple_clients: 1", lines[7])
+        self.assertEqual(User.objects.count(), 1)
+        self.assertFalse(MigrationRun.objects.exists())
+
+    def test_plan_matches_migration(self):
+        # Arrange
+        UserFactory.create(email=self._subscribers[1].email)
+        out = StringIO()
+        call_command("migrate_subscriber_to_user", plan=True, stdout=out)
+
+        # Act
+        call_command("migrate_subscriber_to_user", conflicts="table")
+
+        # Assert
+        planned = {
+            line.split(":")[0]: int(line.split(":")[1].split()[0])
+            for line in out.getvalue().splitlines()
+        }
+        created = planned["subscriber.Subscriber create"]
+        created += planned["subscriber.SubscriberSMS create"]
+        self.assertEqual(User.objects.count(), 2 + created)
+        for (source, reason), count in Counter(
+            MigrationConflict.objects.values_list("source", "reason")
+        ).items():
+            self.assertEqual(planned[f"{source} {reason}"], count)
+        self.assertEqual(planned["subscriber.Subscriber skip"], 1)
+
+    def test_plan_skips_subscribers_of_users_with_email_in_other_case(self):
+        # Arrange
+        UserFactory.create(email=self._subscribers[1].email.upper(), phone="")
+        out = StringIO()
+        call_command("migrate_subscriber_to_user", plan=True, stdout=out)
+        users = User.objects.count()
+
+        # Act
+        call_command("migrate_subscriber_to_user", conflicts="table")
+
+        # Assert
+        lines = out.getvalue().splitlines()
+        self.assertIn("subscriber.Subscriber create: 1", lines[0])
+        self.assertIn("subscriber.Subscriber skip: 1", lines[1])
+        self.assertEqual(
+            User.objects.filter(email_key=self._subscribers[1].email.lower()).count(),
+            1,
+        )
+        self.assertEqual(User.objects.count() - users, 1 + 2)
+
+    def test_plan_scans_every_source_once(self):
+        # Act
+        with CaptureQueriesContext(connection) as context:
+            call_command("migrate_subscriber_to_user", plan=True, stdout=StringIO())
+
+        # Assert
+        for table in ['"subscriber_subscriber"', '"subscriber_subscribersms"']:
+            with self.subTest(table=table):
+                scans = [query for query in context if table in query["sql"]]
+                self.assertEqual(len(scans), 1)
+
+    def test_write_conflicts_to_gzip_file(self):
+        # Act
+        call_command("migrate_subscriber_to_user", gzip=True)
+
+        # Assert
+        subscriber_sms = self._subscribers_sms[0]
+        with gzip.open("subscribersms_conflicts.csv.gz", "rt", newline="") as file:
+            self.assertEqual(
+                list(csv.reader(file)),
+                [["ID", "PHONE"], [str(subscriber_sms.pk), str(subscriber_sms.phone)]],
+            )
+        self.assertFalse(MigrationConflict.objects.exists())
+
+
+@skipUnless(connection.vendor == "postgresql", "workers require PostgreSQL")
+class CommandsMigrateSubscriberToUserWorkersTestCase(TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        in_temporary_directory(self)
+        subscribers = SubscriberFactory.create_batch(10)
+        subscribers_sms = SubscriberSMSFactory.create_batch(10)
+        ClientFactory.create(email=subscribers[0].email)
+        client = ClientFactory.create(email=subscribers[1].email)
+        UserFactory.create(phone=client.phone)
+        ClientFactory.create_batch(2, phone=subscribers_sms[0].phone)
+
+    def _migrate(self, **options):
+        existing = list(User.objects.values_list("pk", flat=True))
+        call_command("migrate_subscriber_to_user", **options)
+        users = User.objects.exclude(pk__in=existing)
+        file_names = ["subscriber_conflicts.csv", "subscribersms_conflicts.csv"]
+        result = {
+            "users": sorted(
+                users.values_list("email", "phone", "gdpr_consent").order_by()
+            ),
+            "conflicts": [open(file_name).read() for file_name in file_names],
+        }
+        users.delete()
+        return result
+
+    def test_workers_give_the_same_result_as_single_process(self):
+        # Arrange
+        expected = self._migrate()
+
+        # Act
+        result = self._migrate(workers=3, chunk_size=2)
+
+        # Assert
+        self.assertEqual(result, expected)
+        self.assertEqual(len(result["users"]), 18)
+
+
+class CommandsMigrateSubscriberToUserEmptyTablesTestCase(TestCase):
+    def test_workers_migrate_empty_tables(self):
+        # Arrange
+        out = StringIO()
+
+        # Act
+        call_command("migrate_subscriber_to_user", workers=2, stdout=out)
+
+        # Assert
+        self.assertIn("Created users: 0, conflicts: 0", out.getvalue())
+        checkpoints = MigrationRun.objects.get().checkpoints.all()
+        self.assertEqual(len(checkpoints), 2)
+        self.assertTrue(all(checkpoint.finished for checkpoint in checkpoints))
+        self.assertTrue(all(checkpoint.start_id is None for checkpoint in checkpoints))
+
 
 @freeze_time("2017-06-18")
-class CommandsMigrateMissingDataFromSubscriberToUserTestCase(TestCase):
+class MigrateMissingDataFromSubscriberToUserTestCase(TestCase):
+    command_options = {}
+
     @classmethod
     def setUpClass(cls):
         super().setUpClass()
@@ -300,6 +1164,30 @@ class CommandsMigrateMissingDataFromSubscriberToUserTestCase(TestCase):
 
         reset_queries()
 
+
+@patch("commons.keyindex.MIN_RUN_SIZE", 1)
+class CommandsMigrateMissingDataFromSubscriberToUserTestCase(
+    MigrateMissingDataFromSubscriberToUserTestCase
+):
+    # variants of the command which have to give the same results
+    command_variants = [
+        {},
+        {"stream": True, "chunk_size": 3},
+        {"engine": "raw", "chunk_size": 3},
+        {"key_index": True},
+        # no memory budget makes the index spill every key to disk
+        {"engine": "raw", "chunk_size": 3, "key_index": True, "memory_budget": 0},
+        {"staging": True},
+        {"stream": True, "chunk_size": 3, "staging": True},
+        {"engine": "raw", "chunk_size": 3, "staging": True},
+        {"batch_size": 1, "transaction_size": 2, "async_commit": True},
+        {"read_alias": "default", "key_index": True},
+        {"incremental": True},
+        *SQL_ENGINES,
+        *[dict(options, incremental=True) for options in SQL_ENGINES],
+    ]
+
+    @for_each_variant
     def test_migrate_subscriber_if_created_data_is_newer_then_user(self):
         # Arrange
         UserFactory.create_batch(5)
@@ -310,13 +1198,16 @@ class CommandsMigrateMissingDataFromSubscriberToUserTestCase(TestCase):
 
         reset_queries()
         # Act
-        call_command("migrate_missing_data_from_subscriber_to_user")
+        call_command(
+            "migrate_missing_data_from_subscriber_to_user", **self.command_options
+        )
 
         # Assert
         print(len(connection.queries))
         user.refresh_from_db()
         self.assertTrue(user.gdpr_consent)
 
+    @for_each_variant
     def test_migrate_subscriber_sms_if_created_data_is_newer_then_user(self):
         # Arrange
         UserFactory.create_batch(5)
@@ -327,13 +1218,16 @@ class CommandsMigrateMissingDataFromSubscriberToUserTestCase(TestCase):
 
         reset_queries()
         # Act
-        call_command("migrate_missing_data_from_subscriber_to_user")
+        call_command(
+            "migrate_missing_data_from_subscriber_to_user", **self.command_options
+        )
 
         # Assert
         print(len(connection.queries))
         user.refresh_from_db()
         self.assertTrue(user.gdpr_consent)
 
+    @for_each_variant
     def test_migrate_subscriber_for_user_created_from_client_with_phone_and_email_subscriber_has_the_newer_date(self):  # noqa
         # Arrange
         UserFactory.create_batch(5)
@@ -353,13 +1247,16 @@ class CommandsMigrateMissingDataFromSubscriberToUserTestCase(TestCase):
 
         reset_queries()
         # Act
-        call_command("migrate_missing_data_from_subscriber_to_user")
+        call_command(
+            "migrate_missing_data_from_subscriber_to_user", **self.command_options
+        )
 
         # Assert
         print(len(connection.queries))
         user.refresh_from_db()
         self.assertTrue(user.gdpr_consent)
 
+    @for_each_variant
     def test_migrate_subscriber_for_user_created_from_client_with_phone_and_email_subscriber_sms_has_the_newer_date(self):  # noqa
         # Arrange
         UserFactory.create_batch(5)
@@ -379,13 +1276,74 @@ class CommandsMigrateMissingDataFromSubscriberToUserTestCase(TestCase):
 
         reset_queries()
         # Act
-        call_command("migrate_missing_data_from_subscriber_to_user")
+        call_command(
+            "migrate_missing_data_from_subscriber_to_user", **self.command_options
+        )
+
+        # Assert
+        print(len(connection.queries))
+        user.refresh_from_db()
+        self.assertTrue(user.gdpr_consent)
+
+    @for_each_variant
+    def test_migrate_subscriber_for_user_created_from_client_with_phone_and_email_subscriber_sms_wins_the_same_date(self):  # noqa
+        # Arrange
+        UserFactory.create_batch(5)
+        subscriber = SubscriberFactory(gdpr_consent=False)
+        subscriber.created = self.ONE_DAY_AGO
+        subscriber.save()
+
+        subscriber_sms = SubscriberSMSFactory(gdpr_consent=True)
+        subscriber_sms.created = self.ONE_DAY_AGO
+        subscriber_sms.save()
+
+        user = UserFactory(
+            email=subscriber.email, phone=subscriber_sms.phone, gdpr_consent=False
+        )
+        user.created = self.MONTH_AGO
+        user.save()
+
+        reset_queries()
+        # Act
+        call_command(
+            "migrate_missing_data_from_subscriber_to_user", **self.command_options
+        )
 
         # Assert
         print(len(connection.queries))
         user.refresh_from_db()
         self.assertTrue(user.gdpr_consent)
 
+    @for_each_variant
+    def test_migrate_subscriber_for_user_created_from_client_with_phone_and_email_subscriber_loses_the_same_date(self):  # noqa
+        # Arrange
+        UserFactory.create_batch(5)
+        subscriber = SubscriberFactory(gdpr_consent=True)
+        subscriber.created = self.ONE_DAY_AGO
+        subscriber.save()
+
+        subscriber_sms = SubscriberSMSFactory(gdpr_consent=False)
+        subscriber_sms.created = self.ONE_DAY_AGO
+        subscriber_sms.save()
+
+        user = UserFactory(
+            email=subscriber.email, phone=subscriber_sms.phone, gdpr_consent=False
+        )
+        user.created = self.MONTH_AGO
+        user.save()
+
+        reset_queries()
+        # Act
+        call_command(
+            "migrate_missing_data_from_subscriber_to_user", **self.command_options
+        )
+
+        # Assert
+        print(len(connection.queries))
+        user.refresh_from_db()
+        self.assertFalse(user.gdpr_consent)
+
+    @for_each_variant
     def test_migrate_subscriber_for_user_created_from_client_with_phone_and_email_user_has_the_newer_date(self):  # noqa
         # Arrange
         UserFactory.create_batch(5)
@@ -403,9 +1361,452 @@ class CommandsMigrateMissingDataFromSubscriberToUserTestCase(TestCase):
         reset_queries()
 
         # Act
-        call_command("migrate_missing_data_from_subscriber_to_user")
+        call_command(
+            "migrate_missing_data_from_subscriber_to_user", **self.command_options
+        )
 
         # Assert
         print(len(connection.queries))
         user.refresh_from_db()
         self.assertFalse(user.gdpr_consent)
+
+    @for_each_variant
+    def test_write_profile_of_phases(self):
+        # Arrange
+        out = StringIO()
+
+        # Act
+        call_command(
+            "migrate_missing_data_from_subscriber_to_user",
+            profile="-",
+            stdout=out,
+            **self.command_options,
+        )
+
+        # Assert
+        report = json.loads(out.getvalue().split("\n", 1)[1])
+        phases = {phase["name"]: phase for phase in report["phases"]}
+        self.assertEqual(list(phases), ["setup", "update", "finish"])
+        self.assertGreaterEqual(phases["update"]["rows_written"], 1)
+        self.assertGreater(phases["update"]["queries"], 0)
+
+    def test_plan_counts_users_to_update_without_writing(self):
+        # Arrange
+        out = StringIO()
+
+        # Act
+        call_command(
+            "migrate_missing_data_from_subscriber_to_user",
+            plan=True,
+            stdout=out,
+            **self.command_options,
+        )
+
+        # Assert
+        lines = out.getvalue().splitlines()
+        self.assertIn("user.User update: 2", lines[0])
+        self.assertIn("user.User unchanged: 0", lines[1])
+        self.assertFalse(User.objects.filter(gdpr_consent=True).exists())
+        self.assertFalse(MigrationRun.objects.exists())
+
+
+class CommandsMigrateMissingDataFromSubscriberToUserStreamTestCase(
+    MigrateMissingDataFromSubscriberToUserTestCase
+):
+    command_options = {"stream": True, "chunk_size": 3}
+
+    def test_read_users_in_chunks_after_last_primary_key(self):
+        # Arrange
+        UserFactory.create_batch(5)
+        out = StringIO()
+
+        # Act
+        with CaptureQueriesContext(connection) as queries:
+            call_command(
+                "migrate_missing_data_from_subscriber_to_user",
+                stdout=out,
+                **self.command_options,
+            )
+
+        # Assert
+        self.assertIn("Updated users: 2", out.getvalue())
+        chunks = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith("SELECT")
+            and 'FROM "user_user"' in query["sql"]
+            and query["sql"].endswith("LIMIT 3")
+        ]
+        # 3 chunks of 7 users and the empty one which ends the scan
+        self.assertEqual(len(chunks), 4)
+        for sql in chunks[1:]:
+            self.assertIn('"user_user"."id" >', sql)
+
+
+class CommandsMigrateMissingDataFromSubscriberToUserRawTestCase(
+    MigrateMissingDataFromSubscriberToUserTestCase
+):
+    command_options = {"engine": "raw", "chunk_size": 3}
+
+    def test_not_parse_phone_numbers_of_users(self):
+        # Arrange
+        UserFactory.create_batch(5)
+        phone_number.cache_clear()
+        from_string = Mock(wraps=PhoneNumber.from_string)
+        out = StringIO()
+
+        # Act
+        with patch.object(PhoneNumber, "from_string", from_string):
+            call_command(
+                "migrate_missing_data_from_subscriber_to_user",
+                stdout=out,
+                **self.command_options,
+            )
+
+        # Assert
+        self.assertIn("Updated users: 2", out.getvalue())
+        self.assertEqual(from_string.call_count, 0)
+
+
+class CommandsMigrateMissingDataFromSubscriberToUserKeyIndexTestCase(
+    MigrateMissingDataFromSubscriberToUserTestCase
+):
+    command_options = {"stream": True, "chunk_size": 3, "key_index": True}
+
+    @patch(
+        "subscriber.management.commands."
+        "migrate_missing_data_from_subscriber_to_user.newest_consents",
+        wraps=newest_consents,
+    )
+    def test_compare_only_users_found_in_index(self, compare):
+        # Arrange
+        UserFactory.create_batch(5)
+        out = StringIO()
+
+        # Act
+        call_command(
+            "migrate_missing_data_from_subscriber_to_user",
+            stdout=out,
+            **self.command_options,
+        )
+
+        # Assert
+        self.assertIn("Updated users: 2", out.getvalue())
+        compared = [user for call in compare.call_args_list for user in call[0][0]]
+        self.assertEqual(len(compared), 2)
+
+
+class CommandsMigrateMissingDataFromSubscriberToUserStagingTestCase(
+    MigrateMissingDataFromSubscriberToUserTestCase
+):
+    command_options = {"stream": True, "chunk_size": 3, "staging": True}
+
+    def test_match_users_with_staging_table(self):
+        # Arrange
+        out = StringIO()
+
+        # Act
+        with CaptureQueriesContext(connection) as queries:
+            call_command(
+                "migrate_missing_data_from_subscriber_to_user",
+                stdout=out,
+                **self.command_options,
+            )
+
+        # Assert
+        self.assertIn("Updated users: 2", out.getvalue())
+        lookups = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith('SELECT "subscriber_subscriber')
+            and " IN (" in query["sql"]
+        ]
+        self.assertTrue(lookups)
+        for sql in lookups:
+            self.assertIn("SELECT key FROM", sql)
+
+
+class CommandsMigrateMissingDataFromSubscriberToUserTransactionSizeTestCase(
+    MigrateMissingDataFromSubscriberToUserTestCase
+):
+    command_options = {"batch_size": 1, "transaction_size": 2, "async_commit": True}
+
+    def test_skip_batch_which_could_not_be_written(self):
+        # Arrange
+        users = []
+        for subscriber in SubscriberFactory.create_batch(2, gdpr_consent=True):
+            user = UserFactory(email=subscriber.email, gdpr_consent=False)
+            user.created = self.ONE_DAY_AGO
+            user.save()
+            users.append(user)
+        failing, updated = users
+        bulk_update = User.objects.bulk_update
+
+        def failing_bulk_update(objs, *args, **kwargs):
+            if any(user.pk == failing.pk for user in objs):
+                raise IntegrityError("Invalid user")
+            return bulk_update(objs, *args, **kwargs)
+
+        out = StringIO()
+        err = StringIO()
+
+        # Act
+        with patch.object(User.objects, "bulk_update", failing_bulk_update):
+            call_command(
+                "migrate_missing_data_from_subscriber_to_user",
+                stdout=out,
+                stderr=err,
+                **self.command_options,
+            )
+
+        # Assert
+        failing.refresh_from_db()
+        updated.refresh_from_db()
+        self.assertFalse(failing.gdpr_consent)
+        self.assertTrue(updated.gdpr_consent)
+        # both users of setUp are updated as well
+        self.assertIn("Updated users: 3", out.getvalue())
+        self.assertIn(f"from {failing.pk} to {failing.pk}", err.getvalue())
+
+
+class CommandsMigrateMissingDataFromSubscriberToUserReadAliasTestCase(
+    MigrateMissingDataFromSubscriberToUserTestCase
+):
+    command_options = {"read_alias": "default", "key_index": True}
+
+    def test_unknown_read_alias(self):
+        # Act & Assert
+        with self.assertRaises(CommandError):
+            call_command(
+                "migrate_missing_data_from_subscriber_to_user", read_alias="unknown"
+            )
+
+    def test_read_from_primary_when_replica_misses_watermark(self):
+        # Arrange
+        subscriber = SubscriberFactory(gdpr_consent=True)
+        user = UserFactory(email=subscriber.email, gdpr_consent=False)
+        user.created = self.ONE_DAY_AGO
+        user.save()
+        err = StringIO()
+
+        # Act
+        with patch(
+            "commons.replicas.missing_rows", return_value=[(Subscriber, subscriber.pk)]
+        ):
+            call_command(
+                "migrate_missing_data_from_subscriber_to_user",
+                stderr=err,
+                **self.command_options,
+            )
+
+        # Assert
+        user.refresh_from_db()
+        self.assertTrue(user.gdpr_consent)
+        self.assertIn(
+            f"Replica default has no subscriber.Subscriber {subscriber.pk} yet",
+            err.getvalue(),
+        )
+
+
+class CommandsMigrateMissingDataFromSubscriberToUserIncrementalTestCase(
+    MigrateMissingDataFromSubscriberToUserTestCase
+):
+    command_variants = [
+        {"incremental": True},
+        *[dict(options, incremental=True) for options in SQL_ENGINES],
+    ]
+
+    @for_each_variant
+    def test_update_only_users_changed_after_last_run(self):
+        # Arrange
+        old_subscriber = SubscriberFactory(gdpr_consent=True)
+        old_user = UserFactory(email=old_subscriber.email, gdpr_consent=False)
+        user = UserFactory(gdpr_consent=False)
+        User.objects.filter(pk__in=[old_user.pk, user.pk]).update(
+            created=self.MONTH_AGO
+        )
+        call_command(
+            "migrate_missing_data_from_subscriber_to_user", **self.command_options
+        )
+        User.objects.filter(pk=old_user.pk).update(gdpr_consent=False)
+        SubscriberFactory(email=user.email, gdpr_consent=True)
+
+        # Act
+        call_command(
+            "migrate_missing_data_from_subscriber_to_user", **self.command_options
+        )
+
+        # Assert
+        old_user.refresh_from_db()
+        user.refresh_from_db()
+        self.assertFalse(old_user.gdpr_consent)
+        self.assertTrue(user.gdpr_consent)
+
+
+@skipUnless(connection.vendor == "postgresql", "workers require PostgreSQL")
+class CommandsMigrateMissingDataFromSubscriberToUserWorkersTestCase(
+    TransactionTestCase
+):
+    def test_workers_update_all_users(self):
+        # Arrange
+        subscribers = SubscriberFactory.create_batch(5, gdpr_consent=True)
+        subscribers_sms = SubscriberSMSFactory.create_batch(5, gdpr_consent=True)
+        for subscriber in subscribers:
+            UserFactory(email=subscriber.email, gdpr_consent=False)
+        for subscriber_sms in subscribers_sms:
+            UserFactory(phone=subscriber_sms.phone, gdpr_consent=False)
+        User.objects.update(created=timezone.now() - timedelta(days=30))
+
+        # Act
+        call_command(
+            "migrate_missing_data_from_subscriber_to_user", workers=3, chunk_size=2
+        )
+
+        # Assert
+        self.assertEqual(User.objects.filter(gdpr_consent=True).count(), 10)
+
+
+@skipUnless(connection.vendor == "postgresql", "pipeline requires PostgreSQL")
+class CommandsMigrateMissingDataFromSubscriberToUserPipelineTestCase(
+    TransactionTestCase
+):
+    def test_pipeline_updates_all_users(self):
+        # Arrange
+        subscribers = SubscriberFactory.create_batch(5, gdpr_consent=True)
+        subscribers_sms = SubscriberSMSFactory.create_batch(5, gdpr_consent=True)
+        for subscriber in subscribers:
+            UserFactory(email=subscriber.email, gdpr_consent=False)
+        for subscriber_sms in subscribers_sms:
+            UserFactory(phone=subscriber_sms.phone, gdpr_consent=False)
+        UserFactory.create_batch(5, gdpr_consent=False)
+        User.objects.update(created=timezone.now() - timedelta(days=30))
+        out = StringIO()
+
+        # Act
+        call_command(
+            "migrate_missing_data_from_subscriber_to_user",
+            stream=True,
+            pipeline=True,
+            chunk_size=2,
+            batch_size=3,
+            stdout=out,
+        )
+
+        # Assert
+        self.assertEqual(User.objects.filter(gdpr_consent=True).count(), 10)
+        self.assertIn("Updated users: 10", out.getvalue())
+
+
+class CommandsConsentCacheTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_migration_invalidates_consents_of_created_users(self):
+        # Arrange
+        subscriber = SubscriberFactory(gdpr_consent=True)
+        get_consent(EMAIL, subscriber.email)
+
+        # Act
+        call_command("migrate_subscriber_to_user")
+
+        # Assert
+        self.assertTrue(get_consent(EMAIL, subscriber.email))
+
+    def test_update_invalidates_consents_of_updated_users(self):
+        for engine in ["python", "raw"]:
+            with self.subTest(engine=engine):
+                # Arrange
+                subscriber_sms = SubscriberSMSFactory(gdpr_consent=True)
+                user = UserFactory(phone=subscriber_sms.phone, gdpr_consent=False)
+                User.objects.filter(pk=user.pk).update(
+                    created=timezone.now() - timedelta(days=1)
+                )
+                phone = str(subscriber_sms.phone)
+                get_consent(PHONE, phone)
+
+                # Act
+                call_command(
+                    "migrate_missing_data_from_subscriber_to_user",
+                    engine=engine,
+                    stdout=StringIO(),
+                )
+
+                # Assert
+                self.assertTrue(get_consent(PHONE, phone))
+
+
+class CommandsExplainMigrationQueriesTestCase(TestCase):
+    def test_all_queries_use_indexes(self):
+        # Arrange
+        UserFactory.create_batch(5)
+        out = StringIO()
+
+        # Act
+        call_command("explain_migration_queries", fail_on_seq_scan=True, stdout=out)
+
+        # Assert
+        self.assertNotIn("SEQ SCAN", out.getvalue())
+
+
+class CommandsBenchmarkMigrationTestCase(TestCase):
+    def test_report_results_of_both_commands_for_every_size(self):
+        # Arrange
+        out = StringIO()
+
+        # Act
+        call_command(
+            "benchmark_migration",
+            sizes=[20, 40],
+            overlap=0.5,
+            duplicate_phones=0.1,
+            in_process=True,
+            stdout=out,
+        )
+
+        # Assert
+        results = json.loads(out.getvalue())
+        self.assertEqual(
+            [(result["command"], result["size"]) for result in results],
+            [
+                ("migrate_subscriber_to_user", 20),
+                ("migrate_missing_data_from_subscriber_to_user", 20),
+                ("migrate_subscriber_to_user", 40),
+                ("migrate_missing_data_from_subscriber_to_user", 40),
+            ],
+        )
+        self.assertEqual(results[2]["rows"], 80)
+        for result in results:
+            self.assertGreater(result["queries"], 0)
+            self.assertGreater(result["peak_rss_kb"], 0)
+            self.assertGreater(result["rows_per_second"], 0)
+        self.assertFalse(User.objects.exists())
+
+    def test_refuse_to_delete_existing_data(self):
+        # Arrange
+        SubscriberFactory()
+
+        # Act
+        with self.assertRaises(CommandError) as context:
+            call_command("benchmark_migration", sizes=[10], in_process=True)
+
+        # Assert
+        self.assertIn("--flush", str(context.exception))
+        self.assertTrue(Subscriber.objects.exists())
+
+    @patch("user.signals.invalidate_consents")
+    def test_delete_dataset_without_delete_signals(self, invalidate_consents):
+        # Arrange
+        cache.clear()
+        user = UserFactory(gdpr_consent=True)
+        SubscriberFactory()
+        get_consent(EMAIL, user.email)
+        invalidate_consents.reset_mock()
+
+        # Act
+        delete_dataset()
+
+        # Assert
+        invalidate_consents.assert_not_called()
+        self.assertFalse(dataset_exists())
+        self.assertIsNone(get_consent(EMAIL, user.email))
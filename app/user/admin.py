@@ -0,0 +1,16 @@
+from django.contrib import admin
+
+from commons.admin import LargeTableAdmin
+from user.models import Client, User
+
+
+@admin.register(User)
+class UserAdmin(LargeTableAdmin):
+    list_display = ("email", "phone", "gdpr_consent", "created")
+    search_fields = ("email", "phone")
+
+
+@admin.register(Client)
+class ClientAdmin(LargeTableAdmin):
+    list_display = ("email", "phone", "created")
+    search_fields = ("email", "phone")
@@ -0,0 +1,82 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from commons.utils import lookup_key, normalize_email, raw_value
+from user.models import User
+
+
+EMAIL = "email"
+PHONE = "phone"
+
+
+def consent_cache_key(field, value):
+    """
+    Return cache key of the consent of the user with the email or E.164 phone.
+    """
+    if field == EMAIL:
+        value = normalize_email(value)
+    digest = hashlib.md5(value.encode()).hexdigest()
+    return f"consent:{field}:{digest}"
+
+
+def get_consent(field, value):
+    """
+    Return consent of the user with the email in any case or the E.164 phone or
+    None if there is no such user.
+
+    Users are looked up by their unique keys. Results, including missing users,
+    are cached for CONSENT_CACHE_TIMEOUT seconds, so repeated lookups do not hit
+    the database.
+    """
+    key = consent_cache_key(field, value)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached[0]
+    lookup = {"email_key": normalize_email(value)} if field == EMAIL else {field: value}
+    gdpr_consent = (
+        User.objects.filter(**lookup).values_list("gdpr_consent", flat=True).first()
+    )
+    cache.set(key, (gdpr_consent,), settings.CONSENT_CACHE_TIMEOUT)
+    return gdpr_consent
+
+
+def consent_keys(users):
+    """
+    Return (email, phone) pairs of users as stored in the database.
+    """
+    return [(user.email, lookup_key(user.phone)) for user in users]
+
+
+def invalidate_consents(keys):
+    """
+    Remove cached consents of (email, phone) pairs.
+
+    Keys are removed at once and again after the commit of the current
+    transaction, so a lookup running before the commit can not cache the old
+    consent until the timeout.
+    """
+    cache_keys = list(_consent_cache_keys(keys))
+    if not cache_keys:
+        return
+    cache.delete_many(cache_keys)
+    transaction.on_commit(lambda: cache.delete_many(cache_keys))
+
+
+def _consent_cache_keys(keys):
+    for email, phone in keys:
+        if email:
+            yield consent_cache_key(EMAIL, email)
+        if phone:
+            yield consent_cache_key(PHONE, phone)
+
+
+def invalidate_user_consents(users):
+    """
+    Remove cached consents of users from the queryset.
+    """
+    invalidate_consents(
+        users.annotate(raw_phone=raw_value("phone")).values_list("email", "raw_phone")
+    )
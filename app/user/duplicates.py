@@ -0,0 +1,90 @@
+from django.db import transaction
+from django.db.models import Count, Max, Min
+from django.db.models.functions import Lower
+
+from commons.utils import lookup_key, normalize_email
+
+
+CHUNK_SIZE = 10000
+
+# unique keys of users in the order in which duplicates are merged
+KEY_FIELDS = ["email_key", "phone"]
+
+
+def fill_email_keys(model, chunk_size=CHUNK_SIZE):
+    """
+    Set email keys of all users of the model with one UPDATE per range of ids,
+    so every statement locks a bounded number of rows.
+    """
+    bounds = model.objects.aggregate(first=Min("pk"), last=Max("pk"))
+    if bounds["first"] is None:
+        return
+    for start in range(bounds["first"], bounds["last"] + 1, chunk_size):
+        model.objects.filter(pk__gte=start, pk__lt=start + chunk_size).update(
+            email_key=Lower("email")
+        )
+
+
+def merge_duplicate_users(model, on_drop=None):
+    """
+    Merge users of the model sharing a non blank key and return number of
+    removed users.
+
+    The oldest user of every group is kept with the consent of the newest one,
+    which consent lookups returned before keys were unique, and blank fields are
+    filled from the removed users. Emails are merged before phones, so a phone
+    shared by users which had the same email is merged as well. Other emails and
+    phones of removed users are passed to on_drop with the removed user and the
+    field, in the transaction of their group, which is merged atomically.
+    """
+    on_drop = on_drop or (lambda user, field: None)
+    removed = 0
+    for field in KEY_FIELDS:
+        keys = list(
+            model.objects.exclude(**{field: ""})
+            .values(field)
+            .annotate(users=Count("pk"))
+            .filter(users__gt=1)
+            .values_list(field, flat=True)
+        )
+        for key in keys:
+            with transaction.atomic():
+                users = list(
+                    model.objects.select_for_update()
+                    .filter(**{field: key})
+                    .order_by("created", "pk")
+                )
+                removed += _merge(model, users, on_drop)
+    return removed
+
+
+def _merge(model, users, on_drop):
+    kept, duplicates = users[0], users[1:]
+    if not duplicates:
+        return 0
+    kept.gdpr_consent = users[-1].gdpr_consent
+    for duplicate in duplicates:
+        kept.email = kept.email or duplicate.email
+        kept.phone = kept.phone or duplicate.phone
+    model.objects.filter(pk__in=[user.pk for user in duplicates]).delete()
+    kept.save()
+    for duplicate, field in _dropped(kept, duplicates):
+        on_drop(duplicate, field)
+    return len(duplicates)
+
+
+def _dropped(kept, duplicates):
+    """
+    Return (user, field) pairs of contacts of duplicates missing in the kept
+    user.
+    """
+    kept_keys = {"email": normalize_email(kept.email), "phone": lookup_key(kept.phone)}
+    return [
+        (duplicate, field)
+        for duplicate in duplicates
+        for field, key in [
+            ("email", normalize_email(duplicate.email)),
+            ("phone", lookup_key(duplicate.phone)),
+        ]
+        if key and key != kept_keys[field]
+    ]
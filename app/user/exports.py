@@ -0,0 +1,77 @@
+import csv
+import io
+import json
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from commons.pagination import watermark_chunks
+from commons.utils import raw_value
+from user.models import User
+
+
+CHUNK_SIZE = 5000
+
+FORMAT_CSV = "csv"
+FORMAT_NDJSON = "ndjson"
+CONTENT_TYPES = {FORMAT_CSV: "text/csv", FORMAT_NDJSON: "application/x-ndjson"}
+
+FIELDS = ["email", "phone", "gdpr_consent", "created"]
+
+
+def parse_created(value):
+    """
+    Return aware datetime parsed from ISO 8601 string or None for empty value.
+
+    Raise ValueError if the value is not a valid datetime.
+    """
+    if not value:
+        return None
+    created = parse_datetime(value)
+    if created is None:
+        raise ValueError(f"Invalid datetime: {value}")
+    if timezone.is_naive(created):
+        created = timezone.make_aware(created)
+    return created
+
+
+def export_rows(created_from=None, created_to=None):
+    """
+    Return queryset of raw values of exported users created in [from, to).
+    """
+    users = User.objects.all()
+    if created_from is not None:
+        users = users.filter(created__gte=created_from)
+    if created_to is not None:
+        users = users.filter(created__lt=created_to)
+    return users.annotate(raw_phone=raw_value("phone")).values_list(
+        "pk", "email", "raw_phone", "gdpr_consent", "created", named=True
+    )
+
+
+def export_lines(rows, export_format, chunk_size=CHUNK_SIZE):
+    """
+    Yield text of users from rows in CSV or NDJSON format, a chunk at once.
+
+    Rows are walked with keyset pagination by (created, pk), so only one chunk
+    is kept in memory however many users are exported.
+    """
+    if export_format == FORMAT_CSV:
+        yield _csv_text([FIELDS])
+    for chunk in watermark_chunks(rows, chunk_size):
+        values = [
+            [row.email, row.raw_phone, row.gdpr_consent, row.created.isoformat()]
+            for row in chunk
+        ]
+        if export_format == FORMAT_CSV:
+            yield _csv_text(values)
+        else:
+            yield "".join(
+                json.dumps(dict(zip(FIELDS, value))) + "\n" for value in values
+            )
+
+
+def _csv_text(values):
+    text = io.StringIO()
+    csv.writer(text).writerows(values)
+    return text.getvalue()
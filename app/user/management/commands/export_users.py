@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from user.exports import (
+    CHUNK_SIZE,
+    FORMAT_CSV,
+    FORMAT_NDJSON,
+    export_lines,
+    export_rows,
+    parse_created,
+)
+
+
+class Command(BaseCommand):
+    help = "Command responsible for streaming users to a CSV or NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format",
+            choices=[FORMAT_CSV, FORMAT_NDJSON],
+            default=FORMAT_CSV,
+            help="Format of exported users.",
+        )
+        parser.add_argument(
+            "--created-from",
+            help="Export only users created at or after this ISO 8601 datetime.",
+        )
+        parser.add_argument(
+            "--created-to",
+            help="Export only users created before this ISO 8601 datetime.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=CHUNK_SIZE,
+            help="Number of users read with one query.",
+        )
+        parser.add_argument(
+            "--output",
+            default="-",
+            help="File to write users to, stdout by default.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            created_from = parse_created(options["created_from"])
+            created_to = parse_created(options["created_to"])
+        except ValueError as error:
+            raise CommandError(str(error))
+        lines = export_lines(
+            export_rows(created_from, created_to),
+            options["format"],
+            options["chunk_size"],
+        )
+        self._write(lines, options["output"])
+
+    def _write(self, lines, path):
+        if path == "-":
+            for text in lines:
+                self.stdout.write(text)
+            return
+        with open(path, "w", newline="") as output:
+            output.writelines(lines)
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.6 on 2026-10-18 15:02
+
+from django.db import migrations, models
+
+from commons.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('user', '0001_initial'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(fields=['created', 'id'], name='user_created_id_idx'),
+        ),
+    ]
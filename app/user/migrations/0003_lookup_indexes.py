@@ -0,0 +1,29 @@
+# Generated by Django 2.2.6 on 2026-10-18 15:04
+
+from django.db import migrations, models
+
+from commons.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('user', '0002_created_watermark'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='client',
+            index=models.Index(fields=['phone'], name='client_phone_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(fields=['email'], name='user_email_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(fields=['phone'], name='user_phone_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.6 on 2026-10-18 15:31
+
+from django.db import migrations, models
+
+from commons.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('user', '0003_lookup_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='client',
+            index=models.Index(fields=['created', 'id'], name='client_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.6 on 2026-10-18 15:39
+
+import commons.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0004_client_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='email_key',
+            field=commons.fields.EmailKeyField(default='', editable=False, max_length=254, source='email'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 2.2.6 on 2026-10-18 15:41
+
+from django.db import migrations, models
+from django.utils import timezone
+
+from commons.operations import AddConstraintConcurrently
+from user.duplicates import fill_email_keys, merge_duplicate_users
+
+
+def merge_duplicates(apps, schema_editor):
+    User = apps.get_model('user', 'User')
+    MigrationRun = apps.get_model('subscriber', 'MigrationRun')
+    MigrationConflict = apps.get_model('subscriber', 'MigrationConflict')
+    fill_email_keys(User)
+    # the run is only created when contacts of removed users are dropped
+    runs = []
+
+    def record_dropped(user, field):
+        if not runs:
+            runs.append(MigrationRun.objects.create(command='merge_duplicate_users'))
+        MigrationConflict.objects.create(
+            run=runs[0],
+            source=User._meta.label,
+            source_id=user.pk,
+            key=str(getattr(user, field)),
+            reason='merged_duplicate',
+        )
+
+    merge_duplicate_users(User, record_dropped)
+    for run in runs:
+        run.finished = timezone.now()
+        run.save(update_fields=['finished'])
+
+
+class Migration(migrations.Migration):
+
+    # keys are filled in short transactions and the unique indexes are built
+    # concurrently, so every step can be repeated after a failure
+    atomic = False
+
+    dependencies = [
+        ('user', '0005_user_email_key'),
+        ('subscriber', '0006_migration_conflict_merged_duplicate'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        AddConstraintConcurrently(
+            model_name='user',
+            constraint=models.UniqueConstraint(condition=models.Q(_negated=True, email_key=''), fields=('email_key',), name='user_email_key_uniq'),
+        ),
+        AddConstraintConcurrently(
+            model_name='user',
+            constraint=models.UniqueConstraint(condition=models.Q(_negated=True, phone=''), fields=('phone',), name='user_phone_uniq'),
+        ),
+    ]
@@ -2,15 +2,42 @@ from django.db import models
 
 from phonenumber_field.modelfields import PhoneNumberField
 
+from commons.fields import EmailKeyField
 from commons.models import AbstractTimeStampedModel
 
 
 class User(AbstractTimeStampedModel):
     email = models.EmailField()
+    # lower case email, unique like the phone stored as E.164
+    email_key = EmailKeyField(source="email")
     phone = PhoneNumberField()
     gdpr_consent = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["created", "id"], name="user_created_id_idx"),
+            models.Index(fields=["email"], name="user_email_idx"),
+            models.Index(fields=["phone"], name="user_phone_idx"),
+        ]
+        constraints = [
+            # users migrated from one channel have the other field blank
+            models.UniqueConstraint(
+                fields=["email_key"],
+                condition=~models.Q(email_key=""),
+                name="user_email_key_uniq",
+            ),
+            models.UniqueConstraint(
+                fields=["phone"], condition=~models.Q(phone=""), name="user_phone_uniq"
+            ),
+        ]
+
 
 class Client(AbstractTimeStampedModel):
     email = models.EmailField(unique=True)
     phone = PhoneNumberField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created", "id"], name="client_created_id_idx"),
+            models.Index(fields=["phone"], name="client_phone_idx"),
+        ]
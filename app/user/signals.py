@@ -0,0 +1,34 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from commons.utils import lookup_key
+from user.consents import invalidate_consents
+from user.models import User
+
+
+KEY_FIELDS = ("email", "phone")
+
+
+def _loaded_keys(instance):
+    # deferred fields are not loaded just to invalidate their keys
+    return instance.__dict__.get("email"), instance.__dict__.get("phone")
+
+
+@receiver(pre_save, sender=User)
+def remember_consent_keys(sender, instance, update_fields=None, **kwargs):
+    # keys stored before the save are invalidated as well when they are changed
+    adding = instance._state.adding
+    if adding or (update_fields is not None and update_fields.isdisjoint(KEY_FIELDS)):
+        return
+    instance._consent_keys = (
+        sender.objects.filter(pk=instance.pk).values_list(*KEY_FIELDS).first()
+    )
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_consent(sender, instance, **kwargs):
+    keys = [_loaded_keys(instance), instance.__dict__.pop("_consent_keys", None)]
+    invalidate_consents(
+        (email, lookup_key(phone)) for email, phone in filter(None, keys)
+    )
@@ -0,0 +1,141 @@
+from datetime import date, datetime
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from mock import patch
+
+from commons.admin import EstimatedCountPaginator, RangeDatesQuerySet
+from subscriber.tests.factories import SubscriberFactory, SubscriberSMSFactory
+from user.models import User
+
+from .factories import ClientFactory, UserFactory
+
+
+class LargeTableAdminTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self._users = UserFactory.create_batch(3)
+        admin = get_user_model().objects.create_superuser(
+            "admin", "admin@test.pl", "password"
+        )
+        self.client.force_login(admin)
+
+    def _changelist(self, model, query=None):
+        url = reverse(
+            f"admin:{model._meta.app_label}_{model._meta.model_name}_changelist"
+        )
+        return self.client.get(url, query or {})
+
+    def test_changelists_of_all_models(self):
+        # Arrange
+        ClientFactory.create()
+        SubscriberFactory.create()
+        SubscriberSMSFactory.create()
+
+        for name in [
+            "user_user",
+            "user_client",
+            "subscriber_subscriber",
+            "subscriber_subscribersms",
+        ]:
+            with self.subTest(name=name):
+                # Act
+                response = self.client.get(reverse(f"admin:{name}_changelist"))
+
+                # Assert
+                self.assertEqual(response.status_code, 200)
+
+    def test_search_users_by_exact_email(self):
+        # Act
+        response = self._changelist(User, {"q": self._users[1].email})
+
+        # Assert
+        self.assertEqual(list(response.context["cl"].result_list), [self._users[1]])
+
+    def test_search_users_by_phone_in_e164_format(self):
+        # Arrange
+        # random phones of the factory are not always valid numbers
+        user = UserFactory(phone="+48600100200")
+
+        # Act
+        response = self._changelist(User, {"q": " +48 600 100 200 "})
+
+        # Assert
+        self.assertEqual(list(response.context["cl"].result_list), [user])
+
+    def test_not_search_users_by_part_of_email(self):
+        # Act
+        response = self._changelist(User, {"q": self._users[0].email[:5]})
+
+        # Assert
+        self.assertEqual(list(response.context["cl"].result_list), [])
+
+    def test_drill_down_by_created(self):
+        # Arrange
+        User.objects.filter(pk=self._users[0].pk).update(
+            created=timezone.make_aware(datetime(2019, 5, 1))
+        )
+
+        # Act
+        response = self._changelist(User, {"created__year": 2019})
+
+        # Assert
+        self.assertEqual(list(response.context["cl"].result_list), [self._users[0]])
+
+    def test_not_count_all_rows(self):
+        # Act
+        response = self._changelist(User)
+
+        # Assert
+        self.assertIsNone(response.context["cl"].full_result_count)
+
+
+class RangeDatesQuerySetTestCase(TestCase):
+    def test_return_periods_between_first_and_last_date(self):
+        # Arrange
+        for created in [datetime(2019, 11, 30), datetime(2020, 2, 2)]:
+            user = UserFactory.create()
+            User.objects.filter(pk=user.pk).update(created=timezone.make_aware(created))
+        users = RangeDatesQuerySet(model=User)
+
+        # Act
+        years = users.dates("created", "year")
+        months = users.dates("created", "month", order="DESC")
+        days = users.filter(created__month=2).dates("created", "day")
+
+        # Assert
+        self.assertEqual(years, [date(2019, 1, 1), date(2020, 1, 1)])
+        self.assertEqual(
+            months,
+            [date(2020, 2, 1), date(2020, 1, 1), date(2019, 12, 1), date(2019, 11, 1)],
+        )
+        self.assertEqual(days, [date(2020, 2, 2)])
+
+
+class EstimatedCountPaginatorTestCase(TestCase):
+    def test_count_small_querysets_exactly(self):
+        # Arrange
+        UserFactory.create_batch(3)
+
+        # Act
+        paginator = EstimatedCountPaginator(User.objects.order_by("pk"), 2)
+
+        # Assert
+        self.assertEqual(paginator.count, 3)
+
+    @skipUnless(connection.vendor == "postgresql", "estimates require PostgreSQL")
+    def test_use_estimate_of_large_tables(self):
+        # Arrange
+        paginator = EstimatedCountPaginator(User.objects.order_by("pk"), 2)
+
+        # Act
+        with patch.object(EstimatedCountPaginator, "_estimate", return_value=10**6):
+            count = paginator.count
+
+        # Assert
+        self.assertEqual(count, 10**6)
@@ -0,0 +1,69 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from freezegun import freeze_time
+
+from user.models import User
+
+from .factories import UserFactory
+
+
+class CommandsExportUsersTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        # users created at the same time are paginated by primary key
+        with freeze_time("2021-01-01"):
+            self._users = UserFactory.create_batch(5)
+
+    def test_export_users_as_csv_to_stdout(self):
+        # Arrange
+        out = StringIO()
+
+        # Act
+        call_command("export_users", chunk_size=2, stdout=out)
+
+        # Assert
+        rows = list(csv.reader(StringIO(out.getvalue())))
+        self.assertEqual(rows[0], ["email", "phone", "gdpr_consent", "created"])
+        self.assertEqual([row[0] for row in rows[1:]], [u.email for u in self._users])
+
+    def test_export_users_created_in_range_as_ndjson_to_file(self):
+        # Arrange
+        User.objects.filter(pk=self._users[0].pk).update(
+            created=timezone.now() - timedelta(days=1)
+        )
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        output = os.path.join(directory, "users.ndjson")
+
+        # Act
+        call_command(
+            "export_users",
+            format="ndjson",
+            created_to="2021-01-02T00:00:00",
+            chunk_size=2,
+            output=output,
+        )
+
+        # Assert
+        with open(output) as file:
+            rows = [json.loads(line) for line in file]
+        self.assertEqual(
+            [row["email"] for row in rows], [u.email for u in self._users[1:]]
+        )
+        self.assertEqual(rows[0]["phone"], str(self._users[1].phone))
+        self.assertEqual(rows[0]["created"], "2021-01-01T00:00:00+00:00")
+
+    def test_reject_invalid_created_range(self):
+        # Act
+        with self.assertRaises(CommandError):
+            call_command("export_users", created_from="tomorrow")
@@ -0,0 +1,122 @@
+from datetime import timedelta
+
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.test import TestCase
+from django.utils import timezone
+
+from mock import Mock
+
+from user.duplicates import fill_email_keys, merge_duplicate_users
+from user.models import User
+
+from .factories import UserFactory
+
+
+class UserKeysTestCase(TestCase):
+    def test_set_email_key_on_save_and_bulk_create(self):
+        # Act
+        saved = UserFactory(email="Saved@Test.pl")
+        User.objects.bulk_create([User(email="Created@Test.pl")])
+
+        # Assert
+        self.assertEqual(saved.email_key, "saved@test.pl")
+        self.assertTrue(User.objects.filter(email_key="created@test.pl").exists())
+
+    def test_reject_email_differing_only_in_case(self):
+        # Arrange
+        UserFactory(email="user@test.pl")
+
+        # Act & Assert
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            UserFactory(email="User@Test.pl")
+
+    def test_reject_the_same_phone(self):
+        # Arrange
+        UserFactory(phone="+48600100200")
+
+        # Act & Assert
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            UserFactory(phone="+48600100200")
+
+    def test_allow_many_users_without_email_or_phone(self):
+        # Act
+        UserFactory.create_batch(2, email="")
+        UserFactory.create_batch(2, phone="")
+
+        # Assert
+        self.assertEqual(User.objects.count(), 4)
+
+
+class MergeDuplicateUsersTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        # duplicates are created as they were before the keys were unique
+        with connection.cursor() as cursor:
+            for name in ["user_email_key_uniq", "user_phone_uniq"]:
+                cursor.execute(f"DROP INDEX {connection.ops.quote_name(name)}")
+
+    def _user(self, days_ago, **kwargs):
+        user = UserFactory(**kwargs)
+        User.objects.filter(pk=user.pk).update(
+            created=timezone.now() - timedelta(days=days_ago)
+        )
+        return user
+
+    def test_fill_email_keys(self):
+        # Arrange
+        user = UserFactory(email="User@Test.pl")
+        User.objects.update(email_key="")
+
+        # Act
+        fill_email_keys(User, chunk_size=1)
+
+        # Assert
+        user.refresh_from_db()
+        self.assertEqual(user.email_key, "user@test.pl")
+
+    def test_keep_the_oldest_user_with_the_newest_consent(self):
+        # Arrange
+        kept = self._user(30, email="User@Test.pl", phone="", gdpr_consent=False)
+        self._user(7, email="user@test.pl", phone="+48600100200", gdpr_consent=True)
+        self._user(1, email="", phone="+48600100200", gdpr_consent=True)
+        other = self._user(1, gdpr_consent=False)
+
+        # Act
+        removed = merge_duplicate_users(User)
+
+        # Assert
+        self.assertEqual(removed, 2)
+        self.assertEqual(
+            list(User.objects.order_by("pk").values_list("pk", flat=True)),
+            [kept.pk, other.pk],
+        )
+        kept.refresh_from_db()
+        self.assertEqual(kept.email, "User@Test.pl")
+        self.assertEqual(str(kept.phone), "+48600100200")
+        self.assertTrue(kept.gdpr_consent)
+
+    def test_report_contacts_dropped_with_removed_users(self):
+        # Arrange
+        self._user(30, email="user@test.pl", phone="")
+        self._user(7, email="User@Test.pl", phone="+48600100200")
+        dropped = self._user(1, email="user@test.pl", phone="+48600100300")
+        on_drop = Mock()
+
+        # Act
+        merge_duplicate_users(User, on_drop)
+
+        # Assert
+        on_drop.assert_called_once_with(dropped, "phone")
+
+    def test_keep_group_intact_when_its_merge_fails(self):
+        # Arrange
+        self._user(30, email="user@test.pl", phone="+48600100200")
+        self._user(1, email="user@test.pl", phone="+48600100300")
+        on_drop = Mock(side_effect=DatabaseError)
+
+        # Act
+        with self.assertRaises(DatabaseError):
+            merge_duplicate_users(User, on_drop)
+
+        # Assert
+        self.assertEqual(User.objects.count(), 2)
@@ -0,0 +1,250 @@
+import json
+from datetime import timedelta
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from commons.sharding import run_in_processes
+from user.consents import EMAIL, get_consent, invalidate_consents
+from user.models import User
+
+from .factories import UserFactory
+
+
+class ConsentViewTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        # random phones of the factory are not always valid numbers
+        self._user = UserFactory(phone="+48600100200", gdpr_consent=True)
+        admin = get_user_model().objects.create_superuser(
+            "admin", "admin@test.pl", "password"
+        )
+        self.client.force_login(admin)
+        self._url = reverse("user:consent")
+
+    def test_return_consent_of_user_by_email(self):
+        # Act
+        response = self.client.get(self._url, {"email": self._user.email})
+
+        # Assert
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(), {"email": self._user.email, "gdpr_consent": True}
+        )
+
+    def test_return_consent_of_user_by_phone(self):
+        # Act
+        response = self.client.get(self._url, {"phone": str(self._user.phone)})
+
+        # Assert
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json(), {"phone": str(self._user.phone), "gdpr_consent": True}
+        )
+
+    def test_return_consent_of_user_by_email_in_any_case(self):
+        # Act
+        response = self.client.get(self._url, {"email": self._user.email.upper()})
+
+        # Assert
+        self.assertTrue(response.json()["gdpr_consent"])
+
+    def test_return_not_found_for_unknown_user(self):
+        # Act
+        response = self.client.get(self._url, {"email": "unknown@test.pl"})
+
+        # Assert
+        self.assertEqual(response.status_code, 404)
+
+    def test_reject_invalid_queries(self):
+        for query in [
+            {},
+            {"email": self._user.email, "phone": str(self._user.phone)},
+            {"phone": "123"},
+            {"phone": str(self._user.phone)[1:]},
+        ]:
+            with self.subTest(query=query):
+                # Act
+                response = self.client.get(self._url, query)
+
+                # Assert
+                self.assertEqual(response.status_code, 400)
+
+    def test_cache_consent(self):
+        # Arrange
+        self.client.get(self._url, {"email": self._user.email})
+
+        # Act
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self._url, {"email": self._user.email})
+
+        # Assert
+        self.assertTrue(response.json()["gdpr_consent"])
+        self.assertFalse([query for query in context if '"user_user"' in query["sql"]])
+
+    def test_invalidate_cache_when_user_is_saved(self):
+        # Arrange
+        self.client.get(self._url, {"email": self._user.email})
+        user = User.objects.get(pk=self._user.pk)
+        user.gdpr_consent = False
+
+        # Act
+        user.save()
+
+        # Assert
+        response = self.client.get(self._url, {"email": self._user.email})
+        self.assertFalse(response.json()["gdpr_consent"])
+
+    def test_invalidate_cache_of_previous_email_when_it_is_changed(self):
+        # Arrange
+        email = self._user.email
+        self.client.get(self._url, {"email": email})
+        user = User.objects.get(pk=self._user.pk)
+        user.email = "changed@test.pl"
+
+        # Act
+        user.save()
+
+        # Assert
+        response = self.client.get(self._url, {"email": email})
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalidate_cache_when_user_is_created_or_deleted(self):
+        # Arrange
+        self.client.get(self._url, {"email": "new@test.pl"})
+
+        # Act
+        UserFactory(email="new@test.pl", gdpr_consent=True)
+        created = self.client.get(self._url, {"email": "new@test.pl"})
+        self._user.delete()
+        deleted = self.client.get(self._url, {"email": self._user.email})
+
+        # Assert
+        self.assertEqual(created.status_code, 200)
+        self.assertEqual(deleted.status_code, 404)
+
+    def test_not_read_stored_keys_when_saving_other_fields(self):
+        # Arrange
+        self.client.get(self._url, {"email": self._user.email})
+        user = User.objects.get(pk=self._user.pk)
+        user.gdpr_consent = False
+
+        # Act
+        with CaptureQueriesContext(connection) as context:
+            user.save(update_fields=["gdpr_consent"])
+
+        # Assert
+        users = [query["sql"] for query in context if '"user_user"' in query["sql"]]
+        self.assertEqual(len(users), 1)
+        self.assertTrue(users[0].startswith('UPDATE "user_user"'))
+        response = self.client.get(self._url, {"email": self._user.email})
+        self.assertFalse(response.json()["gdpr_consent"])
+
+    def test_require_permission(self):
+        # Arrange
+        self.client.logout()
+
+        # Act
+        response = self.client.get(self._url, {"email": self._user.email})
+
+        # Assert
+        self.assertEqual(response.status_code, 403)
+
+
+def update_consent(email, gdpr_consent):
+    User.objects.filter(email=email).update(gdpr_consent=gdpr_consent)
+    invalidate_consents([(email, None)])
+
+
+@skipUnless(connection.vendor == "postgresql", "processes require PostgreSQL")
+class ConsentCacheProcessesTestCase(TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def test_invalidate_consent_cached_by_another_process(self):
+        # Arrange
+        user = UserFactory(phone="+48600100200", gdpr_consent=True)
+        get_consent(EMAIL, user.email)
+
+        # Act
+        run_in_processes(update_consent, [(user.email, False)], 1)
+
+        # Assert
+        self.assertFalse(get_consent(EMAIL, user.email))
+
+
+class ExportViewTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        self._users = UserFactory.create_batch(3)
+        admin = get_user_model().objects.create_superuser(
+            "admin", "admin@test.pl", "password"
+        )
+        self.client.force_login(admin)
+        self._url = reverse("user:export")
+
+    def test_stream_users_as_csv(self):
+        # Act
+        response = self.client.get(self._url)
+
+        # Assert
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "email,phone,gdpr_consent,created")
+        self.assertEqual(
+            lines[1:],
+            [
+                f"{user.email},{user.phone},False,{user.created.isoformat()}"
+                for user in self._users
+            ],
+        )
+
+    def test_stream_users_created_in_range_as_ndjson(self):
+        # Arrange
+        User.objects.filter(pk=self._users[0].pk).update(
+            created=timezone.now() - timedelta(days=2)
+        )
+        created_from = (timezone.now() - timedelta(days=1)).isoformat()
+
+        # Act
+        response = self.client.get(
+            self._url, {"format": "ndjson", "created_from": created_from}
+        )
+
+        # Assert
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).decode().splitlines()
+        ]
+        self.assertEqual(
+            [row["email"] for row in rows], [user.email for user in self._users[1:]]
+        )
+
+    def test_reject_invalid_queries(self):
+        for query in [{"format": "xml"}, {"created_to": "yesterday"}]:
+            with self.subTest(query=query):
+                # Act
+                response = self.client.get(self._url, query)
+
+                # Assert
+                self.assertEqual(response.status_code, 400)
+
+    def test_require_permission(self):
+        # Arrange
+        self.client.logout()
+
+        # Act
+        response = self.client.get(self._url)
+
+        # Assert
+        self.assertEqual(response.status_code, 403)
@@ -0,0 +1,11 @@
+from django.urls import path
+
+from user import views
+
+
+app_name = "user"
+
+urlpatterns = [
+    path("consent/", views.consent, name="consent"),
+    path("export/", views.export, name="export"),
+]
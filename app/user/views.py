@@ -0,0 +1,67 @@
+from django.contrib.auth.decorators import permission_required
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+
+from phonenumber_field.phonenumber import to_python
+
+from user.consents import EMAIL, PHONE, get_consent
+from user.exports import (
+    CONTENT_TYPES,
+    FORMAT_CSV,
+    export_lines,
+    export_rows,
+    parse_created,
+)
+
+
+@require_GET
+@permission_required("user.view_user", raise_exception=True)
+def consent(request):
+    """
+    Return consent of the user with the email or E.164 phone from the query.
+    """
+    try:
+        field, value = _lookup(request.GET.get(EMAIL), request.GET.get(PHONE))
+    except ValueError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+    gdpr_consent = get_consent(field, value)
+    if gdpr_consent is None:
+        return JsonResponse({"error": "User not found."}, status=404)
+    return JsonResponse({field: value, "gdpr_consent": gdpr_consent})
+
+
+def _lookup(email, phone):
+    """
+    Return field and value of the consent lookup by email or by E.164 phone.
+    """
+    if bool(email) == bool(phone):
+        raise ValueError("Pass either email or phone.")
+    if email:
+        return EMAIL, email
+    number = to_python(phone)
+    if not phone.startswith("+") or not number or not number.is_valid():
+        raise ValueError("Phone must be in E.164 format.")
+    return PHONE, number.as_e164
+
+
+@require_GET
+@permission_required("user.view_user", raise_exception=True)
+def export(request):
+    """
+    Stream users created in the optional [created_from, created_to) range as CSV
+    or NDJSON.
+    """
+    export_format = request.GET.get("format", FORMAT_CSV)
+    if export_format not in CONTENT_TYPES:
+        return JsonResponse({"error": "Format must be csv or ndjson."}, status=400)
+    try:
+        created_from = parse_created(request.GET.get("created_from"))
+        created_to = parse_created(request.GET.get("created_to"))
+    except ValueError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+    response = StreamingHttpResponse(
+        export_lines(export_rows(created_from, created_to), export_format),
+        content_type=CONTENT_TYPES[export_format],
+    )
+    response["Content-Disposition"] = f'attachment; filename="users.{export_format}"'
+    return response